@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import BuildCache, DEFAULT_MAX_BYTES
+from pipeline import BuildError, BuildResult, build
+import tracing
+
+
+def build_one(spec, backend = "tools", cache_dir = None, cache_size = DEFAULT_MAX_BYTES):
+	#a forked worker starts with a copy of the parent's trace events, they are not ours to return
+	tracing.drain()
+	cache = BuildCache(cache_dir, cache_size) if cache_dir else None
+	try:
+		result = build(spec, backend = backend, cache = cache)
+	except Exception as e:
+		result = BuildResult(spec.name)
+		result.errors.append(BuildError("crash", f"Build crashed: {type(e).__name__}: {e}"))
+	result.trace_events = tracing.drain()
+	return result
+
+
+def _duplicate_result(spec):
+	result = BuildResult(spec.name)
+	result.errors.append(BuildError(
+			"duplicate", f"Material {spec.name} is built more than once in this batch (outputs would collide)"
+	))
+	return result
+
+
+def build_all(
+		specs: list, workers: int = None, backend = "tools", cache_dir = None, cache_size = DEFAULT_MAX_BYTES,
+		progress = None
+):
+	#results come back (and progress is reported) in the order of specs, whatever order the workers finish in
+	workers = workers or os.cpu_count() or 1
+	seen = set()
+	results = list()
+	with ProcessPoolExecutor(max_workers = min(workers, max(1, len(specs)))) as pool:
+		futures = list()
+		for spec in specs:
+			key = (os.path.normcase(os.path.abspath(spec.game_dir)), spec.name.lower())
+			if key in seen:
+				futures.append(None)
+				continue
+			seen.add(key)
+			futures.append(pool.submit(build_one, spec, backend, cache_dir, cache_size))
+
+		for i, (spec, future) in enumerate(zip(specs, futures)):
+			if future is None:
+				result = _duplicate_result(spec)
+			else:
+				try:
+					result = future.result()
+					tracing.extend(result.trace_events)
+				except BrokenProcessPool as e:
+					result = BuildResult(spec.name)
+					result.errors.append(BuildError("worker", f"Build worker died: {e}"))
+			results.append(result)
+			if progress:
+				progress(i, len(specs), result)
+	return results
+
@@ -0,0 +1,339 @@
+import sys
+import os
+from pathlib import Path
+import json
+import time
+import shutil
+import tempfile
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from images import TGA, write_tga
+from core import TF2Output
+from pipeline import MaterialSpec, SequenceSpec, BuildControl, build, write_vmt
+import layout
+import sheet
+import mips
+import vtf
+import tools
+
+BENCH_VERSION = 1
+STAGES = ["scan", "layout", "composite", "mips", "compress", "write", "export"]
+#(frames, size, alpha coverage, rle), size (min, max) gives every frame a random width and height in that range
+PRESETS = {
+		"quick": [
+				(10, 32, 1.0, False),
+				(100, 64, 0.5, True),
+				(16, 256, 0.5, False),
+				(300, (8, 40), 1.0, False),
+		],
+		"full":  [
+				(10, 32, 1.0, False),
+				(100, 128, 1.0, False),
+				(100, 128, 0.25, True),
+				(1000, 32, 0.5, False),
+				(1000, 32, 0.5, True),
+				(5000, 32, 0.5, False),
+				(16, 512, 1.0, False),
+				(16, 512, 0.25, True),
+				(4, 1024, 0.5, False),
+				(1000, (8, 40), 0.5, False),
+				(3000, (8, 40), 0.5, False),
+		],
+}
+#stage changes smaller than this are noise, whatever the ratio
+MIN_DELTA = 0.005
+
+
+def case_name(count: int, size, alpha: float, rle: bool):
+	size = f"{size[0]}-{size[1]}" if isinstance(size, (tuple, list)) else size
+	return f"n{count}-s{size}-a{alpha:g}-{'rle' if rle else 'raw'}"
+
+
+def synthetic_frame(rng, size, alpha: float):
+	#8x8 blocks of random colour (so rle has runs to find) inside an opaque rectangle covering `alpha` of the frame
+	#size: side of a square frame or the (min, max) range of a random width and height
+	if isinstance(size, (tuple, list)):
+		width, height = (int(x) for x in rng.integers(size[0], size[1] + 1, 2))
+	else:
+		width = height = size
+	blocks_x, blocks_y = -(-width // 8), -(-height // 8)
+	colors = rng.integers(0, 256, (blocks_y, blocks_x, 4), np.uint8)
+	pixels = np.ascontiguousarray(colors.repeat(8, 0).repeat(8, 1)[:height, :width])
+	pixels[..., 3] = 0
+	side_x = max(1, int(round(width * alpha ** 0.5)))
+	side_y = max(1, int(round(height * alpha ** 0.5)))
+	start_x, start_y = (width - side_x) // 2, (height - side_y) // 2
+	pixels[start_y:start_y + side_y, start_x:start_x + side_x, 3] = 255
+	return pixels
+
+
+def generate(directory: Path, count: int, size, alpha: float, rle: bool, seed: int = 0):
+	directory.mkdir(parents = True, exist_ok = True)
+	rng = np.random.default_rng(seed)
+	paths = list()
+	for i in range(count):
+		path = directory / f"frame{i:05d}.tga"
+		write_tga(path, synthetic_frame(rng, size, alpha), rle = rle)
+		paths.append(str(path))
+	return paths
+
+
+def peak_rss():
+	#bytes, None where neither resource nor psutil is available
+	try:
+		import resource
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak if sys.platform == "darwin" else peak * 1024
+	except ImportError:
+		pass
+	try:
+		import psutil
+		info = psutil.Process().memory_info()
+		return getattr(info, "peak_wset", info.rss)
+	except ImportError:
+		return None
+
+
+def _timed(function, repeat: int):
+	#best of repeat runs, returns (seconds, last result)
+	best = None
+	result = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best, result
+
+
+def _stage(seconds: float, frames: int, nbytes: int):
+	return {
+			"seconds":       round(seconds, 6),
+			"frames_per_s":  round(frames / seconds, 2) if seconds else None,
+			"mb_per_s":      round(nbytes / seconds / 1e6, 2) if seconds and nbytes else None,
+			"bytes":         nbytes,
+	}
+
+
+def run_case(
+		paths: list, work: str, repeat: int = 3, quality: str = "fast", filter_name: str = "box", workers: int = None,
+		export = False
+):
+	stages = dict()
+	input_bytes = sum(os.path.getsize(path) for path in paths)
+	start_rss = peak_rss()
+
+	seconds, headers = _timed(lambda: [TGA(path) for path in paths], repeat)
+	stages["scan"] = _stage(seconds, len(paths), 18 * len(paths))
+
+	sizes = [(tga.width, tga.height) for tga in headers]
+	try:
+		seconds, _ = _timed(lambda: layout.pack(sizes), repeat)
+	except layout.PackError as e:
+		stages["layout"] = {"skipped": str(e)}
+		return {"stages": stages, "peak_rss": peak_rss(), "start_rss": start_rss}
+	stages["layout"] = _stage(seconds, len(paths), 0)
+
+	sequences = [
+			sheet.SheetSequence(i // 100, True, [(path, 1.0) for path in paths[i:i + 100]])
+			for i in range(0, len(paths), 100)
+	]
+	seconds, composite = _timed(lambda: sheet.composite(sequences), repeat)
+	stages["composite"] = _stage(seconds, len(paths), input_bytes)
+
+	sheet_bytes = composite.pixels.nbytes
+	seconds, levels = _timed(lambda: mips.generate(composite.pixels, filter_name), repeat)
+	stages["mips"] = _stage(seconds, len(paths), sheet_bytes)
+
+	image_format = vtf.auto_format(composite.pixels)
+	writer = vtf.VTFWriter(
+			composite.pixels, sheet = composite.sht_bytes(), image_format = image_format,
+			quality = quality, mip_levels = levels, workers = workers
+	)
+	seconds, resources = _timed(writer.resources, repeat)
+	stages["compress"] = _stage(seconds, len(paths), sum(level.nbytes for level in levels))
+
+	tf2 = TF2Output(Path(work), "bench", "")
+	tf2.mkdir_final()
+	spec = MaterialSpec("bench", game_dir = work)
+	vtf_path = tf2.final / "bench.vtf"
+
+	def write():
+		writer.write(vtf_path, resources)
+		write_vmt(spec, tf2)
+
+	seconds, _ = _timed(write, repeat)
+	stages["write"] = _stage(
+			seconds, len(paths), vtf_path.stat().st_size + (tf2.final / "bench.vmt").stat().st_size
+	)
+
+	if export:
+		#the whole tools backend (validation, mksheet, vtex, vmt) with the local stand-ins as processes
+		spec.sequences = [SequenceSpec(str(i), paths[i:i + 100]) for i in range(0, len(paths), 100)]
+		control = BuildControl(runner = tools.ToolRunner(tools.FakeToolchain()))
+		seconds, result = _timed(lambda: build(spec, control = control), repeat)
+		if result.ok:
+			stages["export"] = _stage(seconds, len(paths), input_bytes)
+		else:
+			stages["export"] = {"skipped": str(result.errors[0])}
+	return {
+			"sheet":     [composite.width, composite.height],
+			"format":    image_format,
+			"stages":    stages,
+			"peak_rss":  peak_rss(),
+			"start_rss": start_rss,
+	}
+
+
+def run(
+		cases: list, repeat: int = 3, work: Path = None, isolate = True, log = None, workers: int = None,
+		export = False
+):
+	temp = None
+	if work is None:
+		temp = tempfile.mkdtemp(prefix = "vtexgui-bench-")
+		work = Path(temp)
+	results = list()
+	try:
+		for count, size, alpha, rle in cases:
+			name = case_name(count, size, alpha, rle)
+			if log:
+				log(f"{name}: generating")
+			paths = generate(work / name, count, size, alpha, rle)
+			if log:
+				log(f"{name}: running")
+			args = (paths, str(work / name / "game"), repeat, "fast", "box", workers, export)
+			if isolate:
+				#a fresh process per case so peak rss belongs to that case alone
+				#(not a multiprocessing.Pool: its daemonic workers cannot start compression workers)
+				with ProcessPoolExecutor(1, mp_context = multiprocessing.get_context("spawn")) as pool:
+					result = pool.submit(run_case, *args).result()
+			else:
+				result = run_case(*args)
+			results.append(dict(name = name, frames = count, size = size, alpha = alpha, rle = rle, **result))
+			shutil.rmtree(work / name, ignore_errors = True)
+	finally:
+		if temp is not None:
+			shutil.rmtree(temp, ignore_errors = True)
+	return {
+			"version":  BENCH_VERSION,
+			"python":   platform.python_version(),
+			"numpy":    np.__version__,
+			"platform": platform.platform(),
+			"repeat":   repeat,
+			"workers":  workers,
+			"export":   export,
+			"cases":    results,
+	}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.15):
+	#stages that got slower than baseline by more than threshold (and MIN_DELTA seconds)
+	base_cases = {case["name"]: case for case in baseline.get("cases", [])}
+	result = list()
+	for case in current.get("cases", []):
+		base = base_cases.get(case["name"])
+		if base is None:
+			continue
+		for stage in STAGES:
+			old = base["stages"].get(stage, dict()).get("seconds")
+			new = case["stages"].get(stage, dict()).get("seconds")
+			if not old or new is None:
+				continue
+			ratio = new / old
+			result.append({
+					"case":       case["name"],
+					"stage":      stage,
+					"baseline":   old,
+					"current":    new,
+					"ratio":      round(ratio, 3),
+					"regression": ratio > 1 + threshold and new - old > MIN_DELTA,
+			})
+	return result
+
+
+def print_comparison(rows: list):
+	for row in rows:
+		flag = "SLOWER" if row["regression"] else "ok"
+		print(
+				f"{flag:6} {row['case']:24} {row['stage']:9} "
+				f"{row['baseline'] * 1000:9.2f} ms -> {row['current'] * 1000:9.2f} ms  x{row['ratio']}",
+				file = sys.stderr
+		)
+
+
+def main(argv: list):
+	import argparse
+	parser = argparse.ArgumentParser(prog = "bench", description = "Benchmark the native sheet build stages.")
+	commands = parser.add_subparsers(dest = "command", required = True)
+
+	run_parser = commands.add_parser("run", help = "generate synthetic frame sets and time every stage")
+	run_parser.add_argument("--preset", choices = list(PRESETS), default = "quick")
+	run_parser.add_argument(
+			"--case", action = "append", default = [],
+			help = "extra case as FRAMES,SIZE,ALPHA,rle|raw (SIZE may be a MIN-MAX range)"
+	)
+	run_parser.add_argument("--repeat", type = int, default = 3, help = "best of N runs per stage")
+	run_parser.add_argument("--work", default = None, help = "directory for the generated frames (default: temp)")
+	run_parser.add_argument("--no-isolate", action = "store_true", help = "run cases in this process (peak rss is shared)")
+	run_parser.add_argument(
+			"--compress-workers", type = int, default = None, help = "compress in this many processes (shared memory)"
+	)
+	run_parser.add_argument(
+			"--export", action = "store_true",
+			help = "also time a full tools backend export with the fake toolchain (no Source SDK needed)"
+	)
+	run_parser.add_argument("--out", default = None, help = "write the results here instead of stdout")
+	run_parser.add_argument("--baseline", default = None, help = "compare against these results")
+	run_parser.add_argument("--threshold", type = float, default = 0.15, help = "allowed slowdown (0.15: 15%%)")
+
+	compare_parser = commands.add_parser("compare", help = "compare two result files")
+	compare_parser.add_argument("baseline")
+	compare_parser.add_argument("current")
+	compare_parser.add_argument("--threshold", type = float, default = 0.15, help = "allowed slowdown (0.15: 15%%)")
+
+	args = parser.parse_args(argv)
+	if args.command == "compare":
+		with open(args.baseline, "r") as fl:
+			baseline = json.load(fl)
+		with open(args.current, "r") as fl:
+			current = json.load(fl)
+		rows = compare(baseline, current, args.threshold)
+		print_comparison(rows)
+		print(json.dumps(rows, indent = 2))
+		return 1 if any(row["regression"] for row in rows) else 0
+
+	cases = list(PRESETS[args.preset])
+	for case in args.case:
+		try:
+			count, size, alpha, kind = case.split(",")
+			size = tuple(int(x) for x in size.split("-")) if "-" in size else int(size)
+			cases.append((int(count), size, float(alpha), kind == "rle"))
+		except ValueError:
+			parser.error(f"bad --case '{case}', expected FRAMES,SIZE,ALPHA,rle|raw")
+	results = run(
+			cases, args.repeat, Path(args.work) if args.work else None, not args.no_isolate,
+			log = lambda message: print(message, file = sys.stderr), workers = args.compress_workers,
+			export = args.export
+	)
+	text = json.dumps(results, indent = 2)
+	if args.out:
+		with open(args.out, "w") as fl:
+			fl.write(text)
+	else:
+		print(text)
+
+	if args.baseline:
+		with open(args.baseline, "r") as fl:
+			rows = compare(json.load(fl), results, args.threshold)
+		print_comparison(rows)
+		return 1 if any(row["regression"] for row in rows) else 0
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,245 @@
+import os
+from pathlib import Path
+import json
+import hashlib
+import shutil
+import time
+import uuid
+import socket
+
+from core import write_json
+
+DEFAULT_MAX_BYTES = 1 << 30
+#age after which a lock whose owner cannot be checked (other host, Windows) is taken over
+STALE_LOCK_SECONDS = 600.0
+
+
+def _read_json(path: Path, default):
+	try:
+		with open(path, "r") as fl:
+			return json.load(fl)
+	except (OSError, ValueError):
+		return default
+
+
+class _Lock:
+	#lock file shared by every process using the cache directory, it names its owner's host and pid
+	def __init__(self, path: Path, stale: float = STALE_LOCK_SECONDS):
+		self.path = path
+		self.stale = stale
+
+	def __enter__(self):
+		owner = json.dumps({"host": socket.gethostname(), "pid": os.getpid()})
+		while True:
+			try:
+				fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			except FileExistsError:
+				self._break_stale()
+				time.sleep(0.01)
+				continue
+			with os.fdopen(fd, "w") as fl:
+				fl.write(owner)
+			return self
+
+	def __exit__(self, *_args):
+		self.path.unlink(missing_ok = True)
+
+	def _break_stale(self):
+		#only a lock left behind by a crashed process is removed, a slow owner is waited for
+		try:
+			with open(self.path, "r") as fl:
+				text = fl.read()
+			age = time.time() - os.stat(self.path).st_mtime
+		except OSError:
+			return
+		try:
+			owner = json.loads(text)
+			alive = _process_alive(owner["host"], owner["pid"])
+		except (ValueError, TypeError, KeyError):
+			#not written yet or cut short
+			alive = None
+		if alive or (alive is None and age < self.stale):
+			return
+		try:
+			with open(self.path, "r") as fl:
+				if fl.read() != text:
+					return
+			self.path.unlink()
+		except OSError:
+			pass
+
+
+def _process_alive(host: str, pid: int):
+	#None when it cannot be told from this process
+	if host != socket.gethostname() or os.name != "posix":
+		#os.kill(pid, 0) would terminate the process on Windows
+		return None
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		return True
+	except OSError:
+		return None
+	return True
+
+
+def make_key(*parts):
+	digest = hashlib.sha256()
+	for part in parts:
+		digest.update(json.dumps(part, sort_keys = True, default = str).encode())
+		digest.update(b"\0")
+	return digest.hexdigest()
+
+
+class BuildCache:
+	def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+		self.directory = Path(directory)
+		self.objects = self.directory / "objects"
+		self.objects.mkdir(parents = True, exist_ok = True)
+		self.max_bytes = max_bytes
+		self.hits = dict()
+		self.misses = dict()
+		#path -> [size, mtime_ns, digest], so unchanged frames are not read again
+		self.file_hashes = _read_json(self.directory / "files.json", dict())
+		self._file_hashes_changed = False
+
+	def file_hash(self, path: str):
+		path = str(path)
+		stat = os.stat(path)
+		known = self.file_hashes.get(path)
+		if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+			return known[2]
+		digest = hashlib.blake2b(digest_size = 16)
+		with open(path, "rb") as fl:
+			for block in iter(lambda: fl.read(1 << 20), b""):
+				digest.update(block)
+		result = digest.hexdigest()
+		self.file_hashes[path] = [stat.st_size, stat.st_mtime_ns, result]
+		self._file_hashes_changed = True
+		return result
+
+	def _entry(self, stage: str, key: str):
+		return self.objects / f"{stage}-{key}"
+
+	def miss(self, stage: str):
+		self.misses[stage] = self.misses.get(stage, 0) + 1
+
+	def hit(self, stage: str):
+		self.hits[stage] = self.hits.get(stage, 0) + 1
+
+	def _meta(self, stage: str, key: str):
+		#meta.json of the entry, which is marked as recently used, or None
+		entry = self._entry(stage, key)
+		meta = _read_json(entry / "meta.json", None)
+		if meta is not None:
+			now = time.time()
+			os.utime(entry, (now, now))
+		return meta
+
+	def get(self, stage: str, key: str):
+		#{name: path} of the cached files, or None
+		meta = self._meta(stage, key)
+		if meta is None:
+			self.miss(stage)
+			return None
+		self.hit(stage)
+		entry = self._entry(stage, key)
+		return {name: entry / name for name in meta["files"]}
+
+	def _matches(self, dest: Path, expected):
+		#the destination already has the cached content ([size, digest] from meta.json)
+		try:
+			return expected is not None and os.path.getsize(dest) == expected[0] and self.file_hash(dest) == expected[1]
+		except OSError:
+			return False
+
+	def restore(self, stage: str, key: str, destinations: dict):
+		#copy the cached files to {name: destination}, returns False on a miss
+		#destinations that already hold the cached content are left alone (their mtime included),
+		#a restore counts as a hit only once every file is in place
+		meta = self._meta(stage, key)
+		if meta is None or any(name not in meta["files"] for name in destinations):
+			self.miss(stage)
+			return False
+		entry = self._entry(stage, key)
+		hashes = meta.get("hashes", dict())
+		try:
+			for name, dest in destinations.items():
+				if self._matches(dest, hashes.get(name)):
+					continue
+				Path(dest).parent.mkdir(parents = True, exist_ok = True)
+				shutil.copyfile(entry / name, dest)
+		except FileNotFoundError:
+			#evicted by another process in the meantime
+			self.miss(stage)
+			return False
+		self.hit(stage)
+		return True
+
+	def put(self, stage: str, key: str, sources: dict):
+		#store {name: path} under the key
+		entry = self._entry(stage, key)
+		temp = self.objects / f".{stage}-{key}.{uuid.uuid4().hex}"
+		temp.mkdir()
+		size = 0
+		hashes = dict()
+		for name, source in sources.items():
+			shutil.copyfile(source, temp / name)
+			size += os.path.getsize(temp / name)
+			hashes[name] = [os.path.getsize(temp / name), self.file_hash(source)]
+		write_json(temp / "meta.json", {"stage": stage, "files": list(sources), "size": size, "hashes": hashes})
+		try:
+			os.rename(temp, entry)
+		except OSError:
+			#another build stored the same entry first, keys are content hashes so it is identical
+			shutil.rmtree(temp, ignore_errors = True)
+
+	def entries(self):
+		result = list()
+		for entry in self.objects.iterdir():
+			if entry.name.startswith("."):
+				continue
+			meta = _read_json(entry / "meta.json", None)
+			if meta is None:
+				continue
+			result.append((entry.stat().st_mtime, meta["size"], entry))
+		return result
+
+	def evict(self):
+		#drop least recently used entries until the cache fits in max_bytes
+		entries = sorted(self.entries())
+		total = sum(size for _, size, _ in entries)
+		while entries and total > self.max_bytes:
+			_, size, entry = entries.pop(0)
+			shutil.rmtree(entry, ignore_errors = True)
+			total -= size
+
+	def flush(self):
+		with _Lock(self.directory / "cache.lock"):
+			self.evict()
+			if self._file_hashes_changed:
+				file_hashes = _read_json(self.directory / "files.json", dict())
+				file_hashes.update(self.file_hashes)
+				write_json(self.directory / "files.json", file_hashes)
+				self._file_hashes_changed = False
+
+			totals = _read_json(self.directory / "stats.json", {"hits": {}, "misses": {}})
+			for name, counts in [["hits", self.hits], ["misses", self.misses]]:
+				for stage, count in counts.items():
+					totals[name][stage] = totals[name].get(stage, 0) + count
+			write_json(self.directory / "stats.json", totals)
+		self.hits.clear()
+		self.misses.clear()
+
+	def stats(self):
+		totals = _read_json(self.directory / "stats.json", {"hits": {}, "misses": {}})
+		entries = self.entries()
+		return {
+				"hits":      totals["hits"],
+				"misses":    totals["misses"],
+				"entries":   len(entries),
+				"bytes":     sum(size for _, size, _ in entries),
+				"max_bytes": self.max_bytes,
+		}
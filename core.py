@@ -0,0 +1,291 @@
+import os
+from pathlib import Path
+import json
+import uuid
+import atexit
+import weakref
+import threading
+
+
+def write_json(path: Path, data, indent: int = None):
+	#written to a temporary file next to path and moved over it, readers never see a partial file
+	path = Path(path)
+	temp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+	try:
+		with open(temp, "w") as fl:
+			json.dump(data, fl, indent = indent)
+		os.replace(temp, path)
+	except BaseException:
+		temp.unlink(missing_ok = True)
+		raise
+
+
+#every live Config, flushed at exit without keeping them alive
+_configs = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def _flush_configs():
+	for config in list(_configs.values()):
+		config.flush()
+
+
+class Config(dict):
+	#config.json kept in memory: reads only go back to the disk when the file changed,
+	#writes are coalesced and saved atomically once nothing changed for save_delay seconds
+	SAVE_DELAY = 0.5
+	#keys a profile can override, the top level values are the default profile
+	PROFILE_KEYS = ["gamedir", "export2workshop", "workshop_folder"]
+
+	def __init__(self, path: Path = None, profile: str = None, save_delay: float = SAVE_DELAY):
+		super().__init__()
+		self.path = Path(path) if path is not None else self.default_path()
+		self.profile = profile
+		self.save_delay = save_delay
+		#(key, ...) -> value set but not written yet
+		self._pending = dict()
+		self._stamp = None
+		self._timer = None
+		self._lock = threading.RLock()
+		self._reload()
+		_configs[id(self)] = self
+
+	@staticmethod
+	def default_path():
+		base = os.getenv('LOCALAPPDATA')
+		return (Path(base) if base else Path.home() / ".config") / "auto_vtex" / "config.json"
+
+	def _stat(self):
+		try:
+			stat = os.stat(self.path)
+			return stat.st_mtime_ns, stat.st_size
+		except OSError:
+			return None
+
+	def _apply(self, key: tuple, value):
+		target = self
+		for part in key[:-1]:
+			target = target.setdefault(part, dict())
+		target[key[-1]] = value
+
+	def _reload(self):
+		with self._lock:
+			stamp = self._stat()
+			if stamp == self._stamp:
+				return
+			data = dict()
+			if stamp is not None:
+				try:
+					with open(self.path, "r") as fl:
+						data = json.load(fl)
+				except (OSError, ValueError):
+					pass
+			self.clear()
+			self.update(data if isinstance(data, dict) else dict())
+			for key, value in self._pending.items():
+				self._apply(key, value)
+			self._stamp = stamp
+
+	def _set(self, name: str, value):
+		with self._lock:
+			self._reload()
+			key = (name,)
+			if self.profile and name in self.PROFILE_KEYS:
+				key = ("profiles", self.profile, name)
+			self._apply(key, value)
+			self._pending[key] = value
+			self._save()
+
+	def _get(self, name: str, default):
+		with self._lock:
+			self._reload()
+			if self.profile and name in self.PROFILE_KEYS:
+				profile = self.get("profiles", dict()).get(self.profile, dict())
+				if name in profile:
+					return profile[name]
+			return self.get(name, default)
+
+	def _save(self):
+		#restart the timer so a burst of changes (typing in an entry) is written once
+		if self._timer is not None:
+			self._timer.cancel()
+		self._timer = threading.Timer(self.save_delay, self.flush)
+		self._timer.daemon = True
+		self._timer.start()
+
+	def flush(self):
+		with self._lock:
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+			if not self._pending:
+				return
+			self._reload()
+			self.path.parent.mkdir(parents = True, exist_ok = True)
+			write_json(self.path, self)
+			self._pending.clear()
+			self._stamp = self._stat()
+
+	@property
+	def profiles(self):
+		self._reload()
+		return sorted(self.get("profiles", dict()))
+
+	def use_profile(self, name: [str, None]):
+		#only switches this object, nothing is written until a value is set
+		self.profile = name or None
+
+	def remove_profile(self, name: str):
+		with self._lock:
+			self._reload()
+			profiles = self.get("profiles", dict())
+			profiles.pop(name, None)
+			self._pending = {k: v for k, v in self._pending.items() if k[:2] != ("profiles", name)}
+			self._pending[("profiles",)] = profiles
+			if self.profile == name:
+				self.profile = None
+			self._save()
+
+	@property
+	def tf2(self) -> str:
+		return self._get("gamedir", "")
+
+	@tf2.setter
+	def tf2(self, value: str):
+		self._set("gamedir", value)
+
+	@property
+	def workshop_export(self):
+		return self._get("export2workshop", False)
+
+	@workshop_export.setter
+	def workshop_export(self, value: bool):
+		self._set("export2workshop", value)
+
+	@property
+	def workshop_folder(self):
+		return self._get("workshop_folder", "")
+
+	@workshop_folder.setter
+	def workshop_folder(self, value: str):
+		self._set("workshop_folder", value)
+
+	@property
+	def open_explorer(self):
+		return self._get("open_explorer", False)
+
+	@open_explorer.setter
+	def open_explorer(self, value: bool):
+		self._set("open_explorer", value)
+
+	@property
+	def edit_mks(self):
+		return self._get("edit_mks", False)
+
+	@edit_mks.setter
+	def edit_mks(self, value: bool):
+		self._set("edit_mks", value)
+
+	@property
+	def verify_export(self):
+		return self._get("verify_export", False)
+
+	@verify_export.setter
+	def verify_export(self, value: bool):
+		self._set("verify_export", value)
+
+
+class BoolKVVar:
+	def __init__(self, value: bool):
+		self.value = value
+
+	def __str__(self):
+		return str(int(self.value))
+
+	def __bool__(self):
+		return self.value
+
+
+class VMT:
+	def __init__(
+			self, material: str,
+			shader = "",
+			translucent = True,
+			vertex_alpha = True,
+			vertex_color = True,
+			blend_frames = False,
+			depth_blend = False,
+			depth_blend_scale = 0.0,
+			additive = False,
+			alpha_test = False,
+			no_cull = False,
+			over_bright_factor = 0.0,
+			custom_path = "",
+			custom_folder = "",
+
+	):
+		self.shader = shader
+		self.base_texture = material
+		self.translucent = BoolKVVar(translucent)
+		self.vertex_alpha = BoolKVVar(vertex_alpha)
+		self.vertex_color = BoolKVVar(vertex_color)
+		self.blend_frames = BoolKVVar(blend_frames)
+		self.depth_blend = BoolKVVar(depth_blend)
+		self.additive = BoolKVVar(additive)
+		self.alpha_test = BoolKVVar(alpha_test)
+		self.no_cull = BoolKVVar(no_cull)
+		self.custom_path = custom_path
+		self.folder = custom_folder
+		self.over_bright_factor = over_bright_factor
+		self.depth_blend_scale = depth_blend_scale
+
+	def __str__(self):
+		path = f"{self.base_texture}/{self.base_texture}"
+		if self.custom_path:
+			path = str(Path(self.custom_path) / f"{self.folder}/{self.base_texture}")
+
+		result = f"\"{self.shader}\" " + "{\n" + "\n".join([
+				f"\t\"$basetexture\" \"{path}\"",
+				f"\t\"$translucent\" \"{self.translucent}\"" if self.translucent else "",
+				f"\t\"$vertexalpha\" \"{self.vertex_alpha}\"" if self.vertex_alpha else "",
+				f"\t\"$vertexcolor\" \"{self.vertex_color}\"" if self.vertex_color else "",
+				f"\t\"$blendframes\" \"{self.blend_frames}\"" if self.blend_frames else "",
+				f"\t\"$depthblend\" \"{self.depth_blend}" if self.depth_blend else "",
+				f"\t\"$depthblendscale\" {self.depth_blend_scale}" if self.depth_blend_scale == 50.0 else "",
+				f"\t\"$additive\" \"{self.additive}\"" if self.additive else "",
+				f"\t\"$alphatest\" \"{self.alpha_test}\"" if self.alpha_test else "",
+				f"\t\"$nocull\" \"{self.no_cull}\"" if self.no_cull else "",
+				f"\t\"$overbrightfactor\" \"{self.over_bright_factor}\"" if self.over_bright_factor else ""
+		]) + "\n}"
+
+		for _ in range(100):
+			result = result.replace("\n\n", "\n")
+			if "\n\n" not in result: break
+		return result
+
+
+class TF2Output:
+	def __init__(self, path: Path, material_name: str, alt_path: str):
+		self.tf = path / "tf"
+		self.mks = path / "bin/mksheet.exe"
+		self.vtex = path / "bin/vtex.exe"
+		self.src = path / "tf/materialsrc" / material_name
+		self.final = path / "tf/materials" / material_name
+		self.alternate_final = path / "tf/materials/effects/workshop" / (alt_path if alt_path else material_name)
+		self.material = material_name
+
+	@property
+	def exists(self):
+		return self.mks.is_file() and self.vtex.is_file()
+
+	def mkdir(self):
+		if not self.src.is_dir():
+			self.src.mkdir(parents = True)
+
+	def mkdir_final(self):
+		if not self.final.is_dir():
+			self.final.mkdir(parents = True)
+
+	def mkdir_alt(self):
+		if not self.alternate_final.is_dir():
+			self.alternate_final.mkdir(parents = True)
@@ -0,0 +1,260 @@
+import numpy as np
+
+FAST = "fast"
+CLUSTER = "cluster"
+QUALITIES = [FAST, CLUSTER]
+
+CHUNK_BLOCKS = 1 << 16
+
+#projected position along c0 -> c1 (0..3) to the dxt color index
+COLOR_INDEX = np.array([0, 2, 3, 1], np.uint32)
+#position along a1 -> a0 (0..7) to the dxt alpha index
+ALPHA_INDEX = np.array([1, 7, 6, 5, 4, 3, 2, 0], np.uint64)
+
+COLOR_SHIFTS = (2 * np.arange(16)).astype(np.uint32)
+ALPHA_SHIFTS = (3 * np.arange(16)).astype(np.uint64)
+
+
+def to_blocks(pixels):
+	height, width = pixels.shape[:2]
+	pad_h, pad_w = -height % 4, -width % 4
+	if pad_h or pad_w:
+		pixels = np.pad(pixels, ((0, pad_h), (0, pad_w), (0, 0)), mode = "edge")
+		height, width = pixels.shape[:2]
+	return pixels.reshape(height // 4, 4, width // 4, 4, 4).swapaxes(1, 2).reshape(-1, 16, 4)
+
+
+def block_size(width: int, height: int, bytes_per_block: int):
+	return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * bytes_per_block
+
+
+def pack565(colors):
+	#colors: (3, n) float
+	r = np.clip(np.rint(colors[0] * (31 / 255)), 0, 31).astype(np.uint32)
+	g = np.clip(np.rint(colors[1] * (63 / 255)), 0, 63).astype(np.uint32)
+	b = np.clip(np.rint(colors[2] * (31 / 255)), 0, 31).astype(np.uint32)
+	return (r << 11) | (g << 5) | b
+
+
+def unpack565(values):
+	r = (values >> 11) & 31
+	g = (values >> 5) & 63
+	b = values & 31
+	return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)]).astype(np.float32)
+
+
+def _bounding_box(colors):
+	lo = colors.min(1)
+	hi = colors.max(1)
+	inset = (hi - lo) / 16
+	lo += inset
+	hi -= inset
+
+	#use the diagonal of the box that follows the colors: flip channels that run against the widest one
+	centred = colors - colors.mean(1, keepdims = True)
+	widest = (hi - lo).argmax(0)
+	reference = np.take_along_axis(centred, widest[None, None, :], 0)
+	flip = (centred * reference).sum(1) < 0
+	return np.where(flip, hi, lo), np.where(flip, lo, hi)
+
+
+def _least_squares(values, t):
+	#endpoints e0/e1 minimizing |(1 - t) * e0 + t * e1 - values| per block
+	a = 1 - t
+	aa = (a * a).sum(0)
+	bb = (t * t).sum(0)
+	ab = (a * t).sum(0)
+	ax = (a * values).sum(1)
+	bx = (t * values).sum(1)
+	det = aa * bb - ab * ab
+	solvable = np.abs(det) > 1e-6
+	det = np.where(solvable, det, 1)
+	e0 = (bb * ax - ab * bx) / det
+	e1 = (aa * bx - ab * ax) / det
+	return np.clip(e0, 0, 255), np.clip(e1, 0, 255), solvable
+
+
+def _nearest(colors, c0, c1):
+	dist = np.empty((4,) + colors.shape[1:], np.float32)
+	for i in range(4):
+		entry = ((3 - i) * c0 + i * c1) / 3
+		diff = colors - entry[:, None]
+		dist[i] = (diff * diff).sum(0)
+	position = dist.argmin(0)
+	return position, dist.min(0).sum(0)
+
+
+def _project(colors, c0, c1):
+	axis = c1 - c0
+	length = (axis * axis).sum(0)
+	length = np.where(length > 0, length, 1)
+	t = ((colors - c0[:, None]) * axis[:, None]).sum(0) / length
+	return np.clip(np.rint(t * 3), 0, 3).astype(np.intp)
+
+
+def _quantize(c0, c1):
+	v0, v1 = pack565(c0), pack565(c1)
+	return v0, v1, unpack565(v0), unpack565(v1)
+
+
+def _color_endpoints(colors, quality: str, iterations: int):
+	c0, c1 = _bounding_box(colors)
+	if quality != CLUSTER:
+		return c0, c1
+
+	_, _, q0, q1 = _quantize(c0, c1)
+	position, error = _nearest(colors, q0, q1)
+	for _ in range(iterations):
+		n0, n1, solvable = _least_squares(colors, position.astype(np.float32) / 3)
+		_, _, m0, m1 = _quantize(n0, n1)
+		new_position, new_error = _nearest(colors, m0, m1)
+		better = solvable & (new_error < error)
+		if not better.any():
+			break
+		c0 = np.where(better, n0, c0)
+		c1 = np.where(better, n1, c1)
+		position = np.where(better, new_position, position)
+		error = np.where(better, new_error, error)
+	return c0, c1
+
+
+def color_blocks(colors, quality: str = FAST, iterations: int = 4):
+	#colors: (3, 16, blocks) float32, returns (blocks,) uint64 dxt1 color blocks
+	c0, c1 = _color_endpoints(colors, quality, iterations)
+	v0, v1, q0, q1 = _quantize(c0, c1)
+	if quality == CLUSTER:
+		position, _ = _nearest(colors, q0, q1)
+	else:
+		position = _project(colors, q0, q1)
+	index = COLOR_INDEX[position]
+
+	#4 color mode needs c0 > c1, swapping the endpoints swaps indices 0<->1 and 2<->3
+	swap = v0 < v1
+	v0, v1 = np.where(swap, v1, v0), np.where(swap, v0, v1)
+	index = np.where(swap, index ^ 1, index)
+	index[:, v0 == v1] = 0
+
+	bits = (index << COLOR_SHIFTS[:, None]).sum(0, dtype = np.uint32)
+	return (v0 | (v1 << 16)).astype(np.uint64) | (bits.astype(np.uint64) << np.uint64(32))
+
+
+def _alpha_error(alpha, lo, hi):
+	span = np.where(hi > lo, hi - lo, 1)
+	level = np.clip(np.rint((alpha - lo) / span * 7), 0, 7)
+	value = lo + level / 7 * (hi - lo)
+	return level, ((value - alpha) ** 2).sum(0)
+
+
+def alpha_blocks(alpha, quality: str = FAST, iterations: int = 4):
+	#alpha: (16, blocks) float32, returns (blocks,) uint64 dxt5 alpha blocks
+	lo = alpha.min(0)
+	hi = alpha.max(0)
+	if quality == CLUSTER:
+		level, error = _alpha_error(alpha, lo, hi)
+		for _ in range(iterations):
+			n_lo, n_hi, solvable = _least_squares(alpha[None], level / 7)
+			n_lo, n_hi = np.rint(n_lo[0]), np.rint(n_hi[0])
+			n_lo, n_hi = np.minimum(n_lo, n_hi), np.maximum(n_lo, n_hi)
+			new_level, new_error = _alpha_error(alpha, n_lo, n_hi)
+			better = solvable & (new_error < error)
+			if not better.any():
+				break
+			lo = np.where(better, n_lo, lo)
+			hi = np.where(better, n_hi, hi)
+			level = np.where(better, new_level, level)
+			error = np.where(better, new_error, error)
+
+	a0 = np.clip(np.rint(hi), 0, 255)
+	a1 = np.clip(np.rint(lo), 0, 255)
+	level, _ = _alpha_error(alpha, a1, a0)
+	index = ALPHA_INDEX[level.astype(np.intp)]
+	index[:, a0 == a1] = 0
+
+	bits = (index << ALPHA_SHIFTS[:, None]).sum(0, dtype = np.uint64)
+	return a0.astype(np.uint64) | (a1.astype(np.uint64) << np.uint64(8)) | (bits << np.uint64(16))
+
+
+def compress_blocks(blocks, alpha: bool, quality: str = FAST):
+	#blocks: (n, 16, 4) uint8 rgba, returns the raw dxt1 (alpha = False) or dxt5 data as an uint64 array
+	result = np.empty((len(blocks), 2 if alpha else 1), "<u8")
+	#work on planes shaped (channel, 16, blocks) so every per-block reduction is elementwise between contiguous rows
+	for start in range(0, len(blocks), CHUNK_BLOCKS):
+		planes = blocks[start:start + CHUNK_BLOCKS].transpose(2, 1, 0).astype(np.float32, order = "C")
+		colors = color_blocks(planes[:3], quality)
+		if alpha:
+			result[start:start + CHUNK_BLOCKS, 0] = alpha_blocks(planes[3], quality)
+			result[start:start + CHUNK_BLOCKS, 1] = colors
+		else:
+			result[start:start + CHUNK_BLOCKS, 0] = colors
+	return result
+
+
+def compress_dxt1(pixels, quality: str = FAST):
+	return compress_blocks(to_blocks(pixels), False, quality)
+
+
+def compress_dxt5(pixels, quality: str = FAST):
+	return compress_blocks(to_blocks(pixels), True, quality)
+
+
+def _color_palette(values, four_color):
+	#values: (n,) uint64 color blocks -> (n, 4, 4) rgba palette
+	v0 = (values & np.uint64(0xFFFF)).astype(np.uint32)
+	v1 = ((values >> np.uint64(16)) & np.uint64(0xFFFF)).astype(np.uint32)
+	c0 = unpack565(v0).T
+	c1 = unpack565(v1).T
+	#dxt1 blocks with c0 <= c1 use 3 colors and transparent black
+	three = ~four_color & (v0 <= v1)
+	palette = np.empty((len(values), 4, 4), np.float32)
+	palette[:, 0, :3] = c0
+	palette[:, 1, :3] = c1
+	palette[:, 2, :3] = np.where(three[:, None], (c0 + c1) / 2, (2 * c0 + c1) / 3)
+	palette[:, 3, :3] = np.where(three[:, None], 0, (c0 + 2 * c1) / 3)
+	palette[..., 3] = 255
+	palette[:, 3, 3] = np.where(three, 0, 255)
+	return palette
+
+
+def _alpha_palette(values):
+	#values: (n,) uint64 alpha blocks -> (n, 8) alpha palette
+	a0 = (values & np.uint64(0xFF)).astype(np.float32)[:, None]
+	a1 = ((values >> np.uint64(8)) & np.uint64(0xFF)).astype(np.float32)[:, None]
+	k = np.arange(8, dtype = np.float32)
+	eight = ((8 - k) * a0 + (k - 1) * a1) / 7
+	six = np.where(k == 6, 0, np.where(k == 7, 255, ((6 - k) * a0 + (k - 1) * a1) / 5))
+	palette = np.where(a0 > a1, eight, six)
+	palette[:, 0] = a0[:, 0]
+	palette[:, 1] = a1[:, 0]
+	return palette
+
+
+def decompress_blocks(data, alpha: bool):
+	#inverse of compress_blocks: raw dxt1/dxt5 bytes -> (n, 16, 4) uint8 rgba
+	values = np.frombuffer(data, "<u8").reshape(-1, 2 if alpha else 1)
+	color = values[:, -1]
+	count = len(color)
+	#palettes are rounded once and indexed flat (colours as one uint32), much faster than take_along_axis on floats
+	palette = np.rint(_color_palette(color, np.full(count, alpha))).astype(np.uint8).view("<u4").ravel()
+	base = np.arange(0, 4 * count, 4, dtype = np.intp)[:, None]
+	bits = (color >> np.uint64(32)).astype(np.uint32)
+	result = palette[((bits[:, None] >> COLOR_SHIFTS) & 3) + base].view(np.uint8).reshape(count, 16, 4)
+	if alpha:
+		palette = np.rint(_alpha_palette(values[:, 0])).astype(np.uint8).ravel()
+		bits = values[:, :1] >> np.uint64(16)
+		result[..., 3] = palette[((bits >> ALPHA_SHIFTS) & np.uint64(7)).astype(np.intp) + 2 * base]
+	return result
+
+
+def from_blocks(blocks, width: int, height: int):
+	#inverse of to_blocks, the edge padding is cropped off
+	rows, cols = max(1, (height + 3) // 4), max(1, (width + 3) // 4)
+	pixels = blocks.reshape(rows, cols, 4, 4, 4).swapaxes(1, 2).reshape(rows * 4, cols * 4, 4)
+	return pixels[:height, :width]
+
+
+def decompress_dxt1(data, width: int, height: int):
+	return from_blocks(decompress_blocks(data, False), width, height)
+
+
+def decompress_dxt5(data, width: int, height: int):
+	return from_blocks(decompress_blocks(data, True), width, height)
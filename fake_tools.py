@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from images import read_image
+import sheet
+import mips
+import vtf
+
+#stand-ins for mksheet.exe and vtex.exe with their arguments and output locations, used by tools.FakeToolchain
+#outputs depend only on the inputs, so exports can be run and benchmarked without the Source SDK:
+#  fake_tools.py mksheet <name>.mks                      -> <name>.sht and <name>.tga next to the mks
+#  fake_tools.py vtex [-nopause] -game <tf> <src>.sht     -> <tf>/materials/<path below materialsrc>.vtf
+
+
+def mksheet(argv: list):
+	if len(argv) != 1:
+		print("usage: mksheet <file>.mks", file = sys.stderr)
+		return 2
+	path = Path(argv[0])
+	with open(path, "r") as fl:
+		sequences = sheet.parse_mks(fl.read())
+	#mksheet lays out every frame, repeated ones included
+	composite = sheet.composite(sequences, dedupe = False)
+	composite.write_sht(path.with_suffix(".sht"))
+	composite.write_tga(path.with_suffix(".tga"))
+	print(f"{path.name}: {composite.width}x{composite.height}, {sum(len(x.frames) for x in sequences)} frames")
+	return 0
+
+
+def vtex(argv: list):
+	args = [x for x in argv if x.lower() != "-nopause"]
+	if len(args) != 3 or args[0].lower() != "-game":
+		print("usage: vtex [-nopause] -game <tf directory> <materialsrc file>.sht", file = sys.stderr)
+		return 2
+	game, source = Path(args[1]), Path(args[2])
+	try:
+		relative = source.resolve().relative_to((game / "materialsrc").resolve())
+	except ValueError:
+		print(f"{source} is not below {game / 'materialsrc'}", file = sys.stderr)
+		return 1
+	with open(source, "rb") as fl:
+		sht = fl.read()
+	pixels = np.ascontiguousarray(read_image(source.with_suffix(".tga")))
+	dest = (game / "materials" / relative).with_suffix(".vtf")
+	dest.parent.mkdir(parents = True, exist_ok = True)
+	vtf.write_vtf(dest, pixels, sheet = sht, image_format = vtf.auto_format(pixels), mip_levels = mips.generate(pixels))
+	print(f"{dest.name}: {pixels.shape[1]}x{pixels.shape[0]}")
+	return 0
+
+
+TOOLS = {"mksheet": mksheet, "vtex": vtex}
+
+
+def main(argv: list):
+	if not argv or argv[0] not in TOOLS:
+		print(f"usage: fake_tools.py {'|'.join(TOOLS)} ARGS...", file = sys.stderr)
+		return 2
+	try:
+		return TOOLS[argv[0]](argv[1:])
+	except (OSError, ValueError) as e:
+		print(f"{argv[0]}: {e}", file = sys.stderr)
+		return 1
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
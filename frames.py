@@ -0,0 +1,129 @@
+import os
+import re
+from pathlib import Path
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from core import write_json
+from images import open_image
+
+METADATA_VERSION = 2
+#header reads are I/O bound (network shares), so more threads than cores pay off
+DEFAULT_WORKERS = 16
+#fewer frames than this per thread are probed on the calling thread
+CHUNK_FRAMES = 32
+
+
+def split_frame(line: str):
+	#(image path, words after it) of an mks "frame" line, a path with spaces is the longest prefix naming a file
+	rest = line.split(None, 1)[1].strip() if len(line.split(None, 1)) > 1 else ""
+	words = rest.split()
+	if len(words) > 1 and not os.path.isfile(words[0]):
+		for end in reversed([len(rest)] + [match.start() for match in re.finditer(r"\s+", rest)]):
+			if os.path.isfile(rest[:end]):
+				return rest[:end], rest[end:].split()
+	return (words[0], words[1:]) if words else ("", [])
+
+
+def file_digest(path: str):
+	digest = hashlib.blake2b(digest_size = 16)
+	with open(path, "rb") as fl:
+		for block in iter(lambda: fl.read(1 << 20), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def probe(path: str, known: dict = None):
+	#metadata entry for the frame, None if it is missing, known is reused while size and mtime match
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	if not os.path.isfile(path):
+		return None
+	if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+		return known
+	entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": None}
+	try:
+		image = open_image(path)
+		entry.update(
+				format = image.format, width = image.width, height = image.height, depth = image.depth,
+				supported = image.supported
+		)
+	except (OSError, ValueError) as e:
+		entry.update(format = None, width = 0, height = 0, depth = 0, supported = False, error = str(e))
+	return entry
+
+
+class FrameMetadata:
+	#path -> {size, mtime_ns, format, width, height, depth, supported, hash}, reused while size and mtime match
+	def __init__(self, path: Path = None):
+		self.path = path
+		self._entries = None
+		self.changed = False
+
+	@property
+	def entries(self):
+		if self._entries is None:
+			self._entries = dict()
+			if self.path is not None:
+				try:
+					with open(self.path, "r") as fl:
+						data = json.load(fl)
+					if data.get("version") == METADATA_VERSION:
+						self._entries = data.get("frames", dict())
+				except (OSError, ValueError, AttributeError):
+					pass
+		return self._entries
+
+	def _store(self, frame: str, entry: dict):
+		if entry is not None and self.entries.get(frame) is not entry:
+			self.entries[frame] = entry
+			self.changed = True
+
+	def get(self, frame: str, with_hash = False):
+		entry = probe(frame, self.entries.get(frame))
+		if entry is None:
+			raise FileNotFoundError(frame)
+		self._store(frame, entry)
+		if with_hash and entry["hash"] is None:
+			entry["hash"] = file_digest(frame)
+			self.changed = True
+		return entry
+
+	def scan(self, frames: list, workers: int = DEFAULT_WORKERS):
+		#{path: entry or None} for every frame, stat and header reads run on a thread pool
+		frames = list(dict.fromkeys(frames))
+		known = self.entries
+
+		def probe_all(chunk):
+			return [probe(frame, known.get(frame)) for frame in chunk]
+
+		workers = max(1, min(workers, len(frames) // CHUNK_FRAMES))
+		if workers == 1:
+			result = dict(zip(frames, probe_all(frames)))
+		else:
+			#a few chunks per thread instead of one future per frame
+			step = -(-len(frames) // (workers * 4))
+			chunks = [frames[i:i + step] for i in range(0, len(frames), step)]
+			with ThreadPoolExecutor(max_workers = workers) as pool:
+				result = dict(zip(frames, (entry for entries in pool.map(probe_all, chunks) for entry in entries)))
+		for frame, entry in result.items():
+			self._store(frame, entry)
+		return result
+
+	def prune(self, frames):
+		keep = set(frames)
+		for frame in [x for x in self.entries if x not in keep]:
+			self.entries.pop(frame)
+			self.changed = True
+
+	def save(self, path: Path = None):
+		path = path if path is not None else self.path
+		if path is None or (not self.changed and path == self.path):
+			return
+		Path(path).parent.mkdir(parents = True, exist_ok = True)
+		write_json(Path(path), {"version": METADATA_VERSION, "frames": self.entries})
+		self.path = path
+		self.changed = False
@@ -0,0 +1,408 @@
+import os
+from pathlib import Path
+import struct
+import mmap
+import zlib
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+try:
+	#decodes and unfilters png data in C, the numpy decoder is used without it
+	from PIL import Image as PILImage
+except ImportError:
+	PILImage = None
+
+TGA_TRUE_COLOR = 2
+TGA_TRUE_COLOR_RLE = 10
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_GRAY = 0
+PNG_RGB = 2
+PNG_PALETTE = 3
+PNG_GRAY_ALPHA = 4
+PNG_RGBA = 6
+#samples per pixel of every color type
+PNG_SAMPLES = {PNG_GRAY: 1, PNG_RGB: 3, PNG_PALETTE: 1, PNG_GRAY_ALPHA: 2, PNG_RGBA: 4}
+PNG_FILTER_PAETH = 4
+
+IMAGE_SUFFIXES = (".tga", ".png")
+
+
+class TGA:
+	format = "tga"
+	requirements = "24/32 bit, raw or RLE"
+
+	def __init__(self, path: Path):
+		self.path = path
+		with open(path, "rb") as fl:
+			data = os.read(fl.fileno(), 18)
+		if len(data) < 18:
+			raise ValueError(f"Not a tga file (truncated header): {path}")
+		self.header = data
+		id_length, colormap_type, self.image_type = struct.unpack("BBB", data[:3])
+		colormap_length, colormap_depth = struct.unpack("<HB", data[5:8])
+		self.width, self.height = struct.unpack("<HH", data[12:16])
+		self.depth, self.descriptor = struct.unpack("BB", data[16:18])
+
+		self.offset = 18 + id_length
+		if colormap_type:
+			self.offset += colormap_length * ((colormap_depth + 7) // 8)
+
+	@property
+	def channels(self):
+		return self.depth // 8
+
+	@property
+	def compressed(self):
+		return self.image_type == TGA_TRUE_COLOR_RLE
+
+	@property
+	def top_down(self):
+		return bool(self.descriptor & 0x20)
+
+	@property
+	def right_to_left(self):
+		return bool(self.descriptor & 0x10)
+
+	@property
+	def supported(self):
+		return self.image_type in (TGA_TRUE_COLOR, TGA_TRUE_COLOR_RLE) and self.depth in (24, 32)
+
+	def _map(self):
+		with open(self.path, "rb") as fl:
+			size = os.fstat(fl.fileno()).st_size
+			if not size:
+				return b""
+			return mmap.mmap(fl.fileno(), 0, access = mmap.ACCESS_READ)
+
+	def _orient(self, pixels):
+		if not self.top_down:
+			pixels = pixels[::-1]
+		if self.right_to_left:
+			pixels = pixels[:, ::-1]
+		return pixels
+
+	def pixels(self):
+		#(height, width, channels) BGR(A) array, top row first; uncompressed files are a read-only view of the mapped file
+		if not self.supported:
+			raise ValueError(f"Unsupported tga (type {self.image_type}, {self.depth} bit): {self.path}")
+
+		data = self._map()
+		size = self.width * self.height * self.channels
+		if self.compressed:
+			pixels = self._decode_rle(data, size)
+		else:
+			if len(data) < self.offset + size:
+				raise ValueError(f"Truncated tga: {self.path}")
+			pixels = np.frombuffer(data, np.uint8, size, self.offset)
+		return self._orient(pixels.reshape(self.height, self.width, self.channels))
+
+	def _decode_rle(self, data, size: int):
+		#walk the packet headers, then expand every packet with one gather
+		channels = self.channels
+		total = self.width * self.height
+		starts = list()
+		counts = list()
+		runs = list()
+		pos = self.offset
+		done = 0
+		end = len(data)
+		while done < total:
+			if pos >= end:
+				raise ValueError(f"Truncated tga: {self.path}")
+			packet = data[pos]
+			count = (packet & 0x7F) + 1
+			starts.append(pos + 1)
+			counts.append(count)
+			if packet & 0x80:
+				runs.append(True)
+				pos += 1 + channels
+			else:
+				runs.append(False)
+				pos += 1 + count * channels
+			done += count
+		if pos > end:
+			raise ValueError(f"Truncated tga: {self.path}")
+
+		counts = np.array(counts, np.intp)
+		first = np.cumsum(counts) - counts
+		step = np.where(runs, 0, channels)
+		index = np.arange(counts.sum(), dtype = np.intp)
+		offsets = np.repeat(np.array(starts, np.intp) - first * step, counts) + index * np.repeat(step, counts)
+		source = np.frombuffer(data, np.uint8)
+		return source[offsets[:total, None] + np.arange(channels)]
+
+	def blit(self, dest, box: tuple = None):
+		#write the image (or the (left, top, width, height) box of it) as RGBA into dest without an intermediate copy
+		pixels = self.pixels()
+		if box is not None:
+			left, top, width, height = box
+			pixels = pixels[top:top + height, left:left + width]
+		dest[..., 0] = pixels[..., 2]
+		dest[..., 1] = pixels[..., 1]
+		dest[..., 2] = pixels[..., 0]
+		dest[..., 3] = pixels[..., 3] if self.channels == 4 else 255
+
+	def read(self):
+		#(height, width, 4) RGBA array top row first
+		result = np.empty((self.height, self.width, 4), np.uint8)
+		self.blit(result)
+		return result
+
+
+def _unfilter_rows(data, filters, bpp: int):
+	#none, sub and up only: none and sub rows do not depend on the row above, runs of up rows are one cumsum
+	height = len(data)
+	result = np.empty_like(data)
+	plain = filters == 0
+	result[plain] = data[plain]
+	sub = np.flatnonzero(filters == 1)
+	if len(sub):
+		rows = data[sub].reshape(len(sub), -1, bpp)
+		result[sub] = np.cumsum(rows, axis = 1, dtype = np.uint8).reshape(len(sub), -1)
+	up = np.concatenate([[False], filters == 2, [False]])
+	starts = np.flatnonzero(up[1:] & ~up[:-1])
+	stops = np.flatnonzero(~up[1:] & up[:-1])
+	for start, stop in zip(starts.tolist(), stops.tolist()):
+		result[start:stop] = np.cumsum(data[start:stop], axis = 0, dtype = np.uint8)
+		if start:
+			result[start:stop] += result[start - 1]
+	return result.reshape(height, -1, bpp)
+
+
+def _unfilter_wavefront(data, filters, bpp: int):
+	#average and paeth need the reconstructed pixel to the left, so the image is walked one anti-diagonal at a time:
+	#every pixel on it only depends on pixels of earlier diagonals (left, up, up-left), whatever the row filters are
+	#the arrays are sheared so a diagonal is one column, source[r, r + c] is pixel (r, c) and
+	#pixel (r, c) of the result is result[r + 1, r + c + 2], with zeros above and left of the image
+	height = len(data)
+	width = data.shape[1] // bpp
+
+	def sheared(array, shape, offset = 0):
+		strides = array.strides
+		view = np.lib.stride_tricks.as_strided(
+				array.reshape(-1)[offset:], shape, (strides[0] + strides[1], strides[1], strides[2]), writeable = True
+		)
+		return view
+
+	source = np.zeros((height, height + width, bpp), np.uint8)
+	sheared(source, (height, width, bpp))[:] = data.reshape(height, width, bpp)
+	result = np.zeros((height + 1, height + width + 2, bpp), np.uint8)
+	kinds = filters.astype(np.intp)[:, None]
+	for d in range(height + width - 1):
+		r0, r1 = max(0, d - width + 1), min(height, d + 1)
+		left = result[r0 + 1:r1 + 1, d + 1].astype(np.int16)
+		up = result[r0:r1, d + 1].astype(np.int16)
+		corner = result[r0:r1, d].astype(np.int16)
+		pa = np.abs(up - corner)
+		pb = np.abs(left - corner)
+		pc = np.abs(left + up - 2 * corner)
+		paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, corner))
+		predicted = np.choose(kinds[r0:r1], (0, left, up, (left + up) >> 1, paeth))
+		result[r0 + 1:r1 + 1, d + 2] = (source[r0:r1, d] + predicted).astype(np.uint8)
+	offset = result.strides[0] // result.itemsize + 2 * bpp
+	return np.ascontiguousarray(sheared(result, (height, width, bpp), offset))
+
+
+def unfilter(raw, width: int, height: int, bpp: int):
+	#(height, width, bpp) samples of decompressed 8 bit png data, rows start with their filter type
+	stride = width * bpp
+	if len(raw) < height * (stride + 1):
+		raise ValueError("Truncated png image data")
+	rows = np.frombuffer(raw, np.uint8, height * (stride + 1)).reshape(height, stride + 1)
+	filters = rows[:, 0]
+	if filters.max() > PNG_FILTER_PAETH:
+		raise ValueError(f"Unknown png filter type {filters.max()}")
+	if filters.max() <= 2:
+		return _unfilter_rows(rows[:, 1:], filters, bpp)
+	return _unfilter_wavefront(rows[:, 1:], filters, bpp)
+
+
+class PNG:
+	#same interface as TGA, only the header is read until the pixels are needed
+	format = "png"
+	requirements = "8 bit gray, RGB or palette with or without alpha, not interlaced"
+
+	def __init__(self, path: Path):
+		self.path = path
+		with open(path, "rb") as fl:
+			data = os.read(fl.fileno(), 33)
+		if len(data) < 33 or data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+			raise ValueError(f"Not a png file: {path}")
+		(
+				self.width, self.height, self.bit_depth, self.color_type, self.compression, self.filter_method,
+				self.interlace
+		) = struct.unpack(">IIBBBBB", data[16:29])
+		if not self.width or not self.height:
+			raise ValueError(f"Empty png: {path}")
+
+	@property
+	def channels(self):
+		return PNG_SAMPLES.get(self.color_type, 0)
+
+	@property
+	def depth(self):
+		#bits per pixel, like TGA.depth
+		return self.bit_depth * self.channels
+
+	@property
+	def supported(self):
+		return (
+				self.bit_depth == 8 and self.color_type in PNG_SAMPLES and not self.compression
+				and not self.filter_method and not self.interlace
+		)
+
+	def _chunks(self):
+		#image data parts, palette and transparency chunk
+		with open(self.path, "rb") as fl:
+			data = fl.read()
+		idat = list()
+		palette = None
+		transparency = None
+		pos = 8
+		while pos + 8 <= len(data):
+			length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+			body = memoryview(data)[pos + 8:pos + 8 + length]
+			if len(body) < length:
+				raise ValueError(f"Truncated png: {self.path}")
+			if kind == b"IDAT":
+				idat.append(body)
+			elif kind == b"PLTE":
+				palette = bytes(body)
+			elif kind == b"tRNS":
+				transparency = bytes(body)
+			elif kind == b"IEND":
+				break
+			pos += 12 + length
+		if not idat:
+			raise ValueError(f"Png without image data: {self.path}")
+		return idat, palette, transparency
+
+	def _decode(self, idat: list):
+		if PILImage is not None:
+			with PILImage.open(self.path) as image:
+				pixels = np.asarray(image)
+			pixels = pixels.reshape(self.height, self.width, -1)
+			if pixels.dtype == np.uint8 and pixels.shape[2] == self.channels:
+				return pixels
+		decompressor = zlib.decompressobj()
+		try:
+			raw = b"".join([decompressor.decompress(part) for part in idat])
+		except zlib.error as e:
+			raise ValueError(f"Corrupt png data ({e}): {self.path}")
+		try:
+			return unfilter(raw, self.width, self.height, self.channels)
+		except ValueError as e:
+			raise ValueError(f"{e}: {self.path}")
+
+	def pixels(self):
+		#(height, width, channels) samples (palette indices for palette images), top row first
+		if not self.supported:
+			raise ValueError(
+					f"Unsupported png (color type {self.color_type}, {self.bit_depth} bit"
+					f"{', interlaced' if self.interlace else ''}): {self.path}"
+			)
+		idat, self.palette, self.transparency = self._chunks()
+		return self._decode(idat)
+
+	def _lookup(self):
+		#(256, 4) RGBA table of the palette, tRNS holds the alpha of the first entries
+		if self.palette is None:
+			raise ValueError(f"Palette png without palette: {self.path}")
+		table = np.zeros((256, 4), np.uint8)
+		colors = np.frombuffer(self.palette, np.uint8)[:256 * 3].reshape(-1, 3)
+		table[:len(colors), :3] = colors
+		table[:, 3] = 255
+		if self.transparency:
+			alpha = np.frombuffer(self.transparency, np.uint8)[:256]
+			table[:len(alpha), 3] = alpha
+		return table
+
+	def blit(self, dest, box: tuple = None):
+		#write the image (or the (left, top, width, height) box of it) as RGBA into dest
+		pixels = self.pixels()
+		if box is not None:
+			left, top, width, height = box
+			pixels = pixels[top:top + height, left:left + width]
+		if self.color_type == PNG_PALETTE:
+			dest[:] = self._lookup()[pixels[..., 0]]
+			return
+		color = 3 if self.color_type in (PNG_RGB, PNG_RGBA) else 1
+		dest[..., :3] = pixels[..., :color]
+		if self.channels > color:
+			dest[..., 3] = pixels[..., color]
+		elif self.transparency and len(self.transparency) >= 2 * color:
+			#one 16 bit sample per channel marks the transparent color
+			key = np.frombuffer(self.transparency, ">u2", color).astype(np.uint8)
+			dest[..., 3] = np.where((pixels == key).all(axis = -1), 0, 255)
+		else:
+			dest[..., 3] = 255
+
+	def read(self):
+		#(height, width, 4) RGBA array top row first
+		result = np.empty((self.height, self.width, 4), np.uint8)
+		self.blit(result)
+		return result
+
+
+FORMATS = {TGA.format: TGA, PNG.format: PNG}
+
+
+def open_image(path):
+	#frame reader for the file extension, everything that is not a png is read as tga
+	return PNG(path) if str(path).lower().endswith(".png") else TGA(path)
+
+
+def read_image(path):
+	return open_image(path).read()
+
+
+def _encode_rle(bgra):
+	#run packets for repeated pixels, raw packets for the rest, rows are never crossed
+	result = list()
+	for row in bgra:
+		values = row.view(np.uint32).ravel()
+		data = row.tobytes()
+		change = np.flatnonzero(values[1:] != values[:-1]) + 1
+		bounds = np.concatenate([[0], change, [len(values)]]).tolist()
+		raw_start = None
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			if end - start == 1:
+				if raw_start is None:
+					raw_start = start
+				continue
+			if raw_start is not None:
+				result += _raw_packets(data, raw_start, start)
+				raw_start = None
+			for run in range(start, end, 128):
+				count = min(128, end - run)
+				result.append(bytes([0x80 | (count - 1)]) + data[run * 4:run * 4 + 4])
+		if raw_start is not None:
+			result += _raw_packets(data, raw_start, len(values))
+	return b"".join(result)
+
+
+def _raw_packets(data: bytes, start: int, end: int):
+	return [
+			bytes([min(128, end - pos) - 1]) + data[pos * 4:min(pos + 128, end) * 4]
+			for pos in range(start, end, 128)
+	]
+
+
+def write_tga(path: Path, pixels, rle = False, band_rows: int = None):
+	#band_rows: convert and write raw images that many rows at a time (pixels may be a memmap)
+	height, width = pixels.shape[:2]
+	with open(path, "wb") as fl:
+		fl.write(struct.pack(
+				"<BBBHHBHHHHBB", 0, 0, TGA_TRUE_COLOR_RLE if rle else TGA_TRUE_COLOR, 0, 0, 0, 0, 0,
+				width, height, 32, 0x28
+		))
+		if rle:
+			fl.write(_encode_rle(np.ascontiguousarray(pixels[..., [2, 1, 0, 3]])))
+			return
+		step = band_rows or height
+		for y in range(0, height, step):
+			fl.write(np.ascontiguousarray(pixels[y:y + step, :, [2, 1, 0, 3]]).data)
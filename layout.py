@@ -0,0 +1,168 @@
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+MAX_SIZE = 2048
+#from this many frames on the skyline packer is used (needs numpy), the max rects free list grows with the frame count
+SKYLINE_FRAMES = 1000
+
+
+class PackError(ValueError):
+	pass
+
+
+class Layout:
+	def __init__(self, width: int, height: int, rects: list, padding: int = 0):
+		self.width = width
+		self.height = height
+		self.rects = rects  # (x, y, w, h) per input size, without the padding
+		self.padding = padding
+
+	@property
+	def used_area(self):
+		return sum(w * h for _, _, w, h in self.rects)
+
+	@property
+	def efficiency(self):
+		return self.used_area / (self.width * self.height) if self.rects else 0.0
+
+	def to_dict(self):
+		return {
+				"width":      self.width,
+				"height":     self.height,
+				"frames":     len(self.rects),
+				"padding":    self.padding,
+				"efficiency": round(self.efficiency, 4),
+		}
+
+
+class MaxRects:
+	def __init__(self, width: int, height: int):
+		self.width = width
+		self.height = height
+		self.free = [(0, 0, width, height)]
+
+	def insert(self, w: int, h: int):
+		#best short side fit
+		best = None
+		best_score = None
+		for fx, fy, fw, fh in self.free:
+			if w <= fw and h <= fh:
+				score = (min(fw - w, fh - h), max(fw - w, fh - h))
+				if best_score is None or score < best_score:
+					best = (fx, fy)
+					best_score = score
+					if score[0] == 0 and score[1] == 0:
+						break
+		if best is None:
+			return None
+		self._place((best[0], best[1], w, h))
+		return best
+
+	def _place(self, used: tuple):
+		ux, uy, uw, uh = used
+		kept = list()
+		created = list()
+		for free in self.free:
+			fx, fy, fw, fh = free
+			if ux >= fx + fw or ux + uw <= fx or uy >= fy + fh or uy + uh <= fy:
+				kept.append(free)
+				continue
+			if ux > fx:
+				created.append((fx, fy, ux - fx, fh))
+			if ux + uw < fx + fw:
+				created.append((ux + uw, fy, fx + fw - ux - uw, fh))
+			if uy > fy:
+				created.append((fx, fy, fw, uy - fy))
+			if uy + uh < fy + fh:
+				created.append((fx, uy + uh, fw, fy + fh - uy - uh))
+		self.free = kept + self._prune(created, kept)
+
+	@staticmethod
+	def _prune(created: list, kept: list):
+		#only the rects split off this insert can be redundant: the kept ones were not inside any free rect before,
+		#and every new rect lies inside one of those
+		created = sorted(set(created), key = lambda r: r[2] * r[3], reverse = True)
+		result = list()
+		for rect in created:
+			x, y, w, h = rect
+			right, bottom = x + w, y + h
+			if not any(
+					x >= ox and y >= oy and right <= ox + ow and bottom <= oy + oh
+					for ox, oy, ow, oh in result
+			) and not any(
+					x >= ox and y >= oy and right <= ox + ow and bottom <= oy + oh
+					for ox, oy, ow, oh in kept
+			):
+				result.append(rect)
+		return result
+
+
+class Skyline:
+	#bottom-left placement on a height per column, space below the skyline is lost but an insert costs a
+	#sliding maximum over the sheet width whatever the frame count
+	def __init__(self, width: int, height: int):
+		self.width = width
+		self.height = height
+		self.heights = np.zeros(width, np.int32)
+
+	def insert(self, w: int, h: int):
+		if w > self.width:
+			return None
+		tops = np.lib.stride_tricks.sliding_window_view(self.heights, w).max(axis = 1)
+		x = int(tops.argmin())
+		y = int(tops[x])
+		if y + h > self.height:
+			return None
+		self.heights[x:x + w] = y + h
+		return x, y
+
+
+def _power_of_two(value: int):
+	result = 1
+	while result < value:
+		result *= 2
+	return result
+
+
+def candidate_sizes(sizes: list, padding: int = 0, max_size: int = MAX_SIZE, square = False):
+	#power of two sheet sizes that could hold the frames, smallest (then squarest) first
+	min_w = _power_of_two(max(w for w, _ in sizes) + 2 * padding)
+	min_h = _power_of_two(max(h for _, h in sizes) + 2 * padding)
+	area = sum((w + 2 * padding) * (h + 2 * padding) for w, h in sizes)
+
+	result = list()
+	width = min_w
+	while width <= max_size:
+		height = min_h
+		while height <= max_size:
+			if width * height >= area and (not square or width == height):
+				result.append((width, height))
+			height *= 2
+		width *= 2
+	result.sort(key = lambda s: (s[0] * s[1], abs(s[0] - s[1]), -s[0]))
+	return result
+
+
+def pack_into(sizes: list, width: int, height: int, padding: int = 0):
+	order = sorted(range(len(sizes)), key = lambda i: (max(sizes[i]), sizes[i][0] * sizes[i][1]), reverse = True)
+	packer = Skyline(width, height) if len(sizes) >= SKYLINE_FRAMES and np is not None else MaxRects(width, height)
+	rects = [None] * len(sizes)
+	for i in order:
+		w, h = sizes[i]
+		position = packer.insert(w + 2 * padding, h + 2 * padding)
+		if position is None:
+			return None
+		rects[i] = (position[0] + padding, position[1] + padding, w, h)
+	return Layout(width, height, rects, padding)
+
+
+def pack(sizes: list, padding: int = 0, max_size: int = MAX_SIZE, square = False):
+	if not sizes:
+		raise PackError("No frames to pack")
+	for width, height in candidate_sizes(sizes, padding, max_size, square):
+		result = pack_into(sizes, width, height, padding)
+		if result is not None:
+			return result
+	raise PackError(f"Frames do not fit in a {max_size}x{max_size} sheet")
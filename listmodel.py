@@ -0,0 +1,111 @@
+import itertools
+
+
+class ListModel:
+	#ordered rows of (uid, value) with a uid -> index map
+	#removals mark the map stale from the removed row on, moves only reindex the rows between both ends
+	_counter = itertools.count()
+
+	def __init__(self, values = ()):
+		self._uids = list()
+		self._values = list()
+		self._index = dict()
+		self._stale = None  # first row whose entry in _index may be wrong
+		self.extend(values)
+
+	@classmethod
+	def new_uid(cls):
+		return str(next(cls._counter))
+
+	def __len__(self):
+		return len(self._uids)
+
+	def __contains__(self, uid):
+		return uid in self._index
+
+	@property
+	def uids(self):
+		return self._uids
+
+	def values(self):
+		return list(self._values)
+
+	def _mark(self, index: int):
+		if self._stale is None or index < self._stale:
+			self._stale = index
+
+	def _reindex(self):
+		if self._stale is None:
+			return
+		for i in range(self._stale, len(self._uids)):
+			self._index[self._uids[i]] = i
+		self._stale = None
+
+	def index(self, uid: str):
+		self._reindex()
+		return self._index[uid]
+
+	def uid_at(self, index: int):
+		return self._uids[index]
+
+	def value_at(self, index: int):
+		return self._values[index]
+
+	def rows(self, start: int, stop: int):
+		return self._values[start:stop]
+
+	def get(self, uid: str):
+		return self._values[self.index(uid)]
+
+	def set(self, uid: str, value):
+		self._values[self.index(uid)] = value
+
+	def append(self, value):
+		return self.extend([value])[0]
+
+	def extend(self, values):
+		values = list(values)
+		uids = [self.new_uid() for _ in values]
+		start = len(self._uids)
+		self._uids += uids
+		self._values += values
+		self._index.update(zip(uids, range(start, start + len(uids))))
+		return uids
+
+	def insert(self, index: int, value):
+		index = max(0, min(index, len(self._uids)))
+		uid = self.new_uid()
+		self._uids.insert(index, uid)
+		self._values.insert(index, value)
+		self._index[uid] = index
+		self._mark(index + 1)
+		return uid
+
+	def remove(self, uid: str):
+		index = self.index(uid)
+		self._uids.pop(index)
+		self._values.pop(index)
+		self._index.pop(uid)
+		if index < len(self._uids):
+			self._mark(index)
+		return index
+
+	def move(self, uid: str, to: int):
+		#returns the new index of the row
+		start = self.index(uid)
+		to = max(0, min(to, len(self._uids) - 1))
+		if start == to:
+			return to
+		value = self._values.pop(start)
+		self._uids.pop(start)
+		self._uids.insert(to, uid)
+		self._values.insert(to, value)
+		for i in range(min(start, to), max(start, to) + 1):
+			self._index[self._uids[i]] = i
+		return to
+
+	def clear(self):
+		self._uids.clear()
+		self._values.clear()
+		self._index.clear()
+		self._stale = None
@@ -3,14 +3,33 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog as fd
 from tkinter.messagebox import showerror, showinfo, showwarning
-import uuid
 import os
 from pathlib import Path
-import json
-import struct
-import subprocess
-import shutil
 import platform
+import threading
+import queue
+
+from core import Config, TF2Output
+from cache import BuildCache
+from pipeline import (
+		MaterialSpec, SequenceSpec, BuildResult, BuildError, BuildControl, VMT_DEFAULTS, STAGES,
+		validate, make_mks, build, cli
+)
+from project import Project, PROJECT_SUFFIX
+from listmodel import ListModel
+from frames import FrameMetadata
+from images import IMAGE_SUFFIXES, np
+import shard
+import tools
+
+
+STAGE_LABELS = {
+		"validate": "Validating",
+		"sheet":    "Building sheet",
+		"texture":  "Building texture",
+		"vmt":      "Writing VMT",
+		"copy":     "Copying to workshop folder",
+}
 
 
 class Colors:
@@ -20,261 +39,173 @@ class Colors:
 	button_bg = "#7a7a7a"
 
 
-class Config(dict):
-	def __init__(self):
-		self.path = Path(os.getenv('LOCALAPPDATA')) / "auto_vtex"
-		if not self.path.is_dir():
-			self.path.mkdir(parents = True)
-		super().__init__()
-		self.path /= "config.json"
-		self._reload()
-
-	def _reload(self):
-		self.clear()
-		if not self.path.is_file():
-			with open(self.path, "w") as fl:
-				json.dump(self, fl)
-
-		with open(self.path, "r") as fl:
-			for k, v in json.load(fl).items():
-				self[k] = v
-
-	def _save(self):
-		with open(self.path, "w") as fl:
-			json.dump(self, fl)
-
-	@property
-	def tf2(self) -> str:
-		self._reload()
-		return self.get("gamedir", "")
-
-	@tf2.setter
-	def tf2(self, value: str):
-		self["gamedir"] = value
-		self._save()
-
-	@property
-	def workshop_export(self):
-		self._reload()
-		return self.get("export2workshop", False)
-
-	@workshop_export.setter
-	def workshop_export(self, value: bool):
-		self["export2workshop"] = value
-		self._save()
-
-	@property
-	def workshop_folder(self):
-		self._reload()
-		return self.get("workshop_folder", "")
-
-	@workshop_folder.setter
-	def workshop_folder(self, value: str):
-		self["workshop_folder"] = value
-		self._save()
-
-	@property
-	def open_explorer(self):
-		self._reload()
-		return self.get("open_explorer", False)
+#drag and drop based on https://stackoverflow.com/questions/14459993/tkinter-listbox-drag-and-drop-with-python
+class DragDropListbox(tk.Frame):
+	#virtual list over a ListModel, the listbox only ever holds the visible rows
+	def __init__(self, master, **kwargs):
+		self.on_select = kwargs.pop("on_select_changed", None)
+		self.on_order_changed = kwargs.pop("on_order_changed", None)
+		self.rows = kwargs.pop("height", 10)
+		listbox_kwargs = {k: kwargs.pop(k) for k in ["width", "fg"] if k in kwargs}
+		if "bg" in kwargs:
+			listbox_kwargs["bg"] = kwargs["bg"]
+		super().__init__(master, **kwargs)
 
-	@open_explorer.setter
-	def open_explorer(self, value: bool):
-		self["open_explorer"] = value
-		self._save()
+		self.listbox = tk.Listbox(
+				self, height = self.rows, selectmode = tk.SINGLE, exportselection = False, **listbox_kwargs
+		)
+		self.scrollbar = tk.Scrollbar(self, orient = "vertical", command = self.yview)
+		self.listbox.pack(side = "left", fill = "both", expand = True)
+		self.scrollbar.pack(side = "right", fill = "y")
+		self.listbox.bind('<Button-1>', self.setCurrent)
+		self.listbox.bind('<B1-Motion>', self.shiftSelection)
+		self.listbox.bind('<ButtonRelease-1>', self.endShift)
+		self.listbox.bind('<MouseWheel>', self.wheel)
+		self.listbox.bind('<Button-4>', lambda _e: self.yview("scroll", -3, "units"))
+		self.listbox.bind('<Button-5>', lambda _e: self.yview("scroll", 3, "units"))
+
+		self.model = ListModel()
+		self.top = 0
+		self.cur_uid = None
+		self._moved = False
+		self._render_pending = False
 
 	@property
-	def edit_mks(self):
-		self._reload()
-		return self.get("edit_mks", False)
-
-	@edit_mks.setter
-	def edit_mks(self, value: bool):
-		self["edit_mks"] = value
-		self._save()
-
-
-class TGA:
-	def __init__(self, path: Path):
-		with open(path, "rb") as fl:
-			data = os.read(fl.fileno(), 18)
-		self.width, self.height = struct.unpack("hh", data[12:16])
-
-
-class BoolKVVar:
-	def __init__(self, value: bool):
-		self.value = value
-
-	def __str__(self):
-		return str(int(self.value))
-
-	def __bool__(self):
-		return self.value
-
-
-class VMT:
-	def __init__(
-			self, material: str,
-			shader = "",
-			translucent = True,
-			vertex_alpha = True,
-			vertex_color = True,
-			blend_frames = False,
-			depth_blend = False,
-			depth_blend_scale = 0.0,
-			additive = False,
-			alpha_test = False,
-			no_cull = False,
-			over_bright_factor = 0.0,
-			custom_path = "",
-			custom_folder = "",
-
-	):
-		self.shader = shader
-		self.base_texture = material
-		self.translucent = BoolKVVar(translucent)
-		self.vertex_alpha = BoolKVVar(vertex_alpha)
-		self.vertex_color = BoolKVVar(vertex_color)
-		self.blend_frames = BoolKVVar(blend_frames)
-		self.depth_blend = BoolKVVar(depth_blend)
-		self.additive = BoolKVVar(additive)
-		self.alpha_test = BoolKVVar(alpha_test)
-		self.no_cull = BoolKVVar(no_cull)
-		self.custom_path = custom_path
-		self.folder = custom_folder
-		self.over_bright_factor = over_bright_factor
-		self.depth_blend_scale = depth_blend_scale
-
-	def __str__(self):
-		path = f"{self.base_texture}/{self.base_texture}"
-		if self.custom_path:
-			path = str(Path(self.custom_path) / f"{self.folder}/{self.base_texture}")
-
-		result = f"\"{self.shader}\" " + "{\n" + "\n".join([
-				f"\t\"$basetexture\" \"{path}\"",
-				f"\t\"$translucent\" \"{self.translucent}\"" if self.translucent else "",
-				f"\t\"$vertexalpha\" \"{self.vertex_alpha}\"" if self.vertex_alpha else "",
-				f"\t\"$vertexcolor\" \"{self.vertex_color}\"" if self.vertex_color else "",
-				f"\t\"$blendframes\" \"{self.blend_frames}\"" if self.blend_frames else "",
-				f"\t\"$depthblend\" \"{self.depth_blend}" if self.depth_blend else "",
-				f"\t\"$depthblendscale\" {self.depth_blend_scale}" if self.depth_blend_scale == 50.0 else "",
-				f"\t\"$additive\" \"{self.additive}\"" if self.additive else "",
-				f"\t\"$alphatest\" \"{self.alpha_test}\"" if self.alpha_test else "",
-				f"\t\"$nocull\" \"{self.no_cull}\"" if self.no_cull else "",
-				f"\t\"$overbrightfactor\" \"{self.over_bright_factor}\"" if self.over_bright_factor else ""
-		]) + "\n}"
-
-		for _ in range(100):
-			result = result.replace("\n\n", "\n")
-			if "\n\n" not in result: break
-		return result
-
-
-class TF2Output:
-	def __init__(self, path: Path, material_name: str, alt_path: str):
-		self.tf = path / "tf"
-		self.mks = path / "bin/mksheet.exe"
-		self.vtex = path / "bin/vtex.exe"
-		self.src = path / "tf/materialsrc" / material_name
-		self.final = path / "tf/materials" / material_name
-		self.alternate_final = path / "tf/materials/effects/workshop" / (alt_path if alt_path else material_name)
-		self.material = material_name
+	def id_list(self):
+		return self.model.uids
 
 	@property
-	def exists(self):
-		return self.mks.is_file() and self.vtex.is_file()
-
-	def mkdir(self):
-		if not self.src.is_dir():
-			self.src.mkdir(parents = True)
-
-	def mkdir_alt(self):
-		if not self.alternate_final.is_dir():
-			self.alternate_final.mkdir(parents = True)
-
-
-#taken from https://stackoverflow.com/questions/14459993/tkinter-listbox-drag-and-drop-with-python
-class DragDropListbox(tk.Listbox):
-	def __init__(self, master, **kwargs):
-		kwargs['selectmode'] = tk.SINGLE
-		self.on_select = kwargs.get("on_select_changed", None)
-		if self.on_select is not None:
-			kwargs.pop("on_select_changed")
-
-		self.on_order_changed = kwargs.get("on_order_changed", None)
-		if self.on_order_changed is not None:
-			kwargs.pop("on_order_changed")
-
-		tk.Listbox.__init__(self, master, **kwargs)
-		self.bind('<Button-1>', self.setCurrent)
-		self.bind('<B1-Motion>', self.shiftSelection)
-		self.cur_index = None
-		self.cur_uid = None
-		self.id_list = list()
+	def cur_index(self):
+		return self.model.index(self.cur_uid) if self.cur_uid is not None else None
+
+	def set_model(self, model: ListModel):
+		#switching models costs the same no matter how many rows they hold
+		self.model = model
+		self.top = 0
+		self.cur_uid = model.uid_at(len(model) - 1) if len(model) else None
+		if self.cur_uid is not None:
+			self.see(len(model) - 1)
+		self.render()
+
+	def clear(self):
+		#detaches the current model, its rows are kept
+		self.set_model(ListModel())
+
+	def size(self):
+		return len(self.model)
+
+	def render(self):
+		self._render_pending = False
+		self.top = max(0, min(self.top, len(self.model) - self.rows))
+		self.listbox.delete(0, tk.END)
+		rows = self.model.rows(self.top, self.top + self.rows)
+		if rows:
+			self.listbox.insert(0, *rows)
+		index = self.cur_index
+		if index is not None and self.top <= index < self.top + self.rows:
+			self.listbox.selection_set(index - self.top)
+			self.listbox.activate(index - self.top)
+		total = max(len(self.model), 1)
+		self.scrollbar.set(self.top / total, min(1.0, (self.top + self.rows) / total))
+
+	def schedule_render(self):
+		#drag motion events are coalesced into one redraw
+		if not self._render_pending:
+			self._render_pending = True
+			self.after_idle(self.render)
+
+	def see(self, index: int):
+		if index < self.top:
+			self.top = index
+		elif index >= self.top + self.rows:
+			self.top = index - self.rows + 1
+
+	def select(self, uid: [str, None], notify = False):
+		self.cur_uid = uid
+		if uid is not None:
+			self.see(self.model.index(uid))
+		self.render()
+		if notify and self.on_select:
+			self.on_select(uid)
+
+	def yview(self, *args):
+		if args and args[0] == "moveto":
+			self.top = int(float(args[1]) * len(self.model))
+		elif args and args[0] == "scroll":
+			step = int(args[1]) * (self.rows if args[2] == "pages" else 1)
+			self.top += step
+		self.render()
+
+	def wheel(self, event):
+		self.yview("scroll", -3 if event.delta > 0 else 3, "units")
+		return "break"
 
 	def setCurrent(self, event):
-		self.cur_index = self.nearest(event.y)
-		if self.cur_index != -1:
-			self.cur_uid = self.id_list[self.cur_index]
-			if self.on_select:
-				self.on_select(self.cur_uid)
+		row = self.listbox.nearest(event.y)
+		if row < 0 or not len(self.model):
+			return
+		index = min(self.top + row, len(self.model) - 1)
+		self.select(self.model.uid_at(index), notify = True)
 
 	def add(self, item: str):
-		self.insert(tk.END, item)
-		result = str(uuid.uuid1())
-		self.id_list.append(result)
-		self.cur_uid = result
-		if self.on_select:
-			self.on_select(result)
+		result = self.model.append(item)
+		self.select(result, notify = True)
 		return result
 
-	def delete_by_uid(self, uid: str):
-		index = self.id_list.index(uid)
+	def add_many(self, items: list):
+		#one model update and one redraw, nothing is selected
+		result = self.model.extend(items)
+		self.render()
+		return result
 
-		self.delete(index)
-		self.id_list.pop(index)
+	def delete_by_uid(self, uid: str):
+		index = self.model.remove(uid)
 
 		if uid == self.cur_uid:
-			if index < len(self.id_list):
-				self.cur_uid = self.id_list[index]
-			elif self.id_list:
-				self.cur_uid = self.id_list[-1]
+			if index < len(self.model):
+				self.cur_uid = self.model.uid_at(index)
+			elif len(self.model):
+				self.cur_uid = self.model.uid_at(len(self.model) - 1)
 			else:
 				self.cur_uid = None
 
 			if self.on_select:
 				self.on_select(self.cur_uid)
+		self.render()
 
 	def edit_name(self, uid: str, name: str):
 		if not name: name = "<empty>"
-		index = self.id_list.index(uid)
-		self.delete(index)
-		self.insert(index, name)
+		self.model.set(uid, name)
+		index = self.model.index(uid) - self.top
+		if 0 <= index < self.rows:
+			self.listbox.delete(index)
+			self.listbox.insert(index, name)
+			if uid == self.cur_uid:
+				self.listbox.selection_set(index)
 
 	def get_by_uid(self, uid: str):
-		return self.get(self.id_list.index(uid))
+		return self.model.get(uid)
 
 	def shiftSelection(self, event):
-		i = self.nearest(event.y)
-		if i < self.cur_index:
-			x = self.get(i)
-			self.delete(i)
-			self.insert(i + 1, x)
-
-			x = self.id_list.pop(i)
-			self.id_list.insert(i + 1, x)
-
-			self.cur_index = i
-			if self.on_order_changed: self.on_order_changed()
-		elif i > self.cur_index:
-			x = self.get(i)
-			self.delete(i)
-			self.insert(i - 1, x)
-
-			x = self.id_list.pop(i)
-			self.id_list.insert(i - 1, x)
-
-			self.cur_index = i
+		if self.cur_uid is None:
+			return
+		if event.y < 0:
+			i = self.top - 1
+		elif event.y >= self.listbox.winfo_height():
+			i = self.top + self.rows
+		else:
+			i = self.top + self.listbox.nearest(event.y)
+		i = max(0, min(i, len(self.model) - 1))
+		if i != self.cur_index:
+			self.model.move(self.cur_uid, i)
+			self.see(i)
+			self._moved = True
+			self.schedule_render()
+
+	def endShift(self, _event):
+		#the new order is reported once per drag instead of once per motion event
+		if self._moved:
+			self._moved = False
 			if self.on_order_changed: self.on_order_changed()
 
 
@@ -330,10 +261,9 @@ class SequenceMenu(tk.Frame):
 		self.files_frame_top = tk.Frame(self.files_frame, width = 120, bg = Colors.main_bg)
 		self.files = DragDropListbox(
 				self.files_frame, width = 120, height = 25,
-				on_order_changed = self.update_files_order,
 				bg = Colors.sequence_bg, fg = Colors.text_fg
 		)
-		self.data_paths = dict()
+		self.data_paths = dict()  # sequence uid -> ListModel of frame paths, shown as is by self.files
 		self.data_looping = dict()
 
 		self.buttons = tk.Frame(self.seqs_frame, bg = Colors.main_bg)
@@ -385,12 +315,6 @@ class SequenceMenu(tk.Frame):
 		uid = self.seqs.add("New sequence")
 		name = f"Sequence {uid}" if not name else name
 		self.seqs.edit_name(uid, name)
-		index = tk.END
-		self.seqs.select_clear(0, "end")
-		self.seqs.selection_set(index)
-		self.seqs.see(index)
-		self.seqs.activate(index)
-		self.seqs.selection_anchor(index)
 
 		self.v_seq_name.set(name)
 		self.data_looping[uid] = True
@@ -411,32 +335,22 @@ class SequenceMenu(tk.Frame):
 			self.data_looping.pop(uid)
 
 		self.seqs.delete_by_uid(uid)
-		index = tk.END
-		self.seqs.select_clear(0, "end")
-		self.seqs.selection_set(index)
-		self.seqs.see(index)
-		self.seqs.activate(index)
-		self.seqs.selection_anchor(index)
 
 	def seq_change_selection(self, uid):
-		self.files.delete(0, tk.END)
 		if uid is None:
+			self.files.clear()
 			self.v_seq_name.set("")
 			return
 
 		if uid not in self.data_paths:
-			self.data_paths[uid] = list()
+			self.data_paths[uid] = ListModel()
 
 		if uid not in self.data_looping:
 			self.data_looping[uid] = True
 
-		index = self.seqs.id_list.index(uid)
-		r = self.seqs.get(index)
-		self.v_seq_name.set(r)
+		self.v_seq_name.set(self.seqs.get_by_uid(uid))
 		self.v_looping.set(self.data_looping[uid])
-
-		for path in self.data_paths[uid]:
-			self.files.add(path)
+		self.files.set_model(self.data_paths[uid])
 
 	def edit_sequence_name(self, *_args):
 		uid = self.seqs.cur_uid
@@ -449,21 +363,16 @@ class SequenceMenu(tk.Frame):
 		if self.seqs.cur_uid is None:
 			return
 		result = list(fd.askopenfilenames(
-				filetypes = (("Targa files", ".tga"),)
+				filetypes = (("Images", " ".join(IMAGE_SUFFIXES)), ("Targa files", ".tga"), ("PNG files", ".png"))
 		))
 		result.sort()
 		self.add_files(*result)
-		index = tk.END
-		self.files.select_clear(0, tk.END)
-		self.files.selection_set(index)
-		self.files.see(index)
-		self.files.activate(index)
-		self.files.selection_anchor(index)
 
 	def add_files(self, *files):
-		for file in files:
-			self.files.add(file)
-			self.data_paths[self.seqs.cur_uid].append(file)
+		#self.files shows the ListModel of the current sequence, so this also updates data_paths
+		uids = self.files.add_many(files)
+		if uids:
+			self.files.select(uids[-1])
 
 	def remove_image(self):
 		file_uid = self.files.cur_uid
@@ -471,24 +380,8 @@ class SequenceMenu(tk.Frame):
 		if file_uid is None or seq_uid is None:
 			return
 
-		self.data_paths[seq_uid].remove(self.files.get(self.files.id_list.index(file_uid)))
 		self.files.delete_by_uid(file_uid)
 
-		index = tk.END
-		self.files.select_clear(0, "end")
-		self.files.selection_set(index)
-		self.files.see(index)
-		self.files.activate(index)
-		self.files.selection_anchor(index)
-
-	def update_files_order(self):
-		uid = self.seqs.cur_uid
-		if uid is None: return
-
-		self.data_paths[uid].clear()
-		for i in range(self.files.size()):
-			self.data_paths[uid].append(self.files.get(i))
-
 	def update_looping(self, *_args):
 		uid = self.seqs.cur_uid
 		if not uid:
@@ -496,6 +389,26 @@ class SequenceMenu(tk.Frame):
 			return
 		self.data_looping[uid] = self.v_looping.get()
 
+	def sequences(self):
+		return [
+				SequenceSpec(
+						self.seqs.get_by_uid(uid),
+						self.data_paths[uid].values() if uid in self.data_paths else [],
+						self.data_looping.get(uid, True)
+				)
+				for uid in self.seqs.id_list
+		]
+
+	def load_sequences(self, sequences: list):
+		#frames only reach the file list when their sequence is selected
+		self.seqs.clear()
+		self.data_paths.clear()
+		self.data_looping.clear()
+		for uid, seq in zip(self.seqs.add_many([seq.name for seq in sequences]), sequences):
+			self.data_paths[uid] = ListModel(seq.frames)
+			self.data_looping[uid] = seq.looping
+		self.seqs.select(self.seqs.id_list[0] if self.seqs.id_list else None, notify = True)
+
 
 class PageMain(tk.Frame):
 	def __init__(self, master, **kwargs):
@@ -507,10 +420,45 @@ class PageMain(tk.Frame):
 				font = 24, command = self.export
 		)
 		self.builder.pack(side = "top")
+		self.project_buttons = tk.Frame(self, bg = Colors.main_bg)
+		self.btn_open = tk.Button(
+				self.project_buttons, text = "Open project", command = self.open_project, width = 20,
+				bg = Colors.button_bg, fg = Colors.text_fg
+		)
+		self.btn_save = tk.Button(
+				self.project_buttons, text = "Save project", command = self.save_project, width = 20,
+				bg = Colors.button_bg, fg = Colors.text_fg
+		)
+		self.progress_frame = tk.Frame(self, bg = Colors.main_bg)
+		self.v_progress = tk.StringVar()
+		self.progress = tk.Label(self.progress_frame, textvariable = self.v_progress, bg = Colors.main_bg, fg = Colors.text_fg)
+		self.btn_cancel = tk.Button(
+				self.progress_frame, text = "Cancel", bg = "red", command = self.cancel_build, width = 20,
+				state = "disabled"
+		)
 		self.btn_export.pack(side = "bottom", fill = "x")
+		self.progress_frame.pack(side = "bottom", fill = "x")
+		self.progress.pack(side = "left")
+		self.btn_cancel.pack(side = "right")
+		self.project_buttons.pack(side = "bottom")
+		self.btn_open.pack(side = "left")
+		self.btn_save.pack(side = "right")
 		self.vmt: [VMTEdit, None] = None
+		self.cfg: [Config, None] = None
+		self.project = Project()
+		self.metadata: [FrameMetadata, None] = None
 		self.mks_var = tk.StringVar()
 		self.popup = None
+		#the build runs on a worker thread and reports back through this queue
+		self.build_queue = queue.Queue()
+		self.control: [BuildControl, None] = None
+		#export validates on a worker thread before the build starts
+		self.preparing = False
+		#set by export when the material overflows one sheet (see shard.split)
+		self.shards = list()
+		self.shard_mapping: [dict, None] = None
+		#the spec export validated, output builds exactly this one
+		self.spec: [MaterialSpec, None] = None
 
 	@staticmethod
 	def ask_tf_dir(config: Config):
@@ -520,95 +468,112 @@ class PageMain(tk.Frame):
 		)
 		config.tf2 = fd.askdirectory(initialdir = "/")
 
-	def export(self):
-		errors = list()
-		to_mks = list()
+	def make_spec(self, config: Config):
+		assert isinstance(self.vmt, VMTEdit)
+		return MaterialSpec(
+				self.builder.v_mat_name.get(),
+				sequences = self.builder.sequences(),
+				game_dir = config.tf2,
+				vmt = self.vmt.options(),
+				workshop_export = config.workshop_export,
+				workshop_folder = config.workshop_folder,
+		)
 
-		config = Config()
+	def open_project(self, path: str = None):
+		if path is None:
+			path = fd.askopenfilename(filetypes = (("VtexGui project", PROJECT_SUFFIX),))
+		if not path:
+			return
+		try:
+			self.project = Project.load(Path(path))
+		except (OSError, ValueError) as e:
+			showerror("Project ERROR", f"Could not open project:\n{path}\n\n{e}")
+			return
+		if not self.project.materials:
+			return
+		spec = self.project.materials[0]
+		self.builder.v_mat_name.set(spec.name)
+		self.builder.load_sequences(spec.sequences)
+		if self.vmt:
+			self.vmt.set_options(spec.vmt)
+
+	def save_project(self):
+		path = self.project.path
+		if path is None:
+			path = fd.asksaveasfilename(
+					defaultextension = PROJECT_SUFFIX, initialfile = self.builder.v_mat_name.get() + PROJECT_SUFFIX,
+					filetypes = (("VtexGui project", PROJECT_SUFFIX),)
+			)
+			if not path:
+				return
+		self.project.materials[:1] = [self.make_spec(self.cfg)]
+		try:
+			self.project.save(Path(path))
+		except OSError as e:
+			showerror("Project ERROR", f"Could not save project:\n{path}\n\n{e}")
+
+	def frame_metadata(self):
+		#a saved project keeps its own frame metadata, otherwise it is shared through the cache directory
+		if self.project.path is not None:
+			return self.project.metadata
+		if self.metadata is None:
+			self.metadata = FrameMetadata(self.cfg.path.parent / "cache" / "frames.json")
+		return self.metadata
+
+	def export(self):
+		if self.control is not None or self.preparing:
+			return
+		config = self.cfg
 		asked = False
-		custom_path = config.workshop_folder
 
 		if not os.path.isdir(config.tf2):
 			asked = True
 			self.ask_tf_dir(config)
 
 		tf2 = TF2Output(Path(config.tf2), self.builder.v_mat_name.get(), config.workshop_folder)
-		if not tf2.material or any(x in tf2.material for x in "<>:\"/\\|?*"):
-			errors.append("Invalid material name.")
-
-		if any(x in custom_path for x in "<>:\"/\\|?*"):
-			errors.append("Invalid workshop folder name.")
-
-		if not tf2.exists:
+		if not tools.default_runner().available(tf2):
 			if not asked:
 				self.ask_tf_dir(config)
-			tf2 = TF2Output(Path(config.tf2), self.builder.v_mat_name.get(), config.workshop_folder)
-			if not tf2.exists:
-				errors.append("Team Fortress 2 not found!")
-
-		if not self.builder.seqs.id_list:
-			errors.append("No sequences present")
-
-		for uid in self.builder.seqs.id_list:
-			if not self.builder.data_paths[uid]:
-				errors.append(f"Empty sequence:\n{self.builder.seqs.get_by_uid(uid)}")
-				continue
-			to_mks.append([self.builder.data_looping[uid]])
-			for path in self.builder.data_paths[uid]:
-				to_mks[-1].append(path)
-				if not os.path.isfile(path):
-					errors.append(f"File moved or missing:\n{path}")
-
-		total_images = 0
-		size = -1
-		err_square = False
-		err_mismatch = False
-
-		for seq in to_mks:
-			for p in seq[1:]:
-				if not os.path.exists(p): continue
-				tga = TGA(p)
-				if tga.width != tga.height:
-					err_square = True
-					errors.append(f"File has non-square resolution ({tga.width}x{tga.height})\n{p}")
-				total_images += 1
-				if size != -1 and size != tga.width and not err_mismatch:
-					errors.append(f"Files have different resolutions.")
-					err_mismatch = True
-				size = tga.width
-
-		if not err_square and not err_mismatch:
-			x = 0
-			y = 0
-
-			for i in range(total_images):
-				if x + size > 2048:
-					y += size
-					x = 0
-					if y > 2048:
-						errors.append("Too much data.\n(Final composite must fit in 2048x2028 texture)")
-						break
-				else:
-					x += size
-		mks_lines = list()
-		mks_i = 0
-		for sequence in to_mks:
-			looping = sequence.pop(0)
-			mks_lines.append(f"sequence {mks_i}")
-			if looping: mks_lines.append("loop")
-			mks_i += 1
-
-			for path in sequence:
-				mks_lines.append(f"frame {path} 1")
-				if " " in path:
-					errors.append(f"Filepath contains a space (mksheet cannot parse this):\n\"{path}\"")
 
+		spec = self.make_spec(config)
+		metadata = self.frame_metadata()
+
+		def work():
+			#splitting packs the sheets and validation reads every frame header, neither belongs on the Tk thread
+			try:
+				shards, mapping = shard.split(spec, metadata)
+				errors = [error for item in shards for error in validate(item, metadata = metadata)]
+				try:
+					metadata.save()
+				except OSError:
+					pass
+			except Exception as e:
+				shards, mapping = [spec], None
+				errors = [BuildError("crash", f"Validation failed: {e}")]
+			self.build_queue.put(("validated", (spec, shards, mapping, errors)))
+
+		self.preparing = True
+		self.btn_export.config(state = "disabled")
+		self.v_progress.set("Validating...")
+		threading.Thread(target = work, daemon = True).start()
+		self.after(100, self.poll_build)
+
+	def validated(self, spec: MaterialSpec, shards: list, mapping: [dict, None], errors: list):
+		self.preparing = False
 		if errors:
-			showerror("VTF ERROR", "The following errors have occurred:\n\n" + "\n\n".join(errors))
+			result = BuildResult(spec.name)
+			result.errors += errors
+			self.build_done(result)
 			return
-
-		self.mks_var.set("\n".join(mks_lines))
-		if config.edit_mks:
+		self.btn_export.config(state = "normal")
+		self.v_progress.set("")
+		self.spec = spec
+		self.shards, self.shard_mapping = shards, mapping
+
+		config = self.cfg
+		self.mks_var.set(make_mks(spec.to_mks()))
+		#a split material has one mks per sheet, there is no single sheet description to edit
+		if config.edit_mks and self.shard_mapping is None:
 			self.popup = tk.Toplevel()
 			self.popup.wm_title("MKS View")
 			self.popup.protocol("WM_DELETE_WINDOW", self.popup_close)
@@ -629,62 +594,82 @@ class PageMain(tk.Frame):
 		if not self.mks_var.get():
 			return
 
-		config = Config()
-		tf2 = TF2Output(Path(config.tf2), self.builder.v_mat_name.get(), config.workshop_folder)
-		path_mks = Path(tf2.material + ".mks")
-
-		with open(path_mks, "w") as fl:
-			fl.write(self.mks_var.get())
-
-		subprocess.call(str(tf2.mks) + f" \"{path_mks}\"")
-		tf2.mkdir()
-		for source, dest in [
-				[tf2.material + ".mks", tf2.src / (tf2.material + ".mks")],
-				[tf2.material + ".sht", tf2.src / (tf2.material + ".sht")],
-				[tf2.material + ".tga", tf2.src / (tf2.material + ".tga")],
-		]:
-			if dest.is_file():
-				os.remove(dest)
-			shutil.move(source, dest)
-
-		result_sht = tf2.src / (tf2.material + ".sht")
-		subprocess.call(str(tf2.vtex) + f" -nopause -game \"{str(tf2.tf)}\" \"{result_sht}\"")
-
-		custom_export = ""
-		if config.workshop_export:
-			custom_export = "Effects/workshop/"
-
-		with open(tf2.final / (tf2.material + ".vmt"), "w") as fl:
-			assert isinstance(self.vmt, VMTEdit)
-			fl.write(str(VMT(
-					tf2.material,
-					custom_path = custom_export,
-					custom_folder = config.workshop_folder,
-					shader = self.vmt.v_shader.get(),
-					blend_frames = self.vmt.v_blend_frames.get(),
-					depth_blend = self.vmt.v_depth_blend.get() if self.vmt.is_enabled(self.vmt.depth_blend) else False,
-					additive = self.vmt.v_additive.get() if self.vmt.is_enabled(self.vmt.additive) else False,
-					alpha_test = self.vmt.v_alpha_test.get() if self.vmt.is_enabled(self.vmt.alpha_test) else False,
-					no_cull = self.vmt.v_no_cull.get() if self.vmt.is_enabled(self.vmt.no_cull) else False,
-					over_bright_factor = self.vmt.over_bright.value if self.vmt.is_enabled(self.vmt.over_bright) else False,
-					vertex_alpha = self.vmt.v_vertex_alpha.get() if self.vmt.is_enabled(self.vmt.vertex_alpha) else False,
-					vertex_color = self.vmt.v_vertex_color.get() if self.vmt.is_enabled(self.vmt.vertex_color) else False,
-					depth_blend_scale = self.vmt.depth_blend_scale.value if self.vmt.is_enabled(self.vmt.depth_blend_scale) else 50.0
-			)))
-
-		if custom_export:
-			tf2.mkdir_alt()
-			for source, dest in [
-					[tf2.final / f"{tf2.material}.vmt", tf2.alternate_final / f"{tf2.material}.vmt"],
-					[tf2.final / f"{tf2.material}.vtf", tf2.alternate_final / f"{tf2.material}.vtf"]
-			]:
-				if dest.is_file():
-					os.remove(dest)
-				shutil.move(source, dest)
-			tf2.final.rmdir()
-
-		if config.open_explorer:
-			os.startfile(tf2.final if not custom_export else tf2.alternate_final)
+		config = self.cfg
+		spec = self.spec
+		mapping = self.shard_mapping
+		specs = self.shards if mapping is not None else [spec]
+		mks = self.mks_var.get() if mapping is None else None
+		cache = BuildCache(config.path.parent / "cache")
+		metadata = self.frame_metadata()
+		control = BuildControl(progress = lambda stage: self.build_queue.put(("stage", stage)))
+		#opt-in: catches a vtex run that left a broken or mismatched vtf before it only shows in game
+		verify = config.verify_export and np is not None
+
+		def work():
+			result = None
+			try:
+				if mapping is not None:
+					shard.write_mapping(spec, mapping)
+				for item in specs:
+					#export validated every item already
+					result = build(
+							item, mks = mks, check = False, cache = cache, metadata = metadata, control = control
+					)
+					if verify:
+						from verify import verify_result
+						verify_result(item, result, mks)
+					if not result.ok:
+						break
+			except Exception as e:
+				result = BuildResult(spec.name)
+				result.errors.append(BuildError("crash", f"Build failed: {e}"))
+			self.build_queue.put(("done", result))
+
+		self.control = control
+		self.btn_export.config(state = "disabled")
+		self.btn_cancel.config(state = "normal")
+		self.v_progress.set("Starting...")
+		threading.Thread(target = work, daemon = True).start()
+		self.after(100, self.poll_build)
+
+	def cancel_build(self):
+		if self.control is not None:
+			self.v_progress.set("Cancelling...")
+			self.control.cancel()
+
+	def poll_build(self):
+		while True:
+			try:
+				kind, value = self.build_queue.get_nowait()
+			except queue.Empty:
+				self.after(100, self.poll_build)
+				return
+			if kind == "stage":
+				self.v_progress.set(f"{STAGE_LABELS.get(value, value)} ({STAGES.index(value) + 1}/{len(STAGES)})")
+			elif kind == "validated":
+				self.validated(*value)
+				return
+			elif kind == "done":
+				self.build_done(value)
+				return
+
+	def build_done(self, result: BuildResult):
+		self.control = None
+		self.btn_export.config(state = "normal")
+		self.btn_cancel.config(state = "disabled")
+		if any(x.code == "cancelled" for x in result.errors):
+			self.v_progress.set("Cancelled")
+			return
+		if not result.ok:
+			self.v_progress.set("Failed")
+			showerror("VTF ERROR", "The following errors have occurred:\n\n" + "\n\n".join(str(x) for x in result.errors))
+			return
+
+		self.v_progress.set("Done")
+		if self.shard_mapping is not None:
+			showinfo("Material split", shard.describe(self.shard_mapping))
+		if self.cfg.open_explorer:
+			os.startfile(result.outputs["vmt"].parent)
 
 
 class FloatField(tk.Frame):
@@ -718,6 +703,10 @@ class FloatField(tk.Frame):
 		except ValueError:
 			return 0.0
 
+	@value.setter
+	def value(self, value: float):
+		self._value.set(str(value))
+
 
 class VMTEdit(tk.Frame):
 	def __init__(self, master, **kwargs):
@@ -825,6 +814,34 @@ class VMTEdit(tk.Frame):
 	def is_enabled(self, widget):
 		return widget in self.mode_widgets.get(self.v_shader.get(), [])
 
+	def options(self):
+		return dict(
+				shader = self.v_shader.get(),
+				blend_frames = self.v_blend_frames.get(),
+				depth_blend = self.v_depth_blend.get() if self.is_enabled(self.depth_blend) else False,
+				additive = self.v_additive.get() if self.is_enabled(self.additive) else False,
+				alpha_test = self.v_alpha_test.get() if self.is_enabled(self.alpha_test) else False,
+				no_cull = self.v_no_cull.get() if self.is_enabled(self.no_cull) else False,
+				over_bright_factor = self.over_bright.value if self.is_enabled(self.over_bright) else False,
+				vertex_alpha = self.v_vertex_alpha.get() if self.is_enabled(self.vertex_alpha) else False,
+				vertex_color = self.v_vertex_color.get() if self.is_enabled(self.vertex_color) else False,
+				depth_blend_scale = self.depth_blend_scale.value if self.is_enabled(self.depth_blend_scale) else 50.0
+		)
+
+	def set_options(self, options: dict):
+		values = dict(VMT_DEFAULTS)
+		values.update(options)
+		self.v_shader.set(values["shader"])
+		self.v_blend_frames.set(values["blend_frames"])
+		self.v_depth_blend.set(values["depth_blend"])
+		self.v_additive.set(values["additive"])
+		self.v_alpha_test.set(values["alpha_test"])
+		self.v_no_cull.set(values["no_cull"])
+		self.v_vertex_alpha.set(values["vertex_alpha"])
+		self.v_vertex_color.set(values["vertex_color"])
+		self.over_bright.value = float(values["over_bright_factor"] or 0.0)
+		self.depth_blend_scale.value = float(values["depth_blend_scale"] or 0.0)
+
 
 class NamedEntry(tk.Frame):
 	def __init__(self, master, name: str, default_value: str, **kwargs):
@@ -845,12 +862,13 @@ class NamedEntry(tk.Frame):
 
 
 class ConfigFrame(tk.Frame):
-	def __init__(self, master, **kwargs):
+	def __init__(self, master, config: Config, **kwargs):
 		super().__init__(master, **kwargs)
 		self.v_explorer = tk.BooleanVar()
 		self.v_workshop = tk.BooleanVar()
 		self.v_mks = tk.BooleanVar()
-		self.cfg = Config()
+		self.v_verify = tk.BooleanVar()
+		self.cfg = config
 
 		self.workshop_export = tk.Checkbutton(
 				self, text = "Export to workshop folder",
@@ -877,10 +895,20 @@ class ConfigFrame(tk.Frame):
 		self.v_mks.set(self.cfg.edit_mks)
 		self.v_mks.trace_add("write", self.changed_mks)
 
+		#reading the vtf back needs numpy
+		self.verify = tk.Checkbutton(
+				self, text = "Verify vtf after export", variable = self.v_verify,
+				bg = Colors.main_bg, fg = Colors.text_fg, selectcolor = Colors.main_bg,
+				state = "normal" if np is not None else "disabled"
+		)
+		self.v_verify.set(self.cfg.verify_export and np is not None)
+		self.v_verify.trace_add("write", self.changed_verify)
+
 		self.workshop_export.pack(side = "top")
 		self.workshop_folder.pack(side = "top")
 		self.open_explorer.pack(side = "top")
 		self.mks.pack(side = "top")
+		self.verify.pack(side = "top")
 
 	def changed_custom_dir(self, *_args):
 		self.cfg.workshop_export = self.v_workshop.get()
@@ -894,6 +922,9 @@ class ConfigFrame(tk.Frame):
 	def changed_mks(self, *_args):
 		self.cfg.edit_mks = self.v_mks.get()
 
+	def changed_verify(self, *_args):
+		self.cfg.verify_export = self.v_verify.get()
+
 
 class DroppedFile:
 	def __init__(self, path: Path):
@@ -910,12 +941,14 @@ class DroppedFile:
 
 def launch(*paths: str):
 	paths = [Path(path) for path in paths]
-	non_tga = [str(path) for path in paths if not str(path).lower().endswith(".tga")]
+	projects = [path for path in paths if path.suffix.lower() == PROJECT_SUFFIX and path.is_file()]
+	paths = [path for path in paths if path not in projects]
+	non_images = [str(path) for path in paths if not str(path).lower().endswith(IMAGE_SUFFIXES)]
 	non_files = [str(path) for path in paths if not path.is_file()]
 
 	paths = [
 			DroppedFile(path) for path in paths if
-			str(path).lower().endswith("tga") and path.is_file()
+			str(path).lower().endswith(IMAGE_SUFFIXES) and path.is_file()
 	]
 
 	paths.sort(key = lambda path: path.file)
@@ -927,12 +960,12 @@ def launch(*paths: str):
 
 	warning_lines = list()
 
-	if non_tga:
-		warning_lines.append("The following files were ignored for not being Targa (tga) files:")
-		warning_lines += non_tga
+	if non_images:
+		warning_lines.append("The following files were ignored for not being Targa (tga) or PNG files:")
+		warning_lines += non_images
 
 	if non_files:
-		if non_tga: warning_lines.append("")
+		if non_images: warning_lines.append("")
 		warning_lines.append("The following arguments were not files!")
 		warning_lines += non_files
 
@@ -944,18 +977,22 @@ def launch(*paths: str):
 	tabs = ttk.Notebook(app)
 	tabs.pack(side = "top")
 
-	cfg = ConfigFrame(tabs)
+	config = Config()
+	cfg = ConfigFrame(tabs, config)
 	vmt_edit = VMTEdit(tabs)
 	page = PageMain(tabs)
 	tabs.add(page, text = "Sequence editor")
 	tabs.add(vmt_edit, text = "VMT options")
 	tabs.add(cfg, text = "Config")
 	page.vmt = vmt_edit
+	page.cfg = config
 	cfg.config(bg = Colors.main_bg)
 	vmt_edit.config(bg = Colors.main_bg)
 	page.config(bg = Colors.main_bg)
 
-	if dropped_files:
+	if projects:
+		page.open_project(str(projects[0]))
+	elif dropped_files:
 		for category, path_list in dropped_files.items():
 			page.builder.add_sequence(
 					name = category,
@@ -965,6 +1002,7 @@ def launch(*paths: str):
 		page.builder.add_sequence()
 
 	app.mainloop()
+	config.flush()
 
 
 def main():
@@ -979,5 +1017,11 @@ def main():
 	launch(*(sys.argv[1:] if len(sys.argv) > 1 else list()))
 
 
+def main_cli():
+	return cli(sys.argv[2:])
+
+
 if __name__ == '__main__':
+	if sys.argv[1:2] == ["--build"]:
+		sys.exit(main_cli())
 	main()
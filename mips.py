@@ -0,0 +1,185 @@
+import numpy as np
+
+BOX = "box"
+KAISER = "kaiser"
+LANCZOS = "lanczos"
+FILTERS = [BOX, KAISER, LANCZOS]
+
+SRGB_TO_LINEAR = np.where(
+		np.arange(256) <= 10,
+		np.arange(256) / 255 / 12.92,
+		((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4
+).astype(np.float32)
+
+
+def linear_to_srgb(values):
+	return np.where(
+			values <= 0.0031308,
+			values * 12.92,
+			1.055 * np.power(np.maximum(values, 0.0031308), 1 / 2.4, dtype = np.float32) - 0.055
+	)
+
+
+def _lanczos(x, a = 3):
+	return np.where(np.abs(x) < a, np.sinc(x) * np.sinc(x / a), 0)
+
+
+def _kaiser(x, width = 3, alpha = 4.0):
+	inside = np.clip(1 - (x / width) ** 2, 0, 1)
+	return np.where(np.abs(x) < width, np.sinc(x) * np.i0(alpha * np.sqrt(inside)) / np.i0(alpha), 0)
+
+
+def taps(name: str):
+	#weights for a 2:1 reduction, output texel i is sum(w[k] * input[2i - r + 1 + k])
+	if name == LANCZOS:
+		kernel, radius = _lanczos, 3
+	elif name == KAISER:
+		kernel, radius = _kaiser, 3
+	else:
+		return np.float32([0.5, 0.5])
+	offsets = np.arange(-2 * radius + 1, 2 * radius + 1) - 0.5
+	weights = kernel(offsets / 2)
+	return (weights / weights.sum()).astype(np.float32)
+
+
+def _reduce_axis(values, axis: int, weights):
+	if values.shape[axis] == 1:
+		return values
+	values = np.moveaxis(values, axis, 0)
+	size = values.shape[0] // 2
+	if len(weights) == 2:
+		result = values.reshape(size, 2, *values.shape[1:]).mean(1)
+	else:
+		radius = len(weights) // 2
+		padded = np.concatenate([values[:1].repeat(radius - 1, 0), values, values[-1:].repeat(radius, 0)])
+		result = np.zeros((size,) + values.shape[1:], np.float32)
+		for k, weight in enumerate(weights):
+			result += weight * padded[k:k + 2 * size:2]
+	return np.moveaxis(result, 0, axis)
+
+
+def reduce(values, filter_name: str = BOX):
+	weights = taps(filter_name)
+	return _reduce_axis(_reduce_axis(values, 0, weights), 1, weights)
+
+
+def to_linear(pixels, gamma = True, premultiply = True):
+	result = np.empty(pixels.shape, np.float32)
+	if gamma:
+		result[..., :3] = SRGB_TO_LINEAR[pixels[..., :3]]
+	else:
+		result[..., :3] = pixels[..., :3] / np.float32(255)
+	result[..., 3] = pixels[..., 3] / np.float32(255)
+	if premultiply:
+		result[..., :3] *= result[..., 3:]
+	return result
+
+
+def from_linear(values, gamma = True, premultiply = True):
+	color = values[..., :3]
+	alpha = np.clip(values[..., 3:], 0, 1)
+	if premultiply:
+		color = np.divide(color, alpha, out = np.zeros_like(color), where = alpha > 0)
+	color = np.clip(color, 0, 1)
+	if gamma:
+		color = linear_to_srgb(color)
+	result = np.empty(values.shape, np.uint8)
+	result[..., :3] = np.rint(color * 255)
+	result[..., 3:] = np.rint(alpha * 255)
+	return result
+
+
+def _level_rect(rect, level: int):
+	#rect at the given mip level, or None if it does not land on whole texels any more
+	unit = 1 << level
+	if any(v % unit for v in rect):
+		return None
+	return [v >> level for v in rect]
+
+
+def _chain(result: list, current, level: int, filter_name: str, gamma, premultiply, rects: list, count: int):
+	#appends the levels below `current` (the linear values of the last level in result)
+	while (current.shape[0] > 1 or current.shape[1] > 1) and (count is None or len(result) < count):
+		reduced = reduce(current, filter_name)
+		level += 1
+		#a box filter never reads across an edge that is aligned at both levels
+		if rects and filter_name != BOX:
+			for rect in rects:
+				src = _level_rect(rect, level - 1)
+				dest = _level_rect(rect, level)
+				if src is None or dest is None:
+					continue
+				x, y, w, h = src
+				nx, ny, nw, nh = dest
+				reduced[ny:ny + nh, nx:nx + nw] = reduce(current[y:y + h, x:x + w], filter_name)
+		current = reduced
+		result.append(from_linear(current, gamma, premultiply))
+	return result
+
+
+def generate(
+		pixels, filter_name: str = BOX, gamma = True, premultiply = True,
+		rects: list = None, count: int = None
+):
+	#full mip chain (largest first), level 0 is the source itself
+	#with rects every frame rectangle is reduced on its own for as long as it maps to whole texels
+	return _chain([pixels], to_linear(pixels, gamma, premultiply), 0, filter_name, gamma, premultiply, rects, count)
+
+
+def reduce_rows(source, start: int, stop: int, filter_name: str = BOX, convert = None):
+	#rows [start, stop) of the next level, reading only the source rows under the filter
+	#convert turns source rows into linear values (None: source already is linear)
+	weights = taps(filter_name)
+	radius = len(weights) // 2
+	#clamped like the edge padding in _reduce_axis
+	rows = np.clip(np.arange(2 * start - radius + 1, 2 * stop + radius - 1), 0, source.shape[0] - 1)
+	values = source[rows] if convert is None else convert(source[rows])
+	if len(weights) == 2:
+		result = values.reshape(stop - start, 2, *values.shape[1:]).mean(1)
+	else:
+		result = np.zeros((stop - start,) + values.shape[1:], np.float32)
+		for k, weight in enumerate(weights):
+			result += weight * values[k:k + 2 * (stop - start):2]
+	return _reduce_axis(result, 1, weights)
+
+
+def generate_banded(
+		pixels, filter_name: str = BOX, gamma = True, premultiply = True,
+		rects: list = None, count: int = None, band_rows: int = 256
+):
+	#same levels as generate, but every level is filtered and converted in bands (band_rows at level 0,
+	#twice as many rows per level down) so level 0, which may be a memmap, never has a linear copy
+	#and the float working set is the previous level plus one band
+	result = [pixels]
+	source = pixels
+	convert = lambda values: to_linear(values, gamma, premultiply)
+	level = 0
+	while (source.shape[0] > 1 or source.shape[1] > 1) and (count is None or len(result) < count):
+		height, width = source.shape[:2]
+		if height == 1:
+			current = reduce(convert(source) if convert else source, filter_name)
+		else:
+			current = np.empty((height // 2, max(1, width // 2), 4), np.float32)
+			step = max(1, (band_rows << level) // 2)
+			for start in range(0, height // 2, step):
+				stop = min(start + step, height // 2)
+				current[start:stop] = reduce_rows(source, start, stop, filter_name, convert)
+		level += 1
+		if rects and filter_name != BOX:
+			for rect in rects:
+				src = _level_rect(rect, level - 1)
+				dest = _level_rect(rect, level)
+				if src is None or dest is None:
+					continue
+				x, y, w, h = src
+				nx, ny, nw, nh = dest
+				values = source[y:y + h, x:x + w]
+				current[ny:ny + nh, nx:nx + nw] = reduce(convert(values) if convert else values, filter_name)
+		converted = np.empty(current.shape, np.uint8)
+		step = max(1, band_rows << level)
+		for start in range(0, current.shape[0], step):
+			converted[start:start + step] = from_linear(current[start:start + step], gamma, premultiply)
+		result.append(converted)
+		source = current
+		convert = None
+	return result
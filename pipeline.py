@@ -0,0 +1,973 @@
+import sys
+import os
+from pathlib import Path
+import json
+import shutil
+import threading
+
+from core import Config, VMT, TF2Output
+from images import np, FORMATS, read_image, write_tga
+from cache import BuildCache, make_key, DEFAULT_MAX_BYTES
+from frames import FrameMetadata, DEFAULT_WORKERS, split_frame
+import layout
+import tools
+import tracing
+
+INVALID_CHARS = "<>:\"/\\|?*"
+
+VMT_DEFAULTS = {
+		"shader":             "SpriteCard",
+		"blend_frames":       False,
+		"depth_blend":        False,
+		"depth_blend_scale":  50.0,
+		"additive":           False,
+		"alpha_test":         False,
+		"no_cull":            False,
+		"over_bright_factor": 0.0,
+		"vertex_alpha":       True,
+		"vertex_color":       True,
+}
+
+#options that only apply to some shaders, mirrors VMTEdit.mode_widgets
+SHADER_OPTIONS = {
+		"SpriteCard":   [
+				"vertex_alpha", "vertex_color", "depth_blend", "depth_blend_scale",
+				"no_cull", "over_bright_factor", "additive"
+		],
+		"UnlitGeneric": ["vertex_alpha", "vertex_color", "alpha_test", "no_cull", "additive"],
+}
+TEXTURE_FORMATS = ["rgba8888", "bgra8888", "rgb888", "bgr888", "dxt1", "dxt5"]
+QUALITIES = ["fast", "cluster"]
+MIP_FILTERS = ["box", "kaiser", "lanczos"]
+#progress is reported per stage, in this order
+STAGES = ["validate", "sheet", "texture", "vmt", "copy"]
+GATED_OPTIONS = [
+		"depth_blend", "depth_blend_scale", "additive", "alpha_test", "no_cull",
+		"over_bright_factor", "vertex_alpha", "vertex_color"
+]
+
+
+class BuildError:
+	def __init__(self, code: str, message: str, path: str = None, details: dict = None):
+		self.code = code
+		self.message = message
+		self.path = path
+		self.details = details
+
+	def __str__(self):
+		return self.message
+
+	def __repr__(self):
+		return f"BuildError({self.code!r}, {self.message!r})"
+
+	def to_dict(self):
+		result = {"code": self.code, "message": self.message, "path": self.path}
+		if self.details:
+			result["details"] = self.details
+		return result
+
+
+class SequenceSpec:
+	def __init__(self, name: str, frames: list, looping: bool = True):
+		self.name = name
+		self.frames = [str(frame) for frame in frames]
+		self.looping = looping
+
+	@classmethod
+	def from_dict(cls, data: dict):
+		return cls(data.get("name", ""), data.get("frames", []), data.get("loop", True))
+
+	def to_dict(self):
+		return {"name": self.name, "loop": self.looping, "frames": list(self.frames)}
+
+
+class MaterialSpec:
+	def __init__(
+			self, name: str,
+			sequences: list = None,
+			game_dir = "",
+			vmt: dict = None,
+			workshop_export = False,
+			workshop_folder = "",
+			image_format = "auto",
+			quality = "fast",
+			mip_filter = "box",
+			mip_per_frame = False,
+			padding = 0,
+			trim = False,
+			memory_budget = 0,
+			compress_workers = 0,
+	):
+		self.name = name
+		self.sequences = sequences if sequences is not None else list()
+		self.game_dir = str(game_dir)
+		self.vmt = dict(vmt) if vmt else dict()
+		self.workshop_export = workshop_export
+		self.workshop_folder = workshop_folder
+		self.image_format = image_format
+		self.quality = quality
+		self.mip_filter = mip_filter
+		self.mip_per_frame = mip_per_frame
+		self.padding = padding
+		self.trim = trim
+		self.memory_budget = memory_budget  # MB for a native build, 0 keeps the whole sheet in memory
+		self.compress_workers = compress_workers  # processes for native compression, 0 or 1 compresses in-process
+
+	@classmethod
+	def from_dict(cls, data: dict, game_dir = "", workshop_export = False, workshop_folder = ""):
+		#the keyword arguments are used for values data does not set
+		return cls(
+				data.get("name", ""),
+				sequences = [SequenceSpec.from_dict(x) for x in data.get("sequences", [])],
+				game_dir = data.get("game_dir", game_dir),
+				vmt = data.get("vmt", None),
+				workshop_export = data.get("workshop_export", workshop_export),
+				workshop_folder = data.get("workshop_folder", workshop_folder),
+				image_format = data.get("format", "auto"),
+				quality = data.get("quality", "fast"),
+				mip_filter = data.get("mip_filter", "box"),
+				mip_per_frame = data.get("mip_per_frame", False),
+				padding = data.get("padding", 0),
+				trim = data.get("trim", False),
+				memory_budget = data.get("memory_budget", 0),
+				compress_workers = data.get("compress_workers", 0),
+		)
+
+	def to_dict(self):
+		return {
+				"name":             self.name,
+				"game_dir":         self.game_dir,
+				"workshop_export":  self.workshop_export,
+				"workshop_folder":  self.workshop_folder,
+				"format":           self.image_format,
+				"quality":          self.quality,
+				"mip_filter":       self.mip_filter,
+				"mip_per_frame":    self.mip_per_frame,
+				"padding":          self.padding,
+				"trim":             self.trim,
+				"memory_budget":    self.memory_budget,
+				"compress_workers": self.compress_workers,
+				"sequences":        [x.to_dict() for x in self.sequences],
+				"vmt":              dict(self.vmt),
+		}
+
+	@property
+	def tf2(self):
+		return TF2Output(Path(self.game_dir), self.name, self.workshop_folder)
+
+	def to_mks(self):
+		return [[seq.looping] + seq.frames for seq in self.sequences if seq.frames]
+
+	def vmt_kwargs(self):
+		result = dict(VMT_DEFAULTS)
+		result.update(self.vmt)
+		enabled = SHADER_OPTIONS.get(result["shader"], [])
+		for option in GATED_OPTIONS:
+			if option not in enabled:
+				result[option] = VMT_DEFAULTS["depth_blend_scale"] if option == "depth_blend_scale" else False
+		return result
+
+
+class BuildResult:
+	def __init__(self, material: str):
+		self.material = material
+		self.errors = list()
+		self.outputs = dict()
+		self.stats = dict()
+		self.trace_events = list()  # recorded in a worker process, handed to tracing.extend by the parent
+
+	@property
+	def ok(self):
+		return not self.errors
+
+	def to_dict(self):
+		return {
+				"material": self.material,
+				"ok":       self.ok,
+				"errors":   [x.to_dict() for x in self.errors],
+				"outputs":  {k: str(v) for k, v in self.outputs.items()},
+				"stats":    self.stats,
+		}
+
+
+class BuildCancelled(Exception):
+	pass
+
+
+class BuildControl:
+	#shared between a build and the thread that watches it: stage progress, cancellation and the tools it runs
+	def __init__(self, progress = None, runner: tools.ToolRunner = None):
+		self.progress = progress
+		self.runner = runner if runner is not None else tools.default_runner()
+		self.cancelled = threading.Event()
+		self.processes = set()
+		self._lock = threading.Lock()
+		self._span = None
+
+	def check(self):
+		if self.cancelled.is_set():
+			raise BuildCancelled()
+
+	def stage(self, name: str):
+		self.check()
+		self.end_stage()
+		if tracing.enabled:
+			self._span = tracing.span(name).__enter__()
+		if self.progress:
+			self.progress(name)
+			self.check()
+
+	def end_stage(self):
+		if self._span is not None:
+			self._span.__exit__(None, None, None)
+			self._span = None
+
+	def cancel(self):
+		self.cancelled.set()
+		with self._lock:
+			processes = list(self.processes)
+		for process in processes:
+			process.kill()
+
+	def _started(self, process):
+		with self._lock:
+			self.processes.add(process)
+		#cancel() may have run before the process was registered
+		if self.cancelled.is_set():
+			process.kill()
+
+	def _finished(self, process):
+		with self._lock:
+			self.processes.discard(process)
+
+	def call(self, tf2: TF2Output, tool: str, args: list, cwd: Path):
+		#runs a tool of the runner's toolchain in cwd, returns its tools.ToolResult
+		self.check()
+		with tracing.span(tool, "tool", args = [str(x) for x in args], toolchain = self.runner.toolchain.name) as span:
+			run = self.runner.run(tf2, tool, args, cwd, self._started, self._finished, self.cancelled)
+			span.set(returncode = run.returncode, timed_out = run.timed_out)
+		self.check()
+		return run
+
+
+def output_snapshot(tf2: TF2Output):
+	#{path: mtime_ns} of this material's files in its output directories, None for missing directories
+	result = dict()
+	for directory in [tf2.src, tf2.final, tf2.alternate_final]:
+		if not directory.is_dir():
+			result[directory] = None
+			continue
+		for path in directory.glob(tf2.material + ".*"):
+			result[path] = path.stat().st_mtime_ns
+	return result
+
+
+def remove_partial_outputs(tf2: TF2Output, before: dict):
+	#drop the files a cancelled build created or rewrote, and the directories it created
+	for directory in [tf2.src, tf2.final, tf2.alternate_final]:
+		if not directory.is_dir():
+			continue
+		for path in directory.glob(tf2.material + ".*"):
+			if before.get(path) != path.stat().st_mtime_ns:
+				path.unlink(missing_ok = True)
+		if before.get(directory, 0) is None and not any(directory.iterdir()):
+			directory.rmdir()
+
+
+def make_mks(to_mks: list):
+	mks_lines = list()
+	for i, sequence in enumerate(to_mks):
+		mks_lines.append(f"sequence {i}")
+		if sequence[0]: mks_lines.append("loop")
+		for path in sequence[1:]:
+			mks_lines.append(f"frame {path} 1")
+	return "\n".join(mks_lines)
+
+
+def validate(
+		spec: MaterialSpec, backend = "tools", metadata: FrameMetadata = None, workers: int = DEFAULT_WORKERS,
+		runner: tools.ToolRunner = None
+):
+	#frames are stat'ed and their headers read on a thread pool, metadata keeps them across runs
+	#runner: whose toolchain the tools backend would use (default: this process's)
+	errors = list()
+	tf2 = spec.tf2
+	native = backend == "native"
+
+	if not tf2.material or any(x in tf2.material for x in INVALID_CHARS):
+		errors.append(BuildError("material_name", "Invalid material name."))
+
+	if any(x in spec.workshop_folder for x in INVALID_CHARS):
+		errors.append(BuildError("workshop_folder", "Invalid workshop folder name."))
+
+	if native:
+		if not np:
+			errors.append(BuildError("numpy", "The native backend needs numpy installed."))
+		if not spec.game_dir or not os.path.isdir(spec.game_dir):
+			errors.append(BuildError("game_dir", "Team Fortress 2 not found!", spec.game_dir))
+	elif not (runner if runner is not None else tools.default_runner()).available(tf2):
+		errors.append(BuildError("game_dir", "Team Fortress 2 not found!", spec.game_dir))
+
+	if native:
+		if spec.image_format != "auto" and spec.image_format not in TEXTURE_FORMATS:
+			errors.append(BuildError("format", f"Unknown texture format: {spec.image_format}"))
+		if spec.quality not in QUALITIES:
+			errors.append(BuildError("quality", f"Unknown compression quality: {spec.quality}"))
+		if spec.mip_filter not in MIP_FILTERS:
+			errors.append(BuildError("mip_filter", f"Unknown mipmap filter: {spec.mip_filter}"))
+		if not isinstance(spec.padding, int) or spec.padding < 0:
+			errors.append(BuildError("padding", f"Invalid frame padding: {spec.padding}"))
+		if not isinstance(spec.memory_budget, int) or spec.memory_budget < 0:
+			errors.append(BuildError("memory_budget", f"Invalid memory budget: {spec.memory_budget}"))
+		if not isinstance(spec.compress_workers, int) or spec.compress_workers < 0:
+			errors.append(BuildError("compress_workers", f"Invalid compression worker count: {spec.compress_workers}"))
+
+	if not spec.sequences:
+		errors.append(BuildError("no_sequences", "No sequences present"))
+
+	metadata = metadata if metadata is not None else FrameMetadata()
+	frames = metadata.scan([path for seq in spec.sequences for path in seq.frames], workers)
+
+	for seq in spec.sequences:
+		if not seq.frames:
+			errors.append(BuildError("empty_sequence", f"Empty sequence:\n{seq.name}"))
+			continue
+		for path in seq.frames:
+			if frames[path] is None:
+				errors.append(BuildError("missing_file", f"File moved or missing:\n{path}", path))
+
+	sizes = dict()
+	err_square = False
+	err_mismatch = False
+	err_numpy = False
+
+	for seq in spec.to_mks():
+		for p in seq[1:]:
+			info = frames[p]
+			if info is None or p in sizes: continue
+			width, height = info["width"], info["height"]
+			if "error" in info:
+				errors.append(BuildError("unreadable", f"Cannot read image header:\n{p}", p, {"error": info["error"]}))
+				continue
+			#png frames are decoded here for either backend (converted to tga for mksheet), mksheet reads tga itself
+			if info["format"] != "tga" and not np and not err_numpy:
+				err_numpy = True
+				errors.append(BuildError("numpy", f"Reading {info['format']} frames needs numpy installed.", p))
+			if (native or info["format"] != "tga") and not info["supported"]:
+				errors.append(BuildError(
+						"unsupported",
+						f"Unsupported {info['format']} (must be {FORMATS[info['format']].requirements}):\n{p}", p,
+						{"format": info["format"], "depth": info["depth"]}
+				))
+			#mksheet needs equally sized square frames
+			if not native and width != height:
+				err_square = True
+				errors.append(BuildError(
+						"non_square", f"File has non-square resolution ({width}x{height})\n{p}", p,
+						{"width": width, "height": height}
+				))
+			elif not native and sizes and (width, height) not in sizes.values() and not err_mismatch:
+				first = next(iter(sizes))
+				errors.append(BuildError(
+						"size_mismatch", f"Files have different resolutions.", p,
+						{"expected": list(sizes[first]), "expected_path": first, "found": [width, height]}
+				))
+				err_mismatch = True
+			sizes[p] = (width, height)
+
+	#the native sheet only packs unique images, so its capacity is checked when it is built
+	if sizes and not native and not err_square and not err_mismatch:
+		try:
+			layout.pack(list(sizes.values()), spec.padding if native else 0)
+		except layout.PackError:
+			errors.append(BuildError(
+					"capacity", f"Too much data.\n(Final composite must fit in {layout.MAX_SIZE}x{layout.MAX_SIZE} texture)",
+					details = {"frames": len(sizes), "max_size": layout.MAX_SIZE}
+			))
+
+	return errors
+
+
+def write_vmt(spec: MaterialSpec, tf2: TF2Output):
+	custom_export = "Effects/workshop/" if spec.workshop_export else ""
+	path = tf2.final / (tf2.material + ".vmt")
+	text = str(VMT(
+			tf2.material,
+			custom_path = custom_export,
+			custom_folder = spec.workshop_folder,
+			**spec.vmt_kwargs()
+	))
+	if path.is_file():
+		with open(path, "r") as fl:
+			if fl.read() == text:
+				return path
+	with open(path, "w") as fl:
+		fl.write(text)
+	return path
+
+
+def stage_frames(mks: str, directory: Path):
+	#mksheet only reads tga and splits its lines at spaces: png frames are converted into directory, frames with
+	#spaces in their path are linked (or copied) there, every other frame is named by its absolute path
+	staged = dict()
+	lines = list()
+	for line in mks.splitlines():
+		words = line.split()
+		if len(words) > 1 and words[0].lower() == "frame":
+			path, rest = split_frame(line)
+			source = os.path.abspath(path)
+			png = source.lower().endswith(".png")
+			if png or any(x.isspace() for x in source):
+				if source not in staged:
+					staged[source] = f"frame{len(staged):05d}.tga"
+					dest = directory / staged[source]
+					if png:
+						with tracing.span("convert", "io", file = source):
+							write_tga(dest, read_image(source))
+					else:
+						try:
+							os.link(source, dest)
+						except OSError:
+							shutil.copyfile(source, dest)
+				source = staged[source]
+			line = " ".join(["frame", source] + rest)
+		lines.append(line)
+	return "\n".join(lines) + "\n"
+
+
+def tool_failed(run: tools.ToolResult, result: BuildResult):
+	#adds an error if the tool failed, its output goes into the message
+	result.stats.setdefault("tools", []).append({
+			"name": run.name, "returncode": run.returncode, "seconds": round(run.seconds, 4)
+	})
+	if run.ok:
+		return False
+	output = run.tail()
+	result.errors.append(BuildError(
+			run.name, run.describe() + (f":\n{output}" if output else ""), details = run.to_dict()
+	))
+	return True
+
+
+def make_sheet_tools(tf2: TF2Output, mks: str, result: BuildResult, control: BuildControl):
+	#mksheet writes next to the mks, so every build gets its own working directory
+	with control.runner.job("mksheet") as scratch:
+		path_mks = scratch / (tf2.material + ".mks")
+
+		try:
+			frames_mks = stage_frames(mks, scratch)
+		except (OSError, ValueError) as e:
+			result.errors.append(BuildError("sheet", f"Could not stage frames for mksheet:\n{e}"))
+			return
+		with open(path_mks, "w") as fl:
+			fl.write(frames_mks)
+
+		if tool_failed(control.call(tf2, "mksheet", [path_mks.name], scratch), result):
+			return
+		tf2.mkdir()
+		for name in [tf2.material + ".sht", tf2.material + ".tga"]:
+			source = scratch / name
+			dest = tf2.src / name
+			if not source.is_file():
+				result.errors.append(BuildError("mksheet", f"mksheet did not produce {name}", str(source)))
+				continue
+			with tracing.span("move", "io", file = name, bytes = source.stat().st_size):
+				if dest.is_file():
+					os.remove(dest)
+				shutil.move(source, dest)
+		#the kept mks names the frames, not the staged copies
+		with open(tf2.src / path_mks.name, "w") as fl:
+			fl.write(mks)
+
+
+def make_sheet_native(spec: MaterialSpec, tf2: TF2Output, mks: str, result: BuildResult):
+	import sheet
+
+	scratch = None
+	if spec.memory_budget:
+		#the sheet is composited into a file next to the outputs, not into memory
+		tf2.mkdir()
+		scratch = tf2.src / (tf2.material + ".composite.tmp")
+	try:
+		sequences = sheet.parse_mks(mks)
+		composite = sheet.composite(
+				sequences, padding = spec.padding, trim = spec.trim, scratch = scratch,
+				budget = spec.memory_budget << 20
+		)
+	except layout.PackError:
+		result.errors.append(BuildError(
+				"capacity", f"Too much data.\n(Final composite must fit in {layout.MAX_SIZE}x{layout.MAX_SIZE} texture)"
+		))
+		return
+	except (OSError, ValueError) as e:
+		result.errors.append(BuildError("sheet", f"Could not build sheet:\n{e}"))
+		return
+	result.stats["layout"] = composite.layout.to_dict()
+	result.stats["dedupe"] = composite.stats
+	if composite.band_rows:
+		result.stats["stream"] = {"budget_mb": spec.memory_budget, "band_rows": composite.band_rows}
+
+	try:
+		tf2.mkdir()
+		with open(tf2.src / (tf2.material + ".mks"), "w") as fl:
+			fl.write(mks)
+		composite.write_sht(tf2.src / (tf2.material + ".sht"))
+		with tracing.span("tga", "native", bytes = composite.width * composite.height * 4):
+			composite.write_tga(tf2.src / (tf2.material + ".tga"))
+		if spec.trim:
+			#the .sht only has a uv rectangle per frame, the trim offsets go next to it
+			path = tf2.src / (tf2.material + ".trim.json")
+			with open(path, "w") as fl:
+				json.dump(composite.trim_dict(), fl, indent = 1)
+			result.outputs["trim"] = path
+	except BaseException:
+		composite.close()
+		raise
+	return composite
+
+
+def make_texture_tools(tf2: TF2Output, result: BuildResult, control: BuildControl):
+	result_sht = tf2.src / (tf2.material + ".sht")
+	result.outputs["sht"] = result_sht
+	result.outputs["tga"] = tf2.src / (tf2.material + ".tga")
+	#vtex writes below the game directory, the working directory only catches stray files
+	with control.runner.job("vtex") as scratch:
+		run = control.call(tf2, "vtex", ["-nopause", "-game", tf2.tf.absolute(), result_sht.absolute()], scratch)
+	if tool_failed(run, result):
+		return
+
+	vtf = tf2.final / (tf2.material + ".vtf")
+	if not vtf.is_file():
+		result.errors.append(BuildError("vtex", f"vtex did not produce {vtf}", str(vtf)))
+		return
+	result.outputs["vtf"] = vtf
+
+
+def make_texture_native(spec: MaterialSpec, tf2: TF2Output, composite, result: BuildResult):
+	import vtf
+	import mips
+
+	result.outputs["sht"] = tf2.src / (tf2.material + ".sht")
+	result.outputs["tga"] = tf2.src / (tf2.material + ".tga")
+	tf2.mkdir_final()
+	path = tf2.final / (tf2.material + ".vtf")
+	rows = composite.band_rows
+	if spec.image_format == "auto":
+		image_format = vtf.auto_format(composite.pixels, rows)
+	else:
+		image_format = vtf.FORMAT_NAMES[spec.image_format]
+	with tracing.span("mips", "native", filter = spec.mip_filter, band_rows = rows):
+		rects = list(composite.rects.values()) if spec.mip_per_frame else None
+		if rows:
+			levels = mips.generate_banded(composite.pixels, spec.mip_filter, rects = rects, band_rows = rows)
+		else:
+			levels = mips.generate(composite.pixels, spec.mip_filter, rects = rects)
+	try:
+		#streaming builds keep their bands in-process, the workers need the levels in shared memory
+		workers = None if rows else spec.compress_workers
+		with tracing.span("vtf", "native", format = image_format, quality = spec.quality, workers = workers):
+			vtf.write_vtf(
+					path, composite.pixels, sheet = composite.sht_bytes(),
+					image_format = image_format, quality = spec.quality, mip_levels = levels, band_rows = rows,
+					workers = workers
+			)
+	except (OSError, ValueError, vtf.CompressionError) as e:
+		result.errors.append(BuildError("vtf", f"Could not write vtf:\n{e}", str(path)))
+		return
+	result.outputs["vtf"] = path
+
+
+def mks_frames(mks: str):
+	result = list()
+	for line in mks.splitlines():
+		words = line.split()
+		if len(words) > 1 and words[0].lower() == "frame":
+			result.append(split_frame(line)[0])
+	return result
+
+
+def stage_keys(spec: MaterialSpec, mks: str, backend: str, cache, toolchain: str = tools.SourceToolchain.name):
+	#sheet: everything the sheet depends on, texture: the sheet plus the texture options
+	#other toolchains than the Source SDK make other files, so they are part of the key
+	frames = sorted(set(mks_frames(mks)))
+	producer = backend if backend == "native" or toolchain == tools.SourceToolchain.name else f"{backend}:{toolchain}"
+	sheet_key = make_key(
+			"sheet", producer, mks, [[path, cache.file_hash(path)] for path in frames],
+			spec.padding, spec.trim
+	)
+	texture_key = make_key(
+			"texture", sheet_key, spec.image_format, spec.quality, spec.mip_filter, spec.mip_per_frame
+	)
+	return sheet_key, texture_key
+
+
+def sheet_files(spec: MaterialSpec, tf2: TF2Output, backend: str):
+	result = {
+			"mks": tf2.src / (tf2.material + ".mks"),
+			"sht": tf2.src / (tf2.material + ".sht"),
+			"tga": tf2.src / (tf2.material + ".tga"),
+	}
+	if backend == "native" and spec.trim:
+		result["trim"] = tf2.src / (tf2.material + ".trim.json")
+	return result
+
+
+def build(
+		spec: MaterialSpec, mks: str = None, check = True, backend = "tools", cache = None,
+		metadata: FrameMetadata = None, control: BuildControl = None
+):
+	result = BuildResult(spec.name)
+	control = control if control is not None else BuildControl()
+	tf2 = spec.tf2
+	with tracing.span("build", "build", material = spec.name, backend = backend):
+		try:
+			if check:
+				control.stage("validate")
+				result.errors += validate(spec, backend = backend, metadata = metadata, runner = control.runner)
+				if result.errors:
+					return result
+
+			control.check()
+			before = output_snapshot(tf2)
+			try:
+				_build(spec, mks, backend, cache, control, result)
+			except BuildCancelled:
+				remove_partial_outputs(tf2, before)
+				raise
+		except BuildCancelled:
+			result.errors.append(BuildError("cancelled", "Build cancelled."))
+			result.outputs.clear()
+		finally:
+			control.end_stage()
+	return result
+
+
+def _build(spec: MaterialSpec, mks: str, backend: str, cache, control: BuildControl, result: BuildResult):
+	if mks is None:
+		mks = make_mks(spec.to_mks())
+
+	tf2 = spec.tf2
+	keys = None
+	if cache is not None:
+		try:
+			keys = stage_keys(spec, mks, backend, cache, control.runner.toolchain.name)
+		except OSError:
+			keys = None
+
+	control.stage("sheet")
+	sheet_outputs = sheet_files(spec, tf2, backend)
+	if "trim" not in sheet_outputs:
+		#offsets of an earlier trimmed build no longer match the sheet
+		(tf2.src / (tf2.material + ".trim.json")).unlink(missing_ok = True)
+	vtf_path = tf2.final / (tf2.material + ".vtf")
+	with tracing.span("cache_restore", "cache"):
+		sheet_cached = keys is not None and cache.restore("sheet", keys[0], sheet_outputs)
+		texture_cached = sheet_cached and cache.restore("texture", keys[1], {"vtf": vtf_path})
+	if keys is not None:
+		if not sheet_cached:
+			cache.miss("texture")
+		result.stats["cache"] = {
+				"sheet":   "hit" if sheet_cached else "miss",
+				"texture": "hit" if texture_cached else "miss",
+		}
+
+	if texture_cached:
+		control.stage("texture")
+		result.outputs.update(sheet_outputs)
+		result.outputs["vtf"] = vtf_path
+	elif sheet_cached and backend != "native":
+		control.stage("texture")
+		make_texture_tools(tf2, result, control)
+	elif backend == "native":
+		composite = make_sheet_native(spec, tf2, mks, result)
+		if not result.ok:
+			return
+		try:
+			control.stage("texture")
+			make_texture_native(spec, tf2, composite, result)
+		finally:
+			composite.close()
+	else:
+		make_sheet_tools(tf2, mks, result, control)
+		if not result.ok:
+			return
+		control.stage("texture")
+		make_texture_tools(tf2, result, control)
+	if not result.ok:
+		return
+
+	if keys is not None:
+		with tracing.span("cache_put", "cache"):
+			if not sheet_cached:
+				cache.put("sheet", keys[0], sheet_outputs)
+			if not texture_cached:
+				cache.put("texture", keys[1], {"vtf": vtf_path})
+			cache.flush()
+
+	control.stage("vmt")
+	vtf = result.outputs["vtf"]
+	vmt = write_vmt(spec, tf2)
+	result.outputs["vmt"] = vmt
+
+	if spec.workshop_export:
+		control.stage("copy")
+		tf2.mkdir_alt()
+		for key, source, dest in [
+				["vmt", vmt, tf2.alternate_final / f"{tf2.material}.vmt"],
+				["vtf", vtf, tf2.alternate_final / f"{tf2.material}.vtf"]
+		]:
+			with tracing.span("move", "io", file = dest.name, bytes = source.stat().st_size):
+				if dest.is_file():
+					os.remove(dest)
+				shutil.move(source, dest)
+			result.outputs[key] = dest
+		tf2.final.rmdir()
+
+
+def load_specs(path: Path, game_dir = "", **defaults):
+	#defaults: workshop_export and workshop_folder of specs that do not set them
+	with open(path, "r") as fl:
+		data = json.load(fl)
+	from project import Project, is_project
+	if is_project(data):
+		data = Project.material_dicts(data, Path(path).parent.absolute())
+	if isinstance(data, dict):
+		data = [data]
+	return [MaterialSpec.from_dict(x, game_dir = game_dir, **defaults) for x in data]
+
+
+def config_defaults(profile: str = None):
+	#spec values from the config keys a profile can override (Config.PROFILE_KEYS)
+	if not profile and not os.getenv("LOCALAPPDATA"):
+		return {"game_dir": ""}
+	config = Config(profile = profile)
+	return {
+			"game_dir":        config.tf2,
+			"workshop_export": config.workshop_export,
+			"workshop_folder": config.workshop_folder,
+	}
+
+
+def print_result(result: BuildResult):
+	print(f"{'OK' if result.ok else 'FAILED'}: {result.material}")
+	if "layout" in result.stats:
+		packed = result.stats["layout"]
+		print(
+				f"\tsheet {packed['width']}x{packed['height']}, {packed['frames']} frames, "
+				f"{packed['efficiency']:.1%} used"
+		)
+	if "dedupe" in result.stats:
+		dedupe = result.stats["dedupe"]
+		print(
+				f"\t{dedupe['unique']} unique images for {dedupe['frames']} frames, "
+				f"{dedupe['texels_saved']} texels saved"
+		)
+		if dedupe["texels_trimmed"]:
+			print(f"\t{dedupe['texels_trimmed']} transparent texels trimmed")
+	if "shard" in result.stats:
+		part = result.stats["shard"]
+		print(f"\tpart of {part['of']}: " + ", ".join(entry["name"] or str(entry["sequence"]) for entry in part["sequences"]))
+	if "verify" in result.stats:
+		from verify import describe
+		print("\tverified " + describe(result.stats["verify"]))
+	if "cache" in result.stats:
+		print("\tcache: " + ", ".join(f"{k} {v}" for k, v in result.stats["cache"].items()))
+	for error in result.errors:
+		print("\t" + str(error).replace("\n", "\n\t"))
+
+
+def cli(argv: list):
+	import argparse
+	parser = argparse.ArgumentParser(
+			prog = "vtexgui",
+			description = "Build VTF/VMT/SHT files from material spec files without the GUI."
+	)
+	parser.add_argument("specs", nargs = "*", help = "material spec json files (one material or a list)")
+	parser.add_argument(
+			"--game", default = None,
+			help = "Team Fortress 2 directory for every material, also those that set their own (default: from config)"
+	)
+	parser.add_argument(
+			"--profile", default = None,
+			help = "take the game directory and workshop export settings from a named config profile"
+	)
+	parser.add_argument("--json", action = "store_true", help = "print results as json")
+	parser.add_argument(
+			"--native", action = "store_true",
+			help = "build the sheet and vtf in-process instead of running mksheet.exe/vtex.exe"
+	)
+	parser.add_argument(
+			"--toolchain", choices = list(tools.TOOLCHAINS), default = None,
+			help = "tools that build without --native: the Source SDK binaries or deterministic local stand-ins"
+	)
+	parser.add_argument("--tool-timeout", type = float, default = None, help = "seconds before mksheet/vtex are killed")
+	parser.add_argument("--tool-jobs", type = int, default = None, help = "mksheet/vtex runs at once per process")
+	parser.add_argument("--format", choices = ["auto"] + TEXTURE_FORMATS, help = "texture format for --native")
+	parser.add_argument("--quality", choices = QUALITIES, help = "dxt compression: fast endpoints or iterative cluster fit")
+	parser.add_argument("--mip-filter", choices = MIP_FILTERS, help = "mipmap filter for --native")
+	parser.add_argument(
+			"--mip-per-frame", action = "store_true",
+			help = "filter mipmaps per frame so frames do not bleed into their neighbours"
+	)
+	parser.add_argument("--padding", type = int, help = "gutter in texels around every frame for --native")
+	parser.add_argument(
+			"--trim", action = "store_true",
+			help = "pack only the non-transparent part of each frame, Source stretches it over the whole particle (offsets go to <material>.trim.json)"
+	)
+	parser.add_argument(
+			"--memory-budget", type = int, default = None,
+			help = "MB per --native build: composite into a file and filter/encode it in row bands that fit"
+	)
+	parser.add_argument(
+			"--compress-workers", type = int, default = None,
+			help = "compress the --native texture in this many processes through shared memory"
+	)
+	parser.add_argument("--cache", default = None, help = "build cache directory, unchanged stages are not rebuilt")
+	parser.add_argument(
+			"--cache-size", type = int, default = DEFAULT_MAX_BYTES >> 20, help = "build cache size limit in MB"
+	)
+	parser.add_argument("--cache-stats", action = "store_true", help = "print build cache statistics")
+	parser.add_argument(
+			"-j", "--jobs", type = int, default = 1,
+			help = "build materials in parallel worker processes (0: one per cpu)"
+	)
+	parser.add_argument(
+			"--watch", action = "store_true",
+			help = "keep running and rebuild the materials whose frames change (uses --jobs workers)"
+	)
+	parser.add_argument("--debounce", type = float, default = 0.5, help = "seconds of quiet before a --watch rebuild")
+	parser.add_argument("--poll", action = "store_true", help = "watch by polling mtimes instead of inotify")
+	parser.add_argument(
+			"--trace", default = None,
+			help = "write a Chrome trace-event json of every stage and tool run (or set VTEXGUI_TRACE)"
+	)
+	parser.add_argument(
+			"--verify", action = "store_true",
+			help = "read every built vtf back and compare its sheet and frames with the source images"
+	)
+	parser.add_argument("--check", action = "store_true", help = "only validate, do not build")
+	args = parser.parse_args(argv)
+	if not args.specs and not args.cache_stats:
+		parser.error("no spec files given")
+	if args.cache_stats and not args.cache:
+		parser.error("--cache-stats needs --cache")
+	if args.trace:
+		#written at exit, after the workers' events were collected
+		tracing.enable(args.trace)
+	#before any worker starts, they inherit the settings
+	tools.configure(args.toolchain, args.tool_timeout, args.tool_jobs)
+	cache = BuildCache(Path(args.cache), args.cache_size << 20) if args.cache else None
+	metadata = FrameMetadata(Path(args.cache) / "frames.json" if args.cache else None)
+
+	backend = "native" if args.native else "tools"
+	if args.profile and args.profile not in Config().profiles:
+		parser.error(f"unknown config profile '{args.profile}'")
+	defaults = config_defaults(args.profile)
+	import shard
+	#spec files that could not be read keep their place in the output
+	items = list()
+	shard_of = dict()  # shard material name -> its entry in the mapping
+	for path in args.specs:
+		try:
+			specs = load_specs(Path(path), **defaults)
+		except (OSError, ValueError) as e:
+			result = BuildResult(str(path))
+			result.errors.append(BuildError("spec", f"Could not read spec file: {e}", str(path)))
+			items.append(result)
+			continue
+
+		for spec in specs:
+			if args.game is not None:
+				spec.game_dir = args.game
+			if args.format:
+				spec.image_format = args.format
+			if args.quality:
+				spec.quality = args.quality
+			if args.mip_filter:
+				spec.mip_filter = args.mip_filter
+			if args.mip_per_frame:
+				spec.mip_per_frame = True
+			if args.padding is not None:
+				spec.padding = args.padding
+			if args.trim:
+				spec.trim = True
+			if args.memory_budget is not None:
+				spec.memory_budget = args.memory_budget
+			if args.compress_workers is not None:
+				spec.compress_workers = args.compress_workers
+			#materials that overflow one sheet are built as <material>_0, _1, ... with a mapping next to the sources
+			shards, mapping = shard.split(spec, metadata)
+			if mapping is not None:
+				if not args.json:
+					print(shard.describe(mapping))
+				if not args.check:
+					try:
+						shard.write_mapping(spec, mapping)
+					except OSError as e:
+						print(f"Could not write the shard mapping of {spec.name}: {e}", file = sys.stderr)
+				for entry in mapping["shards"]:
+					shard_of[entry["material"]] = dict(entry, of = spec.name)
+			items += shards
+
+	def report(result: BuildResult):
+		if result.material in shard_of:
+			result.stats["shard"] = shard_of[result.material]
+		if not args.json:
+			print_result(result)
+
+	def check_output(spec: MaterialSpec, result: BuildResult):
+		if args.verify:
+			import verify
+			verify.verify_result(spec, result)
+		return result
+
+	results = list()
+	specs = [x for x in items if isinstance(x, MaterialSpec)]
+	if args.jobs != 1 and not args.check and len(specs) > 1:
+		import batch
+		built = iter(batch.build_all(
+				specs, workers = args.jobs or None, backend = backend,
+				cache_dir = args.cache, cache_size = args.cache_size << 20,
+		))
+		for item in items:
+			result = check_output(item, next(built)) if isinstance(item, MaterialSpec) else item
+			results.append(result)
+			report(result)
+	else:
+		for item in items:
+			if not isinstance(item, MaterialSpec):
+				result = item
+			elif args.check:
+				result = BuildResult(item.name)
+				result.errors += validate(item, backend = backend, metadata = metadata)
+			else:
+				result = check_output(item, build(item, backend = backend, cache = cache, metadata = metadata))
+			results.append(result)
+			report(result)
+
+	metadata.save()
+	if args.json:
+		print(json.dumps([x.to_dict() for x in results], indent = 2))
+	elif len(results) > 1:
+		failed = sum(not x.ok for x in results)
+		print(f"{len(results) - failed} built, {failed} failed")
+	if args.cache_stats:
+		print(json.dumps(cache.stats(), indent = 2))
+
+	if args.watch and specs:
+		import watch
+		watcher = watch.Watcher(
+				specs, workers = args.jobs or os.cpu_count() or 1, debounce = args.debounce, backend = backend,
+				cache_dir = args.cache, cache_size = args.cache_size << 20, polling = args.poll,
+				report = report
+		)
+		print(f"Watching {len(watcher.users)} frames of {len(specs)} materials, ctrl+c to stop")
+		try:
+			watcher.run()
+		except KeyboardInterrupt:
+			pass
+	return 0 if all(x.ok for x in results) else 1
+
+
+if __name__ == '__main__':
+	sys.exit(cli(sys.argv[1:]))
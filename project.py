@@ -0,0 +1,104 @@
+import os
+from pathlib import Path
+import json
+
+from core import write_json
+from pipeline import MaterialSpec
+from frames import FrameMetadata
+
+PROJECT_FORMAT = "vtexgui-project"
+PROJECT_VERSION = 1
+PROJECT_SUFFIX = ".vtproj"
+#per-frame metadata lives next to the project and is only read when a frame is looked up
+META_SUFFIX = ".meta.json"
+
+
+class ProjectError(ValueError):
+	pass
+
+
+def _relative(path: str, base: Path):
+	#frames below the project directory are stored relative to it so the project can be moved
+	try:
+		relative = os.path.relpath(path, base)
+	except ValueError:
+		return path
+	return path if relative.startswith("..") else relative
+
+
+def _absolute(path: str, base: Path):
+	return path if os.path.isabs(path) else os.path.normpath(base / path)
+
+
+class Project:
+	def __init__(self, materials: list = None, path: Path = None):
+		self.materials = materials if materials is not None else list()
+		self.path = Path(path) if path is not None else None
+		self.metadata = FrameMetadata(self.meta_path(self.path) if self.path else None)
+
+	@staticmethod
+	def meta_path(path: Path):
+		return path.with_name(path.name + META_SUFFIX)
+
+	@property
+	def frames(self):
+		#every frame path once, in material/sequence order
+		return list(dict.fromkeys(
+				frame for spec in self.materials for seq in spec.sequences for frame in seq.frames
+		))
+
+	@staticmethod
+	def upgrade(data: dict):
+		if not isinstance(data, dict) or data.get("format") != PROJECT_FORMAT:
+			raise ProjectError("Not a VtexGui project file")
+		version = data.get("version")
+		if not isinstance(version, int) or version > PROJECT_VERSION:
+			raise ProjectError(f"Unsupported project version: {version}")
+		return data
+
+	@classmethod
+	def material_dicts(cls, data: dict, base: Path):
+		#spec dicts with the frame paths resolved against the project directory
+		data = cls.upgrade(data)
+		materials = list()
+		for item in data.get("materials", []):
+			item = dict(item)
+			item["sequences"] = [
+					dict(seq, frames = [_absolute(frame, base) for frame in seq.get("frames", [])])
+					for seq in item.get("sequences", [])
+			]
+			materials.append(item)
+		return materials
+
+	@classmethod
+	def from_dict(cls, data: dict, base: Path, game_dir = "", path: Path = None):
+		return cls([MaterialSpec.from_dict(x, game_dir = game_dir) for x in cls.material_dicts(data, base)], path)
+
+	def to_dict(self, base: Path):
+		materials = list()
+		for spec in self.materials:
+			item = spec.to_dict()
+			for seq in item["sequences"]:
+				seq["frames"] = [_relative(frame, base) for frame in seq["frames"]]
+			materials.append(item)
+		return {"format": PROJECT_FORMAT, "version": PROJECT_VERSION, "materials": materials}
+
+	@classmethod
+	def load(cls, path: Path, game_dir = ""):
+		path = Path(path)
+		with open(path, "r") as fl:
+			data = json.load(fl)
+		return cls.from_dict(data, path.parent.absolute(), game_dir, path)
+
+	def save(self, path: Path = None):
+		path = Path(path) if path is not None else self.path
+		if path is None:
+			raise ProjectError("No project path")
+		write_json(path, self.to_dict(path.parent.absolute()))
+		self.metadata.prune(self.frames)
+		self.metadata.save(self.meta_path(path))
+		self.path = path
+
+
+def is_project(data):
+	return isinstance(data, dict) and data.get("format") == PROJECT_FORMAT
@@ -0,0 +1,160 @@
+from core import write_json
+from pipeline import MaterialSpec
+from frames import FrameMetadata
+import layout
+
+SHARDS_SUFFIX = ".shards.json"
+
+
+def shard_name(name: str, index: int):
+	#suffixes are stable for the same plan: <material>_0, <material>_1, ...
+	return f"{name}_{index}"
+
+
+def _pack_area(sizes: dict, padding: int, max_size: int):
+	#sheet area of the distinct frames in sizes (path -> (w, h)), None if they do not fit
+	try:
+		packed = layout.pack(list(sizes.values()), padding, max_size)
+	except layout.PackError:
+		return None
+	return packed.width * packed.height
+
+
+def _frame_area(size: tuple, padding: int):
+	return (size[0] + 2 * padding) * (size[1] + 2 * padding)
+
+
+def _pieces(index: int, frames: list, sizes: dict, padding: int, max_size: int):
+	#(sequence index, start, stop) runs of frames that fit on one sheet, the whole sequence if it does
+	result = list()
+	start = 0
+	while start < len(frames):
+		#grow the run by doubling, then bisect the largest count that still packs
+		fits, count = 0, 1
+		while start + fits < len(frames):
+			stop = min(start + count, len(frames))
+			if _pack_area({x: sizes[x] for x in frames[start:stop]}, padding, max_size) is None:
+				break
+			fits = stop - start
+			count *= 2
+		if not fits:
+			return None
+		low, high = fits, min(count, len(frames) - start)
+		while high - low > 1:
+			middle = (low + high) // 2
+			if _pack_area({x: sizes[x] for x in frames[start:start + middle]}, padding, max_size) is None:
+				high = middle
+			else:
+				low = middle
+		result.append((index, start, start + low))
+		start += low
+	return result
+
+
+def plan(sequences: list, sizes: dict, padding: int = 0, max_size: int = layout.MAX_SIZE):
+	#sequences: frame path lists, sizes: path -> (w, h)
+	#returns shards as lists of (sequence index, start, stop), or None if a single frame does not fit
+	#sequences stay whole unless they alone overflow a sheet, pieces go largest first to the sheet that grows least
+	pieces = list()
+	for i, frames in enumerate(sequences):
+		result = _pieces(i, frames, sizes, padding, max_size)
+		if result is None:
+			return None
+		pieces += result
+
+	def piece_area(piece):
+		i, start, stop = piece
+		return sum(_frame_area(sizes[x], padding) for x in set(sequences[i][start:stop]))
+
+	shards = list()  # [pieces, path -> size, sheet area]
+	for piece in sorted(pieces, key = piece_area, reverse = True):
+		i, start, stop = piece
+		frames = {x: sizes[x] for x in sequences[i][start:stop]}
+		best = None
+		for shard in shards:
+			merged = dict(shard[1], **frames)
+			if sum(_frame_area(size, padding) for size in merged.values()) > max_size * max_size:
+				continue
+			area = _pack_area(merged, padding, max_size)
+			if area is not None and (best is None or area - shard[2] < best[0]):
+				best = (area - shard[2], shard, merged, area)
+		if best is None:
+			shards.append([[piece], frames, _pack_area(frames, padding, max_size)])
+		else:
+			_, shard, merged, area = best
+			shard[0].append(piece)
+			shard[1] = merged
+			shard[2] = area
+
+	#sheets and the sequences on them keep the order of the spec
+	result = [sorted(shard[0]) for shard in shards]
+	result.sort()
+	return result
+
+
+def split(spec: MaterialSpec, metadata: FrameMetadata = None):
+	#[spec] if it fits one sheet, otherwise one spec per sheet and the mapping of sequences to materials
+	#native builds pack deduplicated (and maybe trimmed) images, so sizes per frame file are an upper bound
+	metadata = metadata if metadata is not None else FrameMetadata()
+	numbered = [(i, seq) for i, seq in enumerate(spec.sequences) if seq.frames]
+	paths = [path for _, seq in numbered for path in seq.frames]
+	if not paths:
+		return [spec], None
+	frames = metadata.scan(paths)
+	if any(info is None or "error" in info for info in frames.values()):
+		#validation reports these
+		return [spec], None
+	sizes = {path: (info["width"], info["height"]) for path, info in frames.items()}
+	if _pack_area(sizes, spec.padding, layout.MAX_SIZE) is not None:
+		return [spec], None
+
+	shards = plan([seq.frames for _, seq in numbered], sizes, spec.padding)
+	if shards is None:
+		return [spec], None
+
+	specs = list()
+	mapping = {"material": spec.name, "shards": []}
+	for n, shard in enumerate(shards):
+		#type(spec): pipeline may run as __main__, its classes are not the ones imported here
+		item = type(spec).from_dict(spec.to_dict(), game_dir = spec.game_dir)
+		item.name = shard_name(spec.name, n)
+		item.sequences = list()
+		entries = list()
+		for number, (i, start, stop) in enumerate(shard):
+			index, seq = numbered[i]
+			item.sequences.append(type(seq)(seq.name, seq.frames[start:stop], seq.looping))
+			entries.append({
+					"sequence": index,
+					"name":     seq.name,
+					"number":   number,
+					"frames":   [start, stop],
+					"split":    stop - start != len(seq.frames),
+			})
+		specs.append(item)
+		mapping["shards"].append({"material": item.name, "sequences": entries})
+	return specs, mapping
+
+
+def mapping_path(spec: MaterialSpec):
+	tf2 = spec.tf2
+	return tf2.src / (tf2.material + SHARDS_SUFFIX)
+
+
+def write_mapping(spec: MaterialSpec, mapping: dict):
+	path = mapping_path(spec)
+	spec.tf2.mkdir()
+	write_json(path, mapping, indent = 1)
+	return path
+
+
+def describe(mapping: dict):
+	lines = [f"{mapping['material']} is split into {len(mapping['shards'])} materials:"]
+	for shard in mapping["shards"]:
+		parts = list()
+		for entry in shard["sequences"]:
+			name = entry["name"] or f"sequence {entry['sequence']}"
+			if entry["split"]:
+				name += f" frames {entry['frames'][0]}-{entry['frames'][1] - 1}"
+			parts.append(f"{name} -> #{entry['number']}")
+		lines.append(f"{shard['material']}: " + ", ".join(parts))
+	return "\n".join(lines)
@@ -0,0 +1,70 @@
+import os
+import time
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def attach(name: str):
+	#workers only map the segment, it belongs to the process that created it
+	#(python < 3.13 has no track flag, the creator's resource tracker is shared with its workers)
+	try:
+		return shared_memory.SharedMemory(name, track = False)
+	except TypeError:
+		return shared_memory.SharedMemory(name)
+
+
+def exit_with_parent():
+	#pool initializer: workers blocked on the call queue outlive a killed parent and keep its resource tracker
+	#(which unlinks the leaked segments once every user is gone) waiting, so they exit when it does
+	parent = os.getppid()
+
+	def watch():
+		while os.getppid() == parent:
+			time.sleep(0.5)
+		os._exit(1)
+
+	threading.Thread(target = watch, daemon = True).start()
+
+
+class SharedBuffer:
+	#one shared memory segment cut into numpy arrays, for handing large arrays to worker processes by name
+	#the creator unlinks it on close (use it as a context manager), its resource tracker does so if it dies
+	def __init__(self, size: int = None, name: str = None):
+		self.owner = name is None
+		self.shm = shared_memory.SharedMemory(create = True, size = max(1, size)) if self.owner else attach(name)
+		self.size = size if size is not None else self.shm.size
+		self.views = list()
+
+	@property
+	def name(self):
+		return self.shm.name
+
+	def array(self, offset: int, shape: tuple, dtype = np.uint8):
+		result = np.ndarray(shape, dtype, self.shm.buf, offset)
+		self.views.append(result)
+		return result
+
+	def close(self):
+		#views must be gone before the mapping can be closed
+		self.views.clear()
+		if self.shm is None:
+			return
+		shm, self.shm = self.shm, None
+		try:
+			shm.close()
+		except BufferError:
+			#an array is still referenced somewhere, the mapping goes with it
+			pass
+		if self.owner:
+			try:
+				shm.unlink()
+			except FileNotFoundError:
+				pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
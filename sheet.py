@@ -0,0 +1,302 @@
+from pathlib import Path
+import os
+import struct
+import hashlib
+import mmap
+
+import numpy as np
+
+from images import open_image, write_tga
+from frames import split_frame
+import layout
+
+#streaming builds: working memory per texel of a band (level 0 to 1 filtering and dxt encoding, measured
+#with some headroom) and per texel of the whole sheet (the float copy of mip 1 and the smaller levels)
+BAND_TEXEL_COST = 160
+SHEET_TEXEL_COST = 6
+
+
+def band_rows(width: int, height: int, budget: int):
+	#rows per band that keep a streaming build of a width x height sheet within budget bytes (at least 4)
+	rows = (budget - SHEET_TEXEL_COST * width * height) // (BAND_TEXEL_COST * width)
+	return int(min(height, max(4, rows // 4 * 4)))
+
+
+class SheetSequence:
+	def __init__(self, number: int, looping: bool = False, frames: list = None):
+		self.number = number
+		self.looping = looping
+		self.frames = frames if frames is not None else list()  # [(path, duration)]
+
+	@property
+	def total_time(self):
+		return float(sum(duration for _, duration in self.frames))
+
+
+def sequences_from_mks(to_mks: list):
+	return [
+			SheetSequence(i, bool(seq[0]), [(str(path), 1.0) for path in seq[1:]])
+			for i, seq in enumerate(to_mks)
+	]
+
+
+def parse_mks(text: str):
+	sequences = list()
+	for n, line in enumerate(text.splitlines(), 1):
+		words = line.split()
+		if not words or words[0].startswith("//"):
+			continue
+		cmd = words[0].lower()
+		if cmd == "sequence":
+			number = int(words[1]) if len(words) > 1 else len(sequences)
+			sequences.append(SheetSequence(number))
+		elif cmd == "loop":
+			if not sequences:
+				raise ValueError(f"mks line {n}: 'loop' outside of a sequence")
+			sequences[-1].looping = True
+		elif cmd == "frame":
+			if not sequences:
+				raise ValueError(f"mks line {n}: 'frame' outside of a sequence")
+			if len(words) < 2:
+				raise ValueError(f"mks line {n}: 'frame' needs an image")
+			path, words = split_frame(line)
+			if len(words) > 1:
+				raise ValueError(f"mks line {n}: multi-image frames are not supported")
+			duration = float(words[0]) if words else 1.0
+			sequences[-1].frames.append((path, duration))
+		else:
+			raise ValueError(f"mks line {n}: unknown command '{words[0]}'")
+	return sequences
+
+
+def parse_sht(data: bytes):
+	#sequences with (uv rectangle, duration) frames, version 1 sheets have 4 rectangles per frame, the first is kept
+	version, count = struct.unpack_from("<ii", data, 0)
+	if version not in (0, 1):
+		raise ValueError(f"Unsupported sheet version {version}")
+	rects = 1 if version == 0 else 4
+	pos = 8
+	sequences = list()
+	try:
+		for _ in range(count):
+			number, clamp, frames, _total = struct.unpack_from("<iiif", data, pos)
+			pos += 16
+			seq = SheetSequence(number, not clamp)
+			for _ in range(frames):
+				duration, *uv = struct.unpack_from(f"<f{4 * rects}f", data, pos)
+				pos += 4 + 16 * rects
+				seq.frames.append((tuple(uv[:4]), duration))
+			sequences.append(seq)
+	except struct.error:
+		raise ValueError("Sheet data is truncated") from None
+	return sequences
+
+
+class Sheet:
+	def __init__(self, width: int, height: int, sequences: list, rects: dict, pixels = None, packed = None):
+		self.width = width
+		self.height = height
+		self.sequences = sequences
+		self.rects = rects  # path -> (x, y, w, h)
+		self.pixels = pixels
+		self.layout = packed
+		self.stats = dict()
+		self.offsets = dict()  # path -> (left, top, source width, source height) of trimmed frames
+		self.scratch = None  # file behind pixels when they are memory-mapped
+		self.mapping = None  # mmap of scratch that pixels view
+		self.band_rows = None  # rows per band for the streaming stages, None keeps everything in memory
+
+	def close(self):
+		#drops a mapped sheet and deletes its scratch file
+		if self.scratch is None:
+			return
+		self.pixels = None
+		_unmap(self.mapping)
+		self.mapping = None
+		try:
+			os.remove(self.scratch)
+		except OSError:
+			pass
+		self.scratch = None
+
+	def uv(self, path):
+		x, y, w, h = self.rects[path]
+		return (
+				(x + 0.5) / self.width,
+				(y + 0.5) / self.height,
+				(x + w - 0.5) / self.width,
+				(y + h - 0.5) / self.height,
+		)
+
+	def sht_bytes(self):
+		data = [struct.pack("<ii", 0, len(self.sequences))]
+		for seq in self.sequences:
+			data.append(struct.pack("<iiif", seq.number, not seq.looping, len(seq.frames), seq.total_time))
+			for path, duration in seq.frames:
+				data.append(struct.pack("<f4f", duration, *self.uv(path)))
+		return b"".join(data)
+
+	def write_sht(self, path: Path):
+		with open(path, "wb") as fl:
+			fl.write(self.sht_bytes())
+
+	def write_tga(self, path: Path):
+		write_tga(path, self.pixels, band_rows = self.band_rows)
+
+	def trim_dict(self):
+		result = dict()
+		for path, (left, top, width, height) in self.offsets.items():
+			_, _, w, h = self.rects[path]
+			result[path] = {
+					"offset":      [left, top],
+					"size":        [w, h],
+					"source_size": [width, height],
+					"uv":          list(self.uv(path)),
+			}
+		return {"frames": result}
+
+
+def fill_gutter(pixels, rect: tuple, padding: int):
+	#repeat the frame edges into its padding so filtering at the border samples the frame itself
+	x, y, w, h = rect
+	pixels[y - padding:y, x:x + w] = pixels[y:y + 1, x:x + w]
+	pixels[y + h:y + h + padding, x:x + w] = pixels[y + h - 1:y + h, x:x + w]
+	pixels[y - padding:y + h + padding, x - padding:x] = pixels[y - padding:y + h + padding, x:x + 1]
+	pixels[y - padding:y + h + padding, x + w:x + w + padding] = pixels[y - padding:y + h + padding, x + w - 1:x + w]
+
+
+def trim_box(pixels, threshold: int = 0):
+	#tight (left, top, width, height) box around the texels with alpha above threshold
+	mask = pixels[..., 3] > threshold
+	rows = np.flatnonzero(mask.any(1))
+	if not len(rows):
+		return 0, 0, 1, 1
+	cols = np.flatnonzero(mask.any(0))
+	return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def content_key(pixels):
+	digest = hashlib.blake2b(digest_size = 16)
+	digest.update(str(pixels.shape).encode())
+	digest.update(np.ascontiguousarray(pixels).data)
+	return digest.hexdigest()
+
+
+def _map_scratch(scratch: Path, height: int, width: int):
+	#(mmap, rgba array viewing it) of a zeroed scratch file
+	with open(scratch, "w+b") as fl:
+		fl.truncate(height * width * 4)
+		mapping = mmap.mmap(fl.fileno(), height * width * 4)
+	return mapping, np.ndarray((height, width, 4), np.uint8, buffer = mapping)
+
+
+def _unmap(mapping):
+	if mapping is None:
+		return
+	try:
+		mapping.close()
+	except BufferError:
+		#arrays made from the sheet are still alive, the mapping goes with the last of them
+		pass
+
+
+def _release(mapping, row: int, start: int, stop: int):
+	#write rows [start, stop) of a mapped sheet back to its file and drop them from memory,
+	#only the pages of those rows are flushed (offsets aligned down to what mmap.flush accepts)
+	first = start * row // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+	mapping.flush(first, stop * row - first)
+	if hasattr(mmap, "MADV_DONTNEED"):
+		#pages shared with the rows around the range are kept
+		first = -(-start * row // mmap.PAGESIZE) * mmap.PAGESIZE
+		last = stop * row // mmap.PAGESIZE * mmap.PAGESIZE
+		if last > first:
+			mapping.madvise(mmap.MADV_DONTNEED, first, last - first)
+
+
+def composite(
+		sequences: list, open_frame = open_image, padding: int = 0, max_size: int = layout.MAX_SIZE, dedupe = True,
+		trim = False, scratch: Path = None, budget: int = None
+):
+	#every unique image is packed once, frames with identical pixels share its rectangle
+	#with trim only the alpha bounding box of a frame is packed and its offset is kept in Sheet.offsets
+	#with scratch the sheet is an mmap of that file: frames are read twice (once for their key and box, once to
+	#blit) and never held together, finished bands go to the file, budget (bytes) sets the band height
+	keys = dict()  # path -> content key
+	images = dict()  # content key -> rgba pixels, or (path, trim box) with scratch
+	shapes = dict()  # content key -> (height, width)
+	offsets = dict()
+	referenced = 0
+	trimmed = 0
+	for seq in sequences:
+		for path, _ in seq.frames:
+			if path not in keys:
+				pixels = open_frame(path).read()
+				box = None
+				if trim:
+					left, top, w, h = trim_box(pixels)
+					offsets[path] = (left, top, pixels.shape[1], pixels.shape[0])
+					trimmed += pixels.shape[0] * pixels.shape[1] - w * h
+					box = (left, top, w, h)
+					pixels = pixels[top:top + h, left:left + w]
+				key = content_key(pixels) if dedupe else path
+				keys[path] = key
+				if key not in images:
+					images[key] = pixels if scratch is None else (path, box)
+					shapes[key] = pixels.shape[:2]
+				del pixels
+			height, width = shapes[keys[path]]
+			referenced += width * height
+	if not images:
+		raise ValueError("No frames to composite")
+
+	packed = layout.pack([shape[::-1] for shape in shapes.values()], padding, max_size)
+	rects = dict(zip(images, packed.rects))
+	rows = None
+	mapping = None
+	if scratch is None:
+		sheet = np.zeros((packed.height, packed.width, 4), np.uint8)
+	else:
+		rows = band_rows(packed.width, packed.height, budget) if budget else packed.height
+		mapping, sheet = _map_scratch(scratch, packed.height, packed.width)
+	try:
+		#top to bottom, so every band above the next frame is finished
+		order = sorted(images, key = lambda key: rects[key][1])
+		released = 0
+		for n, key in enumerate(order):
+			x, y, w, h = rect = rects[key]
+			if scratch is None:
+				sheet[y:y + h, x:x + w] = images[key]
+			else:
+				path, box = images[key]
+				open_frame(path).blit(sheet[y:y + h, x:x + w], box)
+			if padding:
+				fill_gutter(sheet, rect, padding)
+			if scratch is not None:
+				done = rects[order[n + 1]][1] - padding if n + 1 < len(order) else packed.height
+				done = done // rows * rows if done < packed.height else done
+				if done > released:
+					_release(mapping, packed.width * 4, released, done)
+					released = done
+	except BaseException:
+		if scratch is not None:
+			del sheet
+			_unmap(mapping)
+			try:
+				os.remove(scratch)
+			except OSError:
+				pass
+		raise
+
+	result = Sheet(packed.width, packed.height, sequences, {path: rects[key] for path, key in keys.items()}, sheet, packed)
+	result.offsets = offsets
+	if scratch is not None:
+		result.scratch = scratch
+		result.mapping = mapping
+		result.band_rows = rows
+	result.stats = {
+			"texels_trimmed": trimmed,
+			"frames":       sum(len(seq.frames) for seq in sequences),
+			"unique":       len(images),
+			"texels_saved": referenced - packed.used_area,
+	}
+	return result
@@ -0,0 +1,188 @@
+import os
+import sys
+from pathlib import Path
+import time
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+#VTEXGUI_TOOLCHAIN=fake runs the stand-ins in fake_tools.py instead of the Source SDK binaries,
+#settings are environment variables so build worker processes pick them up too
+ENV_TOOLCHAIN = "VTEXGUI_TOOLCHAIN"
+ENV_TIMEOUT = "VTEXGUI_TOOL_TIMEOUT"
+ENV_JOBS = "VTEXGUI_TOOL_JOBS"
+DEFAULT_TIMEOUT = 600.0
+#bytes of each output stream kept for error messages
+OUTPUT_LIMIT = 1 << 16
+
+
+class ToolResult:
+	def __init__(
+			self, name: str, args: list, returncode: int = None, stdout: bytes = b"", stderr: bytes = b"",
+			seconds: float = 0.0, timed_out = False
+	):
+		self.name = name
+		self.args = args
+		self.returncode = returncode
+		self.stdout = stdout[-OUTPUT_LIMIT:]
+		self.stderr = stderr[-OUTPUT_LIMIT:]
+		self.seconds = seconds
+		self.timed_out = timed_out
+
+	@property
+	def ok(self):
+		return self.returncode == 0 and not self.timed_out
+
+	def tail(self, lines: int = 10):
+		#last lines of the tool's output, stderr first
+		text = (self.stderr or self.stdout).decode(errors = "replace").strip()
+		return "\n".join(text.splitlines()[-lines:])
+
+	def describe(self):
+		if self.timed_out:
+			return f"{self.name} timed out after {self.seconds:.1f} s"
+		if self.returncode is None:
+			return f"{self.name} did not run"
+		return f"{self.name} exited with code {self.returncode}"
+
+	def to_dict(self):
+		return {
+				"name":       self.name,
+				"args":       self.args,
+				"returncode": self.returncode,
+				"seconds":    round(self.seconds, 4),
+				"timed_out":  self.timed_out,
+				"output":     self.tail(),
+		}
+
+
+class SourceToolchain:
+	#mksheet.exe and vtex.exe of the game directory
+	name = "source"
+
+	def command(self, tf2, tool: str):
+		#absolute: tools run in their job directory
+		return [str((tf2.mks if tool == "mksheet" else tf2.vtex).absolute())]
+
+	def available(self, tf2):
+		return tf2.exists
+
+
+class FakeToolchain:
+	#deterministic stand-ins with the same arguments and outputs, run as real processes (needs numpy)
+	name = "fake"
+
+	def command(self, tf2, tool: str):
+		return [sys.executable, str(Path(__file__).with_name("fake_tools.py")), tool]
+
+	def available(self, tf2):
+		return tf2.tf.parent.is_dir()
+
+
+TOOLCHAINS = dict()
+
+
+def register_toolchain(toolchain):
+	#toolchain: class with a name, command(tf2, tool) -> argument list prefix and available(tf2)
+	TOOLCHAINS[toolchain.name] = toolchain
+	return toolchain
+
+
+register_toolchain(SourceToolchain)
+register_toolchain(FakeToolchain)
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def configure(toolchain: str = None, timeout: float = None, jobs: int = None):
+	#defaults of every ToolRunner made from now on, in this process and the workers it starts
+	global _default
+	if toolchain is not None:
+		if toolchain not in TOOLCHAINS:
+			raise ValueError(f"Unknown toolchain '{toolchain}'")
+		os.environ[ENV_TOOLCHAIN] = toolchain
+	if timeout is not None:
+		os.environ[ENV_TIMEOUT] = str(timeout)
+	if jobs is not None:
+		os.environ[ENV_JOBS] = str(jobs)
+	with _default_lock:
+		_default = None
+
+
+def _env_number(name: str, default, kind = float):
+	try:
+		return kind(os.environ[name])
+	except (KeyError, ValueError):
+		return default
+
+
+class ToolRunner:
+	#runs tools from argument lists (never a shell) in a working directory per job, captures their output and
+	#exit code, kills them after timeout seconds and runs at most jobs of them at once in this process
+	def __init__(self, toolchain = None, timeout: float = None, jobs: int = None):
+		if toolchain is None:
+			name = os.getenv(ENV_TOOLCHAIN) or SourceToolchain.name
+			toolchain = TOOLCHAINS.get(name, SourceToolchain)()
+		self.toolchain = toolchain
+		self.timeout = timeout if timeout is not None else _env_number(ENV_TIMEOUT, DEFAULT_TIMEOUT)
+		jobs = jobs if jobs is not None else _env_number(ENV_JOBS, os.cpu_count() or 1, int)
+		self.jobs = max(1, jobs)
+		self._slots = threading.BoundedSemaphore(self.jobs)
+
+	def available(self, tf2):
+		return self.toolchain.available(tf2)
+
+	@contextmanager
+	def job(self, name: str = "tool"):
+		#a fresh working directory, removed with everything left in it
+		with tempfile.TemporaryDirectory(prefix = f"vtexgui-{name}-") as directory:
+			yield Path(directory)
+
+	def run(
+			self, tf2, tool: str, args: list, cwd: Path, started = None, finished = None,
+			cancelled: threading.Event = None
+	):
+		#started/finished(process) are called around the process (cancellation kills it in between),
+		#waiting for a slot stops if cancelled is set
+		args = [str(x) for x in args]
+		while not self._slots.acquire(timeout = 0.1):
+			if cancelled is not None and cancelled.is_set():
+				return ToolResult(tool, args)
+		try:
+			start = time.perf_counter()
+			try:
+				process = subprocess.Popen(
+						self.toolchain.command(tf2, tool) + args, cwd = cwd,
+						stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.PIPE
+				)
+			except OSError as e:
+				return ToolResult(tool, args, stderr = str(e).encode(), seconds = time.perf_counter() - start)
+			if started:
+				started(process)
+			timed_out = False
+			try:
+				try:
+					stdout, stderr = process.communicate(timeout = self.timeout)
+				except subprocess.TimeoutExpired:
+					timed_out = True
+					process.kill()
+					stdout, stderr = process.communicate()
+			finally:
+				if finished:
+					finished(process)
+			return ToolResult(
+					tool, args, process.returncode, stdout, stderr, time.perf_counter() - start, timed_out
+			)
+		finally:
+			self._slots.release()
+
+
+def default_runner():
+	#one runner per process, so its job limit holds across concurrent builds
+	global _default
+	with _default_lock:
+		if _default is None:
+			_default = ToolRunner()
+		return _default
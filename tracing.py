@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import atexit
+import threading
+
+#VTEXGUI_TRACE=<file> turns tracing on for this process and every worker it starts,
+#only the process named in VTEXGUI_TRACE_OWNER writes the file
+ENV_PATH = "VTEXGUI_TRACE"
+ENV_OWNER = "VTEXGUI_TRACE_OWNER"
+
+enabled = False
+_path = None
+_events = list()
+_lock = threading.Lock()
+
+
+def io_counters():
+	#(bytes read, bytes written) by this process so far, None where the platform does not say
+	try:
+		with open("/proc/self/io", "r") as fl:
+			values = dict(line.split(": ") for line in fl.read().splitlines())
+		return int(values["rchar"]), int(values["wchar"])
+	except (OSError, KeyError, ValueError):
+		pass
+	try:
+		import psutil
+		counters = psutil.Process().io_counters()
+		return counters.read_bytes, counters.write_bytes
+	except (ImportError, AttributeError):
+		return None
+
+
+def _child_time():
+	times = os.times()
+	return times.children_user + times.children_system
+
+
+class _NullSpan:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *_args):
+		return False
+
+	def set(self, **_args):
+		pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+	#one complete ("X") event: wall and cpu time, process io and the cpu time of child processes that exited
+	def __init__(self, name: str, category: str, args: dict):
+		self.name = name
+		self.category = category
+		self.args = args
+
+	def set(self, **args):
+		self.args.update(args)
+
+	def __enter__(self):
+		self.ts = time.time_ns() // 1000
+		self.start = time.perf_counter()
+		self.cpu = time.thread_time()
+		self.children = _child_time()
+		self.io = io_counters()
+		return self
+
+	def __exit__(self, exc_type, *_args):
+		duration = time.perf_counter() - self.start
+		args = dict(self.args)
+		args["cpu_ms"] = round((time.thread_time() - self.cpu) * 1000, 3)
+		children = _child_time() - self.children
+		if children:
+			args["child_cpu_ms"] = round(children * 1000, 3)
+		io = io_counters()
+		if io is not None and self.io is not None:
+			args["bytes_read"] = io[0] - self.io[0]
+			args["bytes_written"] = io[1] - self.io[1]
+		if exc_type is not None:
+			args["error"] = exc_type.__name__
+		add_event({
+				"name": self.name,
+				"cat":  self.category,
+				"ph":   "X",
+				"ts":   self.ts,
+				"dur":  max(1, int(duration * 1e6)),
+				"pid":  os.getpid(),
+				"tid":  threading.get_ident(),
+				"args": args,
+		})
+		return False
+
+
+def span(name: str, category: str = "stage", **args):
+	#costs one global lookup when tracing is off
+	if not enabled:
+		return NULL_SPAN
+	return Span(name, category, args)
+
+
+def add_event(event: dict):
+	with _lock:
+		_events.append(event)
+
+
+def extend(events: list):
+	#events recorded by a worker process
+	with _lock:
+		_events.extend(events)
+
+
+def drain():
+	with _lock:
+		result = list(_events)
+		_events.clear()
+	return result
+
+
+def enable(path: str = None):
+	global enabled, _path
+	enabled = True
+	if path:
+		_path = path
+		os.environ[ENV_PATH] = path
+		os.environ[ENV_OWNER] = str(os.getpid())
+		atexit.register(write)
+
+
+def write(path: str = None):
+	#everything recorded so far, workers' events included once they were extended in
+	path = path or _path
+	if not path:
+		return
+	events = [{
+			"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+			"args": {"name": "vtexgui" if str(pid) == os.environ.get(ENV_OWNER) else f"worker {pid}"},
+	} for pid in sorted({event["pid"] for event in _events})]
+	with _lock:
+		events += _events
+	with open(path, "w") as fl:
+		json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fl)
+
+
+if os.getenv(ENV_PATH):
+	if os.getenv(ENV_OWNER, str(os.getpid())) == str(os.getpid()):
+		enable(os.getenv(ENV_PATH))
+	else:
+		enable()
@@ -0,0 +1,197 @@
+import sys
+from pathlib import Path
+import json
+import time
+
+import numpy as np
+
+from images import read_image
+from pipeline import BuildError, BuildResult, MaterialSpec, load_specs
+import sheet
+import tracing
+import vtf
+
+#dxt frames below this are reported, lossless formats must match exactly
+#(a frame from the wrong place in the sheet scores 10-15 dB, dxt1 on smooth gradients can drop below 30)
+MIN_PSNR = 25.0
+LOSSLESS = {vtf.IMAGE_FORMAT_RGBA8888, vtf.IMAGE_FORMAT_BGRA8888, vtf.IMAGE_FORMAT_RGB888, vtf.IMAGE_FORMAT_BGR888}
+#formats that drop alpha, only the colour channels are compared (dxt1 keeps one bit alpha if flagged)
+NO_ALPHA = {vtf.IMAGE_FORMAT_RGB888, vtf.IMAGE_FORMAT_BGR888, vtf.IMAGE_FORMAT_DXT1}
+
+
+def frame_rect(uv: tuple, width: int, height: int):
+	#inverse of Sheet.uv: the rectangle is inset by half a texel on every side
+	u0, v0, u1, v1 = uv
+	x = int(round(u0 * width - 0.5))
+	y = int(round(v0 * height - 0.5))
+	return x, y, int(round(u1 * width + 0.5)) - x, int(round(v1 * height + 0.5)) - y
+
+
+def psnr(mse: float):
+	#None for identical images
+	return None if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def verify(path: Path, sequences: list, trim: dict = None, min_psnr: float = MIN_PSNR):
+	#compares a built vtf against the frames it was made from, returns (errors, stats)
+	#sequences: sheet.SheetSequence list with (frame path, duration) frames, trim: the .trim.json frames dict
+	start = time.perf_counter()
+	errors = list()
+	try:
+		reader = vtf.VTFReader(path)
+	except (OSError, ValueError) as e:
+		return [BuildError("verify", f"Could not read vtf:\n{e}", str(path))], dict()
+	if reader.sheet is None:
+		return [BuildError("verify", "The vtf has no sheet resource", str(path))], dict()
+	try:
+		built = sheet.parse_sht(reader.sheet)
+	except (ValueError, IndexError) as e:
+		return [BuildError("verify", f"Could not read the vtf sheet: {e}", str(path))], dict()
+
+	if len(built) != len(sequences):
+		errors.append(BuildError(
+				"verify", f"The vtf sheet has {len(built)} sequences, expected {len(sequences)}", str(path),
+				{"sequences": len(built), "expected": len(sequences)}
+		))
+	for i, (seq, expected) in enumerate(zip(built, sequences)):
+		if len(seq.frames) != len(expected.frames):
+			errors.append(BuildError(
+					"verify", f"Sequence {i} has {len(seq.frames)} frames in the vtf, expected {len(expected.frames)}",
+					str(path), {"sequence": i, "frames": len(seq.frames), "expected": len(expected.frames)}
+			))
+	if errors:
+		return errors, dict()
+
+	with tracing.span("decode", "verify", format = reader.image_format):
+		texture = reader.read_mip(0)
+	one_bit = reader.image_format == vtf.IMAGE_FORMAT_DXT1 and reader.flags & vtf.TEXTUREFLAGS_ONEBITALPHA
+	channels = 3 if reader.image_format in NO_ALPHA and not one_bit else 4
+	trim = trim or dict()
+	sources = dict()  # frame path -> source pixels, frames repeat across sequences
+	measured = list()
+	for i, (seq, expected) in enumerate(zip(built, sequences)):
+		for j, ((uv, _), (frame, _)) in enumerate(zip(seq.frames, expected.frames)):
+			x, y, w, h = frame_rect(uv, reader.width, reader.height)
+			if frame not in sources:
+				try:
+					sources[frame] = read_image(frame)
+				except (OSError, ValueError) as e:
+					errors.append(BuildError("verify", f"Could not read frame:\n{e}", frame))
+					sources[frame] = None
+			source = sources[frame]
+			if source is None:
+				continue
+			if frame in trim:
+				left, top = trim[frame]["offset"]
+				source = source[top:top + h, left:left + w]
+			actual = texture[y:y + h, x:x + w]
+			if actual.shape != source.shape:
+				errors.append(BuildError(
+						"verify", f"Frame {j} of sequence {i} is {w}x{h} in the vtf, the image is "
+						f"{source.shape[1]}x{source.shape[0]}", frame,
+						{"sequence": i, "frame": j, "rect": [x, y, w, h]}
+				))
+				continue
+			diff = np.abs(actual[..., :channels].astype(np.int16) - source[..., :channels])
+			measured.append((i, j, frame, float(np.square(diff, dtype = np.float32).mean()), int(diff.max())))
+
+	lossless = reader.image_format in LOSSLESS
+	for i, j, frame, mse, max_error in measured:
+		value = psnr(mse)
+		failed = max_error > 0 if lossless else value is not None and value < min_psnr
+		if failed:
+			errors.append(BuildError(
+					"verify",
+					f"Frame {j} of sequence {i} does not match its image "
+					f"(psnr {value:.1f} dB, max error {max_error})", frame,
+					{"sequence": i, "frame": j, "psnr": value, "max_error": max_error}
+			))
+
+	values = [psnr(mse) for _, _, _, mse, _ in measured]
+	finite = [x for x in values if x is not None]
+	stats = {
+			"format":    reader.image_format,
+			"size":      [reader.width, reader.height],
+			"mips":      reader.mip_count,
+			"sequences": len(built),
+			"frames":    len(measured),
+			"min_psnr":  round(min(finite), 2) if finite else None,
+			"mean_psnr": round(float(np.mean(finite)), 2) if finite else None,
+			"max_error": max((x[4] for x in measured), default = 0),
+			"seconds":   round(time.perf_counter() - start, 4),
+	}
+	return errors, stats
+
+
+def describe(stats: dict):
+	if stats["min_psnr"] is None:
+		return f"{stats['frames']} frames, identical"
+	return (
+			f"{stats['frames']} frames, psnr min {stats['min_psnr']} mean {stats['mean_psnr']} dB, "
+			f"max error {stats['max_error']}"
+	)
+
+
+def verify_result(spec: MaterialSpec, result: BuildResult, mks: str = None, min_psnr: float = MIN_PSNR):
+	#checks the vtf of a successful build against the spec (or the mks it was built from),
+	#adds errors and stats["verify"] to the result
+	if not result.ok or "vtf" not in result.outputs:
+		return result
+	try:
+		sequences = sheet.parse_mks(mks) if mks is not None else sheet.sequences_from_mks(spec.to_mks())
+	except ValueError as e:
+		result.errors.append(BuildError("verify", f"Could not read the mks: {e}"))
+		return result
+	trim = None
+	if "trim" in result.outputs:
+		try:
+			with open(result.outputs["trim"], "r") as fl:
+				trim = json.load(fl)["frames"]
+		except (OSError, ValueError, KeyError) as e:
+			result.errors.append(BuildError("verify", f"Could not read trim offsets: {e}", str(result.outputs["trim"])))
+			return result
+	with tracing.span("verify", "stage", material = spec.name):
+		errors, stats = verify(result.outputs["vtf"], sequences, trim, min_psnr)
+	result.errors += errors
+	if stats:
+		result.stats["verify"] = stats
+	return result
+
+
+def main(argv: list):
+	import argparse
+	parser = argparse.ArgumentParser(
+			prog = "verify", description = "Check a built vtf against the frames of its spec or .mks file."
+	)
+	parser.add_argument("vtf")
+	parser.add_argument("source", help = "material spec json, project file or .mks sheet description")
+	parser.add_argument("--trim", default = None, help = "<material>.trim.json of a trimmed build")
+	parser.add_argument("--min-psnr", type = float, default = MIN_PSNR, help = "lowest acceptable psnr of a dxt frame")
+	parser.add_argument("--json", action = "store_true", help = "print the result as json")
+	args = parser.parse_args(argv)
+
+	source = Path(args.source)
+	if source.suffix.lower() == ".mks":
+		with open(source, "r") as fl:
+			sequences = sheet.parse_mks(fl.read())
+	else:
+		sequences = sheet.sequences_from_mks(load_specs(source)[0].to_mks())
+	trim = None
+	if args.trim:
+		with open(args.trim, "r") as fl:
+			trim = json.load(fl)["frames"]
+
+	errors, stats = verify(Path(args.vtf), sequences, trim, args.min_psnr)
+	if args.json:
+		print(json.dumps({"ok": not errors, "errors": [x.to_dict() for x in errors], "stats": stats}, indent = 2))
+	else:
+		print(f"{'OK' if not errors else 'FAILED'}: {args.vtf}")
+		if stats:
+			print(f"\t{describe(stats)}, {stats['seconds'] * 1000:.1f} ms")
+		for error in errors:
+			print("\t" + str(error).replace("\n", "\n\t"))
+	return 1 if errors else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
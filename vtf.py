@@ -0,0 +1,396 @@
+from pathlib import Path
+import struct
+import mmap
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from sharedbuf import SharedBuffer, exit_with_parent
+import dxt
+import mips
+
+IMAGE_FORMAT_NONE = -1
+IMAGE_FORMAT_RGBA8888 = 0
+IMAGE_FORMAT_RGB888 = 2
+IMAGE_FORMAT_BGR888 = 3
+IMAGE_FORMAT_BGRA8888 = 12
+IMAGE_FORMAT_DXT1 = 13
+IMAGE_FORMAT_DXT5 = 15
+
+TEXTUREFLAGS_CLAMPS = 0x4
+TEXTUREFLAGS_CLAMPT = 0x8
+TEXTUREFLAGS_ONEBITALPHA = 0x1000
+TEXTUREFLAGS_EIGHTBITALPHA = 0x2000
+
+RESOURCE_LOW_RES = b"\x01\x00\x00"
+RESOURCE_SHEET = b"\x10\x00\x00"
+RESOURCE_HIGH_RES = b"\x30\x00\x00"
+
+VERSION = (7, 3)
+HEADER_SIZE = 80
+LOW_RES_SIZE = 16
+
+
+FORMAT_NAMES = {
+		"rgba8888": IMAGE_FORMAT_RGBA8888,
+		"bgra8888": IMAGE_FORMAT_BGRA8888,
+		"rgb888":   IMAGE_FORMAT_RGB888,
+		"bgr888":   IMAGE_FORMAT_BGR888,
+		"dxt1":     IMAGE_FORMAT_DXT1,
+		"dxt5":     IMAGE_FORMAT_DXT5,
+}
+
+
+def _encode_raw(order: list):
+	def encode(pixels, quality = dxt.FAST):
+		return np.ascontiguousarray(pixels[..., order])
+	return encode
+
+
+#image format -> (encode(rgba array, quality) -> buffer, size(width, height) -> bytes)
+FORMATS = {
+		IMAGE_FORMAT_RGBA8888: (_encode_raw([0, 1, 2, 3]), lambda w, h: w * h * 4),
+		IMAGE_FORMAT_BGRA8888: (_encode_raw([2, 1, 0, 3]), lambda w, h: w * h * 4),
+		IMAGE_FORMAT_RGB888:   (_encode_raw([0, 1, 2]), lambda w, h: w * h * 3),
+		IMAGE_FORMAT_BGR888:   (_encode_raw([2, 1, 0]), lambda w, h: w * h * 3),
+		IMAGE_FORMAT_DXT1:     (dxt.compress_dxt1, lambda w, h: dxt.block_size(w, h, 8)),
+		IMAGE_FORMAT_DXT5:     (dxt.compress_dxt5, lambda w, h: dxt.block_size(w, h, 16)),
+}
+
+
+#formats with an alpha channel, dxt1 is written without its 1 bit alpha
+ALPHA_FORMATS = {IMAGE_FORMAT_RGBA8888, IMAGE_FORMAT_BGRA8888, IMAGE_FORMAT_DXT5}
+
+
+def _decode_raw(order: list):
+	def decode(data, width: int, height: int):
+		pixels = np.frombuffer(data, np.uint8).reshape(height, width, len(order))
+		result = np.full((height, width, 4), 255, np.uint8)
+		result[..., order] = pixels
+		return result
+	return decode
+
+
+#image format -> decode(buffer, width, height) -> rgba array
+DECODERS = {
+		IMAGE_FORMAT_RGBA8888: _decode_raw([0, 1, 2, 3]),
+		IMAGE_FORMAT_BGRA8888: _decode_raw([2, 1, 0, 3]),
+		IMAGE_FORMAT_RGB888:   _decode_raw([0, 1, 2]),
+		IMAGE_FORMAT_BGR888:   _decode_raw([2, 1, 0]),
+		IMAGE_FORMAT_DXT1:     dxt.decompress_dxt1,
+		IMAGE_FORMAT_DXT5:     dxt.decompress_dxt5,
+}
+
+
+def register_format(image_format: int, encode, size, decode = None, alpha = False):
+	FORMATS[image_format] = (encode, size)
+	if alpha:
+		ALPHA_FORMATS.add(image_format)
+	if decode is not None:
+		DECODERS[image_format] = decode
+
+
+def _bands(pixels, band_rows: int = None):
+	step = band_rows or pixels.shape[0]
+	for y in range(0, pixels.shape[0], step):
+		yield pixels[y:y + step]
+
+
+def reflectivity(pixels, band_rows: int = None):
+	if band_rows is None:
+		mean = pixels[..., :3].reshape(-1, 3).mean(axis = 0)
+	else:
+		total = sum(band[..., :3].reshape(-1, 3).sum(axis = 0, dtype = np.float64) for band in _bands(pixels, band_rows))
+		mean = total / (pixels.shape[0] * pixels.shape[1])
+	linear = (mean / 255.0) ** 2.2
+	return [float(x) for x in linear]
+
+
+def has_alpha(pixels, band_rows: int = None):
+	return any((band[..., 3] != 255).any() for band in _bands(pixels, band_rows))
+
+
+class EncodedBands:
+	#a mip level that is encoded band_rows rows at a time while it is written instead of up front
+	def __init__(self, pixels, image_format: int, quality, band_rows: int):
+		self.pixels = pixels
+		self.encode, size = FORMATS[image_format]
+		self.quality = quality
+		#dxt blocks are 4 rows high
+		self.band_rows = max(4, (band_rows + 3) & ~3)
+		self.nbytes = size(pixels.shape[1], pixels.shape[0])
+
+	def __iter__(self):
+		for band in _bands(self.pixels, self.band_rows):
+			yield self.encode(band, self.quality)
+
+
+class CompressionError(RuntimeError):
+	pass
+
+
+#levels are cut into jobs of about this many texels (whole block rows)
+JOB_TEXELS = 1 << 18
+
+
+def _encode_job(source: str, target: str, offset: int, shape: tuple, rows: tuple, out_offset: int, image_format, quality):
+	#worker side of encode_parallel: encodes rows of one level in place, only the timing goes back
+	start = time.perf_counter()
+	with SharedBuffer(name = source) as inputs, SharedBuffer(name = target) as outputs:
+		encode, _ = FORMATS[image_format]
+		encoded = memoryview(encode(inputs.array(offset, shape)[rows[0]:rows[1]], quality)).cast("B")
+		outputs.array(out_offset, (encoded.nbytes,))[:] = encoded
+		nbytes = encoded.nbytes
+		del encoded
+	return nbytes, time.perf_counter() - start
+
+
+def encode_parallel(levels: list, image_format: int, quality = dxt.FAST, workers: int = 2):
+	#encoded bytes of every level, compressed by worker processes in disjoint block row ranges
+	#levels go to the workers through one shared buffer and come back through another, nothing large is pickled
+	_, size = FORMATS[image_format]
+	in_offsets = np.cumsum([0] + [level.nbytes for level in levels]).tolist()
+	out_sizes = [size(level.shape[1], level.shape[0]) for level in levels]
+	out_offsets = np.cumsum([0] + out_sizes).tolist()
+	with SharedBuffer(in_offsets[-1]) as source, SharedBuffer(out_offsets[-1]) as target:
+		jobs = list()
+		for level, offset, out_offset in zip(levels, in_offsets, out_offsets):
+			source.array(offset, level.shape)[:] = level
+			height, width = level.shape[:2]
+			step = max(4, JOB_TEXELS // width // 4 * 4)
+			for row in range(0, height, step):
+				start = out_offset + (size(width, row) if row else 0)
+				jobs.append((offset, level.shape, (row, min(row + step, height)), start))
+		source.views.clear()
+
+		try:
+			with ProcessPoolExecutor(max_workers = min(workers, len(jobs)), initializer = exit_with_parent) as pool:
+				futures = [
+						pool.submit(_encode_job, source.name, target.name, *job, image_format, quality)
+						for job in jobs
+				]
+				written = sum(future.result()[0] for future in futures)
+		except BrokenProcessPool as e:
+			raise CompressionError(f"A compression worker died: {e}") from None
+		if written != out_offsets[-1]:
+			raise CompressionError(f"Compression workers wrote {written} of {out_offsets[-1]} bytes")
+		return [bytes(target.shm.buf[start:start + n]) for start, n in zip(out_offsets, out_sizes)]
+
+
+def _nbytes(chunk):
+	return chunk.nbytes if isinstance(chunk, EncodedBands) else memoryview(chunk).nbytes
+
+
+class VTFWriter:
+	def __init__(
+			self, pixels,
+			sheet: bytes = None,
+			image_format = IMAGE_FORMAT_BGRA8888,
+			low_res_format = IMAGE_FORMAT_DXT1,
+			flags = TEXTUREFLAGS_CLAMPS | TEXTUREFLAGS_CLAMPT,
+			mipmaps = True,
+			mip_levels: list = None,
+			quality = dxt.FAST,
+			band_rows: int = None,
+			workers: int = None,
+	):
+		#band_rows: the top level (pixels, which may be a memmap) is scanned and encoded that many rows at a time,
+		#the levels below as many texels at a time
+		#workers: compress the levels in that many processes (see encode_parallel), not combined with band_rows
+		height, width = pixels.shape[:2]
+		if width & (width - 1) or height & (height - 1):
+			raise ValueError(f"Texture size must be a power of two ({width}x{height})")
+		if image_format not in FORMATS:
+			raise ValueError(f"Unsupported image format {image_format}")
+
+		self.width = width
+		self.height = height
+		self.image_format = image_format
+		self.quality = quality
+		self.low_res_format = low_res_format
+		self.sheet = sheet
+		self.band_rows = band_rows
+		self.workers = workers
+		if mip_levels is not None:
+			self.mips = mip_levels
+		else:
+			self.mips = mips.generate(pixels) if mipmaps else [pixels]
+
+		self.flags = flags
+		#the flag tells the engine to blend, a format that drops the alpha channel must not set it
+		if image_format in ALPHA_FORMATS and has_alpha(pixels, band_rows):
+			self.flags |= TEXTUREFLAGS_EIGHTBITALPHA
+		self.reflectivity = reflectivity(pixels, band_rows)
+
+	def low_res(self):
+		for level in self.mips:
+			if level.shape[0] <= LOW_RES_SIZE and level.shape[1] <= LOW_RES_SIZE:
+				return level
+		return self.mips[-1]
+
+	def resources(self):
+		result = list()
+		if self.low_res_format != IMAGE_FORMAT_NONE:
+			encode, _ = FORMATS[self.low_res_format]
+			result.append([RESOURCE_LOW_RES, [encode(self.low_res(), self.quality)]])
+		if self.sheet is not None:
+			result.append([RESOURCE_SHEET, [struct.pack("<I", len(self.sheet)), self.sheet]])
+		if self.band_rows:
+			#band_rows is for the top level, the levels below get as many texels per band
+			levels = [
+					EncodedBands(level, self.image_format, self.quality, self.band_rows << i)
+					for i, level in enumerate(self.mips)
+			]
+		elif self.workers and self.workers > 1:
+			levels = encode_parallel(self.mips, self.image_format, self.quality, self.workers)
+		else:
+			encode, _ = FORMATS[self.image_format]
+			levels = [encode(level, self.quality) for level in self.mips]
+		result.append([RESOURCE_HIGH_RES, levels[::-1]])
+		return result
+
+	def buffers(self, resources: list = None):
+		#resources can be encoded up front (see resources()) to keep compression apart from the write
+		resources = resources if resources is not None else self.resources()
+		header_size = HEADER_SIZE + 8 * len(resources)
+		low_res = self.low_res() if self.low_res_format != IMAGE_FORMAT_NONE else None
+
+		header = struct.pack(
+				"<4s2II2HIHH4x3f4xfIBIBBH3xI8x",
+				b"VTF\0", *VERSION, header_size,
+				self.width, self.height, self.flags,
+				1, 0,
+				*self.reflectivity,
+				1.0,
+				self.image_format & 0xFFFFFFFF, len(self.mips),
+				self.low_res_format & 0xFFFFFFFF,
+				low_res.shape[1] if low_res is not None else 0,
+				low_res.shape[0] if low_res is not None else 0,
+				1,
+				len(resources)
+		)
+
+		entries = list()
+		data = list()
+		offset = header_size
+		for tag, chunks in resources:
+			entries.append(tag + struct.pack("<BI", 0, offset))
+			for chunk in chunks:
+				data.append(chunk)
+				offset += _nbytes(chunk)
+
+		return [header] + entries + data
+
+	def write(self, path: Path, resources: list = None):
+		with open(path, "wb") as fl:
+			for chunk in self.buffers(resources):
+				if isinstance(chunk, EncodedBands):
+					fl.writelines(memoryview(band).cast("B") for band in chunk)
+				else:
+					fl.write(memoryview(chunk).cast("B"))
+
+
+def auto_format(pixels, band_rows: int = None):
+	#same choice vtex makes for a tga without a config: dxt5 if it has alpha, dxt1 otherwise
+	return IMAGE_FORMAT_DXT5 if has_alpha(pixels, band_rows) else IMAGE_FORMAT_DXT1
+
+
+def write_vtf(path: Path, pixels, sheet: bytes = None, **kwargs):
+	writer = VTFWriter(pixels, sheet = sheet, **kwargs)
+	writer.write(path)
+	return writer
+
+
+class VTFError(ValueError):
+	pass
+
+
+class VTFReader:
+	#reads the header, resource directory and sheet up front, image data only on request
+	#mips are mapped instead of read so checking mip 0 of a large sheet does not load the whole file
+	HEADER = struct.Struct("<4s2II2HIHH4x3f4xfIBIBB")
+
+	def __init__(self, path: Path):
+		self.path = Path(path)
+		self.size = self.path.stat().st_size
+		self.resources = dict()  # tag -> offset
+		self.sheet = None
+		with open(self.path, "rb") as fl:
+			data = fl.read(HEADER_SIZE)
+			if len(data) < self.HEADER.size or data[:4] != b"VTF\0":
+				raise VTFError(f"{self.path} is not a vtf file")
+			(
+				_, major, minor, self.header_size, self.width, self.height, self.flags, self.frames, _,
+				*self.reflectivity, _, image_format, self.mip_count, low_res_format, low_width, low_height
+			) = self.HEADER.unpack_from(data)
+			self.version = (major, minor)
+			if major != 7:
+				raise VTFError(f"Unsupported vtf version {major}.{minor}")
+			self.image_format = struct.unpack("<i", struct.pack("<I", image_format))[0]
+			self.low_res_format = struct.unpack("<i", struct.pack("<I", low_res_format))[0]
+			self.low_res_size = (low_width, low_height)
+
+			if minor >= 3:
+				count, = struct.unpack_from("<I", data, 68)
+				fl.seek(HEADER_SIZE)
+				entries = fl.read(8 * count)
+				if len(entries) < 8 * count:
+					raise VTFError(f"{self.path} is truncated (resource directory)")
+				for i in range(count):
+					tag, flags, offset = struct.unpack_from("<3sBI", entries, 8 * i)
+					#flag 0x2: the value is stored in the entry, there is no data to seek to
+					self.resources[tag] = None if flags & 0x2 else offset
+			else:
+				#no resource directory: the low res image and then the image data follow the header
+				low_res = 0
+				if self.low_res_format != IMAGE_FORMAT_NONE and self.low_res_format in FORMATS:
+					low_res = FORMATS[self.low_res_format][1](low_width, low_height)
+				self.resources[RESOURCE_HIGH_RES] = self.header_size + low_res
+
+			offset = self.resources.get(RESOURCE_SHEET)
+			if offset is not None:
+				fl.seek(offset)
+				length, = struct.unpack("<I", fl.read(4))
+				self.sheet = fl.read(length)
+				if len(self.sheet) < length:
+					raise VTFError(f"{self.path} is truncated (sheet)")
+
+		if RESOURCE_HIGH_RES not in self.resources:
+			raise VTFError(f"{self.path} has no image data")
+		if self.image_format not in FORMATS:
+			raise VTFError(f"{self.path}: unsupported image format {self.image_format}")
+		end = self.mip_offset(0) + self.mip_size(0)
+		if end > self.size:
+			raise VTFError(f"{self.path} is truncated ({self.size} bytes, image data needs {end})")
+
+	def mip_dimensions(self, level: int):
+		return max(1, self.width >> level), max(1, self.height >> level)
+
+	def mip_size(self, level: int):
+		#bytes of one level for all frames
+		_, size = FORMATS[self.image_format]
+		return size(*self.mip_dimensions(level)) * self.frames
+
+	def mip_offset(self, level: int):
+		#levels are stored smallest first, so mip 0 is at the end
+		if not 0 <= level < self.mip_count:
+			raise IndexError(f"mip level {level} out of range")
+		return self.resources[RESOURCE_HIGH_RES] + sum(
+				self.mip_size(i) for i in range(level + 1, self.mip_count)
+		)
+
+	def read_mip(self, level: int = 0, frame: int = 0):
+		#decoded rgba array of one frame of one mip level
+		if self.image_format not in DECODERS:
+			raise VTFError(f"{self.path}: cannot decode image format {self.image_format}")
+		width, height = self.mip_dimensions(level)
+		size = self.mip_size(level) // self.frames
+		offset = self.mip_offset(level) + frame * size
+		with open(self.path, "rb") as fl, mmap.mmap(fl.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+			data = memoryview(mapped)[offset:offset + size]
+			try:
+				return np.array(DECODERS[self.image_format](data, width, height))
+			finally:
+				data.release()
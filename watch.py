@@ -0,0 +1,256 @@
+import os
+import sys
+import time
+import select
+import signal
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import DEFAULT_MAX_BYTES
+from pipeline import BuildError, BuildResult
+import batch
+import tracing
+
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_ATTRIB
+
+EVENT = struct.Struct("iIII")
+#times a material whose build crashed its worker is built again before the crash is reported
+WORKER_RETRIES = 1
+
+
+def normalize(path: str):
+	return os.path.normcase(os.path.abspath(path))
+
+
+class PollingSource:
+	#compares (mtime_ns, size) of every watched file on each poll
+	def __init__(self, paths: list, interval: float = 0.5):
+		self.paths = sorted(set(paths))
+		self.interval = interval
+		self.state = {path: self._stat(path) for path in self.paths}
+
+	@staticmethod
+	def _stat(path: str):
+		try:
+			stat = os.stat(path)
+			return stat.st_mtime_ns, stat.st_size
+		except OSError:
+			return None
+
+	def poll(self, timeout: float):
+		time.sleep(min(timeout, self.interval))
+		changed = set()
+		for path in self.paths:
+			state = self._stat(path)
+			if state != self.state[path]:
+				self.state[path] = state
+				changed.add(path)
+		return changed
+
+	def close(self):
+		pass
+
+
+class InotifySource:
+	#one inotify watch per directory that holds watched files
+	def __init__(self, paths: list):
+		import ctypes
+		import ctypes.util
+
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+		self.paths = set(paths)
+		self.directories = dict()
+		for directory in sorted({os.path.dirname(path) for path in self.paths}):
+			wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+			if wd < 0:
+				self.close()
+				raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+			self.directories[wd] = directory
+
+	@staticmethod
+	def available():
+		return sys.platform.startswith("linux")
+
+	def poll(self, timeout: float):
+		changed = set()
+		ready, _, _ = select.select([self.fd], [], [], timeout)
+		if not ready:
+			return changed
+		try:
+			data = os.read(self.fd, 1 << 16)
+		except BlockingIOError:
+			return changed
+		pos = 0
+		while pos + EVENT.size <= len(data):
+			wd, _mask, _cookie, length = EVENT.unpack_from(data, pos)
+			name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b"\0")
+			pos += EVENT.size + length
+			if wd in self.directories and name:
+				path = normalize(os.path.join(self.directories[wd], os.fsdecode(name)))
+				if path in self.paths:
+					changed.add(path)
+		return changed
+
+	def close(self):
+		if self.fd >= 0:
+			os.close(self.fd)
+			self.fd = -1
+
+
+def open_source(paths: list, polling = False, interval: float = 0.5):
+	if not polling and InotifySource.available():
+		try:
+			return InotifySource(paths)
+		except (OSError, AttributeError):
+			pass
+	return PollingSource(paths, interval)
+
+
+def _ignore_interrupt():
+	#ctrl+c is handled by the watcher, which lets running builds finish
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Watcher:
+	def __init__(
+			self, specs: list, workers: int = 2, debounce: float = 0.5, backend = "tools",
+			cache_dir = None, cache_size = DEFAULT_MAX_BYTES, polling = False, interval: float = 0.5,
+			report = None
+	):
+		self.specs = specs
+		self.workers = max(1, workers)
+		self.debounce = debounce
+		self.backend = backend
+		self.cache_dir = cache_dir
+		self.cache_size = cache_size
+		self.report = report
+
+		#frame path -> indices of the materials that use it
+		self.users = dict()
+		for i, spec in enumerate(specs):
+			for seq in spec.sequences:
+				for frame in seq.frames:
+					self.users.setdefault(normalize(frame), set()).add(i)
+		self.source = open_source(list(self.users), polling, interval)
+
+		self.queue = deque()
+		self.queued = set()
+		self.running = dict()  # future -> material index
+		self.dirty = set()  # materials that changed again while building
+		#material index -> crashes of its worker while it was built alone, since its last finished build
+		self.crashes = dict()
+		#materials whose build was lost with others in one crash, they are built alone until one finishes
+		self.suspects = set()
+		self.pool = None
+
+	def materials_for(self, paths: set):
+		result = set()
+		for path in paths:
+			result |= self.users.get(path, set())
+		return sorted(result)
+
+	def enqueue(self, materials):
+		running = set(self.running.values())
+		for i in materials:
+			if i in running:
+				self.dirty.add(i)
+			elif i not in self.queued:
+				self.queue.append(i)
+				self.queued.add(i)
+
+	def _new_pool(self):
+		return ProcessPoolExecutor(max_workers = self.workers, initializer = _ignore_interrupt)
+
+	def _restart_pool(self):
+		#a broken pool fails every build in it and refuses new ones
+		self.pool.shutdown(wait = True)
+		self.pool = self._new_pool()
+
+	def _start(self):
+		while self.queue and len(self.running) < self.workers:
+			i = self.queue[0]
+			if self.running and (i in self.suspects or self.suspects & set(self.running.values())):
+				return
+			try:
+				future = self.pool.submit(batch.build_one, self.specs[i], self.backend, self.cache_dir, self.cache_size)
+			except BrokenProcessPool:
+				#the builds that were running fail with it and are collected (and the pool replaced) next round
+				if not self.running:
+					self._restart_pool()
+				return
+			self.queue.popleft()
+			self.queued.discard(i)
+			self.running[future] = i
+
+	def _collect(self):
+		done = [x for x in self.running if x.done()]
+		lost = list()
+		if any(isinstance(x.exception(), BrokenProcessPool) for x in done):
+			#a worker died (out of memory, crash) and took the pool down, every build still in it is lost
+			self._restart_pool()
+			done = list(self.running)
+			lost = [self.running[x] for x in done]
+			if len(lost) > 1:
+				#which one crashed is unknown, building them alone tells
+				self.suspects.update(lost)
+		for future in done:
+			i = self.running.pop(future)
+			try:
+				result = future.result()
+				tracing.extend(result.trace_events)
+				self.crashes.pop(i, None)
+				self.suspects.discard(i)
+			except Exception as e:
+				if isinstance(e, BrokenProcessPool):
+					if len(lost) == 1:
+						self.crashes[i] = self.crashes.get(i, 0) + 1
+					if self.crashes.get(i, 0) <= WORKER_RETRIES:
+						self.dirty.discard(i)
+						self.enqueue([i])
+						continue
+				self.crashes.pop(i, None)
+				self.suspects.discard(i)
+				result = BuildResult(self.specs[i].name)
+				result.errors.append(BuildError("worker", f"Build worker died: {e}"))
+			if self.report:
+				self.report(result)
+			if i in self.dirty:
+				self.dirty.discard(i)
+				self.enqueue([i])
+
+	def run(self, stop: threading.Event = None):
+		#blocks until stop is set (or KeyboardInterrupt), rebuilding materials whose frames changed
+		pending = set()
+		last_change = 0.0
+		self.pool = self._new_pool()
+		try:
+			while stop is None or not stop.is_set():
+				changed = self.source.poll(0.1 if self.running or pending else 0.5)
+				now = time.monotonic()
+				if changed:
+					pending |= changed
+					last_change = now
+				if pending and now - last_change >= self.debounce:
+					self.enqueue(self.materials_for(pending))
+					pending.clear()
+				self._collect()
+				self._start()
+		finally:
+			self.source.close()
+			#lets running builds finish, like leaving the pool's with block did
+			self.pool.shutdown(wait = True)